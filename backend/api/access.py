@@ -0,0 +1,128 @@
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import LRUTTLCache
+from .models import Document, Workspace
+
+
+# (user_id, document_id) -> bool. Per process: invalidation below only
+# reaches this worker, other workers converge within ACCESS_CACHE_TTL.
+access_cache = LRUTTLCache(settings.ACCESS_CACHE_SIZE, settings.ACCESS_CACHE_TTL)
+
+
+def visible_to(user_id):
+    """Filter for documents a user can see
+    
+    Public documents need no per-user rows at all; workspace documents are
+    matched through the user's (few) memberships, and only restricted
+    documents consult the collaborators join table.
+    """
+    shared = Document.collaborators.through.objects.filter(
+        user_id=user_id
+    ).values('document_id')
+    workspaces = Workspace.members.through.objects.filter(
+        user_id=user_id
+    ).values('workspace_id')
+    return (
+        Q(owner_id=user_id)
+        | Q(visibility=Document.VISIBILITY_PUBLIC)
+        | Q(visibility=Document.VISIBILITY_WORKSPACE, workspace_id__in=workspaces)
+        | Q(id__in=shared)
+    )
+
+
+def visible_documents(user):
+    return Document.objects.filter(visible_to(user.id))
+
+
+def document_visible(user_id, field='document_id'):
+    """Correlated EXISTS for filtering other rows by their document
+    
+    Unlike ``document__in=<visible ids>`` this lets the database walk the
+    outer table's own ordering index and stop after a page of matches.
+    """
+    return Exists(Document.objects.filter(visible_to(user_id), pk=OuterRef(field)))
+
+
+def query_document_access(user_id, document_id):
+    """Single EXISTS query against the visibility rules"""
+    return Document.objects.filter(visible_to(user_id), pk=document_id).exists()
+
+
+def has_document_access(user, document_id):
+    """Can `user` open the document? Cached per (user, document)"""
+    if not user.is_authenticated:
+        return False
+    key = (user.id, int(document_id))
+    allowed = access_cache.get(key)
+    if allowed is None:
+        allowed = query_document_access(user.id, document_id)
+        access_cache.set(key, allowed)
+    return allowed
+
+
+async def ahas_document_access(user, document_id):
+    """Async variant that only hops to a DB thread on a cache miss"""
+    if not user.is_authenticated:
+        return False
+    key = (user.id, int(document_id))
+    allowed = access_cache.get(key)
+    if allowed is None:
+        allowed = await database_sync_to_async(query_document_access)(user.id, document_id)
+        access_cache.set(key, allowed)
+    return allowed
+
+
+def invalidate_document(document_id):
+    access_cache.delete_where(lambda key: key[1] == document_id)
+
+
+def invalidate_user(user_id):
+    access_cache.delete_where(lambda key: key[0] == user_id)
+
+
+@receiver(post_delete, sender=Document)
+def document_deleted(sender, instance, **kwargs):
+    invalidate_document(instance.pk)
+
+
+@receiver(post_delete, sender=Workspace)
+def workspace_deleted(sender, instance, **kwargs):
+    # Its documents were detached with a bulk UPDATE, which sends no signals
+    access_cache.clear()
+
+
+@receiver(post_save, sender=Document)
+def document_saved(sender, instance, created, **kwargs):
+    # Visibility or workspace may have changed; new documents have no entries
+    if not created:
+        invalidate_document(instance.pk)
+
+
+@receiver(m2m_changed, sender=Document.collaborators.through)
+def collaborators_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_document(instance.pk)
+    elif pk_set:
+        for document_id in pk_set:
+            access_cache.delete((instance.pk, document_id))
+    else:
+        invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=Workspace.members.through)
+def members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        invalidate_user(instance.pk)
+    elif pk_set:
+        for user_id in pk_set:
+            invalidate_user(user_id)
+    else:
+        access_cache.clear()
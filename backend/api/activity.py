@@ -0,0 +1,145 @@
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from .metrics import registry
+from .models import ActivityLog
+
+
+activity_queue_depth = registry.gauge(
+    'collabspace_activity_queue_depth',
+    'ActivityLog rows waiting for the background writer'
+)
+activity_dropped = registry.counter(
+    'collabspace_activity_dropped',
+    'ActivityLog rows dropped because the queue was full'
+)
+activity_flush_seconds = registry.histogram(
+    'collabspace_activity_flush_seconds',
+    'Time spent bulk-inserting one batch of ActivityLog rows'
+)
+activity_flush_rows = registry.counter(
+    'collabspace_activity_flush_rows',
+    'ActivityLog rows written by the background writer'
+)
+activity_flush_errors = registry.counter(
+    'collabspace_activity_flush_errors',
+    'ActivityLog rows that could not be written'
+)
+
+
+class ActivityLogWriter:
+    """Takes ActivityLog writes off the request path
+
+    `record` builds the row (timestamped now, not at insert time) and puts
+    it on a bounded queue; a daemon thread bulk-inserts it within
+    ACTIVITY_LOG_INTERVAL seconds, or as soon as ACTIVITY_LOG_BATCH_SIZE
+    rows are waiting. When the queue is full the caller either waits up to
+    ACTIVITY_LOG_BLOCK_TIMEOUT for room ('block') or the row is dropped
+    straight away ('drop'); dropped rows are counted. With
+    ACTIVITY_LOG_SYNC the row is saved inline instead.
+    """
+
+    def __init__(self):
+        self.queue = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+
+    def record(self, **fields):
+        entry = ActivityLog(timestamp=timezone.now(), **fields)
+        if settings.ACTIVITY_LOG_SYNC:
+            entry.save()
+            return
+        self.start()
+        try:
+            if settings.ACTIVITY_LOG_OVERFLOW == 'block':
+                self.queue.put(entry, timeout=settings.ACTIVITY_LOG_BLOCK_TIMEOUT)
+            else:
+                self.queue.put_nowait(entry)
+        except queue.Full:
+            activity_dropped.inc()
+            return
+        depth = self.queue.qsize()
+        activity_queue_depth.set(depth)
+        if depth >= settings.ACTIVITY_LOG_BATCH_SIZE:
+            self.wakeup.set()
+
+    def start(self):
+        """Start the writer thread on first use (and again after a fork)"""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            if self.queue is None:
+                self.queue = queue.Queue(maxsize=settings.ACTIVITY_LOG_QUEUE_SIZE)
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name='activity-log-writer', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stopping.is_set():
+                self.wakeup.wait(settings.ACTIVITY_LOG_INTERVAL)
+                self.wakeup.clear()
+                close_old_connections()
+                self.drain()
+        finally:
+            connection.close()
+
+    def take(self):
+        batch = []
+        while len(batch) < settings.ACTIVITY_LOG_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        activity_queue_depth.set(self.queue.qsize())
+        return batch
+
+    def drain(self):
+        """Write everything queued so far, one batch at a time"""
+        if self.queue is None:
+            return
+        batch = self.take()
+        while batch:
+            self.write(batch)
+            batch = self.take()
+
+    def write(self, batch):
+        start = time.perf_counter()
+        try:
+            ActivityLog.objects.bulk_create(batch)
+        except Exception:
+            # Most likely a document was deleted while its rows were queued;
+            # keep the rest of the batch
+            written = 0
+            for entry in batch:
+                try:
+                    entry.save()
+                    written += 1
+                except Exception as e:
+                    activity_flush_errors.inc()
+                    print(f"Error writing activity '{entry.action}' for document {entry.document_id}: {e}")
+            activity_flush_rows.inc(written)
+            return
+        activity_flush_seconds.observe(time.perf_counter() - start)
+        activity_flush_rows.inc(len(batch))
+
+    def flush_sync(self):
+        """Stop the writer and write whatever is still queued, for shutdown"""
+        thread = self.thread
+        if thread is not None:
+            self.stopping.set()
+            self.wakeup.set()
+            thread.join(timeout=10)
+        self.drain()
+
+
+activity_log = ActivityLogWriter()
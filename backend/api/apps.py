@@ -1,6 +1,20 @@
+import atexit
+
 from django.apps import AppConfig
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import access  # noqa: F401 - connects cache invalidation signals
+        from . import instrumentation  # noqa: F401 - instruments DB connections
+        from .activity import activity_log
+        from .session import document_sessions
+        from .writebehind import edit_queue
+
+        # Don't lose write-behind state when the worker is stopped
+        atexit.register(document_sessions.flush_all_sync)
+        atexit.register(edit_queue.flush_sync)
+        atexit.register(activity_log.flush_sync)
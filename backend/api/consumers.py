@@ -1,8 +1,23 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Document, DocumentEdit, ActivityLog
+from .access import ahas_document_access
+from .dashboard import PUBLIC_GROUP, user_group, workspace_group
+from .instrumentation import (
+    dashboard_sockets, edits_applied, edits_rejected, group_send, handler_errors,
+    handler_seconds, message_label, room_sockets
+)
+from .locks import LockedError
+from .models import DocumentEdit
+from .ot import Operation, StaleVersionError
+from .presence import cursor_ticker, presence
+from .session import SessionMovedError
+from .sharding import ShardUnavailableError, shard_router
+from . import wire
+from .writebehind import edit_queue
 import time
 
 
@@ -16,32 +31,29 @@ class DashboardConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        # Join personal dashboard group
-        self.dashboard_group = f'dashboard_{self.user.id}'
-        await self.channel_layer.group_add(
-            self.dashboard_group,
-            self.channel_name
-        )
-        
-        # Join global documents group
-        await self.channel_layer.group_add(
-            'documents_global',
-            self.channel_name
-        )
+        # Personal group, the public-documents group and one per workspace;
+        # document events are only sent to the groups that can see them
+        self.dashboard_groups = [
+            user_group(self.user.id),
+            PUBLIC_GROUP,
+            *[workspace_group(workspace_id) for workspace_id in await self.get_workspace_ids()]
+        ]
+        for group in self.dashboard_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
         
         await self.accept()
+        dashboard_sockets.inc()
         print(f'Dashboard WebSocket connected for user {self.user.username}')
     
     async def disconnect(self, close_code):
-        if hasattr(self, 'dashboard_group'):
-            await self.channel_layer.group_discard(
-                self.dashboard_group,
-                self.channel_name
-            )
-        await self.channel_layer.group_discard(
-            'documents_global',
-            self.channel_name
-        )
+        if hasattr(self, 'dashboard_groups'):
+            dashboard_sockets.dec()
+        for group in getattr(self, 'dashboard_groups', []):
+            await self.channel_layer.group_discard(group, self.channel_name)
+    
+    @database_sync_to_async
+    def get_workspace_ids(self):
+        return list(self.user.workspaces.values_list('id', flat=True))
     
     # Event handlers
     async def document_created(self, event):
@@ -57,10 +69,292 @@ class DashboardConsumer(AsyncWebsocketConsumer):
             'document_id': event['document_id'],
             'title': event['title']
         }))
+    
+    async def upload_progress(self, event):
+        """Background upload events (see api.uploads) go out as they are"""
+        await self.send(text_data=json.dumps(event))
+
+    upload_complete = upload_progress
+    upload_failed = upload_progress
+
+    async def workspace_joined(self, event):
+        """Start receiving a workspace's events without reconnecting"""
+        group = workspace_group(event['workspace_id'])
+        if group not in self.dashboard_groups:
+            self.dashboard_groups.append(group)
+            await self.channel_layer.group_add(group, self.channel_name)
 
 
-class DocumentConsumer(AsyncWebsocketConsumer):
-    """WebSocket consumer for real-time document collaboration"""
+class SessionMessageHandlers:
+    """Edit, batch and lock messages applied to a document's live session
+    
+    These run on the worker that owns the document (see api.sharding):
+    in DocumentConsumer for its own sockets, and in ForwardedMessage for
+    messages other workers pass on. Users of the mixin provide `session`,
+    `user`, `channel_name`, `room_group_name`, `channel_layer`,
+    `send_payload` and `reroute`, which re-sends a message once the
+    session has moved to another worker.
+    """
+    
+    async def handle_session_message(self, data):
+        message_type = data.get('type')
+        if message_type == 'edit':
+            await self.handle_edit(data)
+        elif message_type == 'edits':
+            await self.handle_edits(data)
+        elif message_type == 'lock':
+            await self.handle_lock(data)
+        elif message_type == 'resync':
+            await self.send_resync()
+        await self.announce_lapsed_locks()
+    
+    async def handle_edit(self, data):
+        """Rebase an edit onto the live document, ack it and broadcast it
+        
+        The ack carries the version the edit produced, which is the
+        client's base version for its next op.
+        """
+        try:
+            op = Operation.from_edit(
+                data.get('operation'),  # 'insert', 'delete', 'replace'
+                data.get('position'),
+                data.get('content', ''),
+                data.get('length', 1)
+            )
+            timestamp = time.time()
+            
+            # Transform against the ops since the client's base version and
+            # apply in memory; Postgres only sees the write-behind flush
+            try:
+                op, version = await self.router.sessions.apply_edit(
+                    self.session, op, data.get('version'), self.user.id
+                )
+            except StaleVersionError:
+                await self.send_resync()
+                return
+            except LockedError as e:
+                await self.reject_edit(e.lock)
+                return
+            except SessionMovedError:
+                await self.reroute(data)
+                return
+            
+            await self.send_payload({'type': 'ack', 'version': version})
+            
+            # Queue the edit row for the batched write-behind insert
+            edits_applied.inc()
+            self.queue_edit_rows([op], version)
+            
+            # Broadcast to everyone else in the room
+            await self.broadcast({
+                'type': 'edit',
+                'user': self.user.username,
+                'operation': op.operation,
+                'position': op.position,
+                'length': op.length,
+                'content': op.text,
+                'timestamp': timestamp,
+                'version': version
+            }, skip_self=True)
+        except Exception as e:
+            handler_errors.labels('edit').inc()
+            print(f"Error in handle_edit: {e}")
+            import traceback
+            traceback.print_exc()
+    
+    async def handle_edits(self, data):
+        """Apply an ordered batch of ops atomically and ack it once
+        
+        Clients tag each batch with their own op_id; a retransmitted batch
+        is acked again with its original version but not re-applied.
+        """
+        try:
+            op_id = data.get('op_id')
+            ops = [
+                Operation.from_edit(
+                    op.get('operation'),
+                    op.get('position'),
+                    op.get('content', ''),
+                    op.get('length', 1)
+                )
+                for op in data.get('ops', [])
+            ]
+            timestamp = time.time()
+            
+            try:
+                applied, version = await self.router.sessions.apply_edits(
+                    self.session,
+                    ops,
+                    data.get('version'),
+                    (self.user.id, op_id) if op_id is not None else None,
+                    self.user.id
+                )
+            except StaleVersionError:
+                await self.send_resync()
+                return
+            except LockedError as e:
+                await self.reject_edit(e.lock, op_id)
+                return
+            except SessionMovedError:
+                await self.reroute(data)
+                return
+            
+            await self.send_payload({'type': 'ack', 'op_id': op_id, 'version': version})
+            if not applied:
+                return
+            
+            edits_applied.inc(len(applied))
+            self.queue_edit_rows(applied, version)
+            
+            await self.broadcast({
+                'type': 'edits',
+                'user': self.user.username,
+                'ops': [
+                    {
+                        'operation': op.operation,
+                        'position': op.position,
+                        'length': op.length,
+                        'content': op.text
+                    }
+                    for op in applied
+                ],
+                'timestamp': timestamp,
+                'version': version
+            }, skip_self=True)
+        except Exception as e:
+            handler_errors.labels('edits').inc()
+            print(f"Error in handle_edits: {e}")
+            import traceback
+            traceback.print_exc()
+    
+    def queue_edit_rows(self, ops, version):
+        """Queue DocumentEdit rows for ops that ended at `version`"""
+        first_version = version - len(ops) + 1
+        for offset, op in enumerate(ops):
+            edit_queue.enqueue(DocumentEdit(
+                document_id=self.session.document_id,
+                user=self.user,
+                operation=op.operation,
+                position=op.position,
+                length=op.length,
+                content=op.text,
+                version=first_version + offset,
+                applied=True
+            ))
+    
+    async def reject_edit(self, lock, op_id=None):
+        """Tell the client its edit hit someone's lock and roll it back"""
+        edits_rejected.inc()
+        payload = {'type': 'edit_rejected', 'user': lock.user, **lock.as_event()}
+        if op_id is not None:
+            payload['op_id'] = op_id
+        await self.send_payload(payload)
+        await self.send_resync()
+    
+    async def send_resync(self):
+        """Send the full live document to a client that joined, asked or fell too far behind"""
+        content, version = self.session.snapshot()
+        await self.send_payload({
+            'type': 'resync',
+            'content': content,
+            'version': version
+        })
+    
+    async def broadcast(self, payload, skip_self=False):
+        """Encode a frame once per protocol and fan it out to the room as-is"""
+        await group_send(
+            self.channel_layer,
+            self.room_group_name,
+            {
+                'type': 'room_frame',
+                'skip_channel': self.channel_name if skip_self else None,
+                **wire.frame(payload)
+            }
+        )
+    
+    async def handle_lock(self, data):
+        """Grant, renew or release a leased lock on a range of the document
+        
+        The range is `position`/`length` at the client's `version`. Granted
+        locks are announced to the whole room, requester included, with
+        the range rebased to the current version; a taken range is only
+        answered with `lock_denied`. Re-sending a held section renews its
+        lease for LOCK_LEASE_SECONDS.
+        """
+        section = data.get('section')
+        try:
+            if not data.get('locked', False):
+                lock = self.session.release_lock(self.channel_name, section)
+                if lock is not None:
+                    await self.broadcast_unlock(lock)
+                return
+            
+            op = Operation.from_edit('delete', data.get('position'), length=data.get('length', 0))
+            lock, conflict, version = self.session.acquire_lock(
+                self.channel_name, self.user.id, self.user.username, section, op, data.get('version')
+            )
+        except StaleVersionError:
+            await self.send_resync()
+            return
+        except SessionMovedError:
+            await self.reroute(data)
+            return
+        
+        # Expired leases pruned while looking go out before the answer
+        await self.announce_lapsed_locks()
+        if lock is None:
+            denied = {'type': 'lock_denied', 'section': section, 'version': version}
+            if conflict is not None:
+                # Who holds the range, under which section and where
+                denied.update(
+                    user=conflict.user,
+                    held_section=conflict.section,
+                    position=conflict.start,
+                    length=conflict.length
+                )
+            await self.send_payload(denied)
+            return
+        
+        await self.broadcast({
+            'type': 'lock',
+            'user': self.user.username,
+            'user_id': self.user.id,
+            'locked': True,
+            **lock.as_event(),
+            'version': version,
+            'lease': settings.LOCK_LEASE_SECONDS
+        })
+    
+    async def broadcast_unlock(self, lock):
+        await self.broadcast(lock.unlock_event())
+    
+    async def announce_lapsed_locks(self):
+        """Unlock the locks the session dropped on its own (expired, deleted)"""
+        if self.session is not None:
+            for lock in self.session.take_lapsed_locks():
+                await self.broadcast_unlock(lock)
+
+
+class DocumentConsumer(SessionMessageHandlers, AsyncWebsocketConsumer):
+    """WebSocket consumer for real-time document collaboration
+    
+    Edits and locks are applied to the session on the worker that owns the
+    document: here, or forwarded to the owner by the shard router. While
+    moving to a new owner after a rebalance, messages are held back until
+    everything sent through the old one has landed.
+    """
+    
+    session = None
+    owner = None
+    joined = None
+    queued = None
+    switches = 0
+    drain_timer = None
+    
+    def __init__(self, *args, router=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # as_asgi(router=...) runs several workers' routers in one process
+        self.router = router or shard_router
     
     async def connect(self):
         self.document_id = self.scope['url_route']['kwargs']['document_id']
@@ -72,277 +366,294 @@ class DocumentConsumer(AsyncWebsocketConsumer):
             return
         
         # Check if user has access to document
-        has_access = await self.check_document_access()
+        has_access = await ahas_document_access(self.user, self.document_id)
         if not has_access:
             await self.close()
             return
         
+        # Load (or attach to) the in-memory session if this worker owns
+        # the document; otherwise join the owner's once we're accepted
+        try:
+            await self.router.start()
+        except ShardUnavailableError as e:
+            print(f"Refusing document {self.document_id} socket: {e}")
+            await self.close()
+            return
+        self.owner = self.router.owner(self.document_id)
+        if self.owner == self.router.worker_id:
+            self.session = await self.router.session_for(self.document_id, connect=True)
+            if self.session is None:
+                await self.close()
+                return
+        
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         
-        await self.accept()
+        # MessagePack if the client offers it, JSON otherwise
+        self.protocol = wire.negotiate(self.scope.get('subprotocols', []))
+        self.binary = self.protocol == wire.MSGPACK_PROTOCOL
+        await self.accept(subprotocol=self.protocol)
+        room_sockets.labels(self.document_id).inc()
         
-        # Notify others about new user
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
+        self.router.attach(self.document_id, self.channel_name)
+        # Start the client from the live body and version: the REST read
+        # it loaded may already be behind, or from another worker
+        if self.session is None:
+            await self.attach_session(resync=True)
+        else:
+            await self.send_resync()
+        
+        # One snapshot of who is already here, instead of replaying joins
+        users, first = await presence.join(
+            self.room_group_name, self.channel_name, self.user.id, self.user.username
+        )
+        self.heartbeat_due = time.monotonic() + settings.PRESENCE_HEARTBEAT_INTERVAL / 2
+        await self.send_payload({'type': 'presence', 'users': users})
+        
+        # Notify others about new user (once, however many tabs they open)
+        if first:
+            await self.broadcast({
                 'type': 'user_joined',
                 'user': self.user.username,
                 'user_id': self.user.id
-            }
-        )
+            })
     
     async def disconnect(self, close_code):
+        if hasattr(self, 'protocol'):
+            sockets = room_sockets.labels(self.document_id)
+            sockets.dec()
+            if sockets.value <= 0:
+                room_sockets.remove(self.document_id)
+        
         if hasattr(self, 'room_group_name'):
-            # Notify others about user leaving
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
+            # Notify others once the user's last connection has gone
+            if await presence.leave(self.room_group_name, self.channel_name) is not None:
+                cursor_ticker.remove(self.room_group_name, self.user.id)
+                await self.broadcast({
                     'type': 'user_left',
                     'user': self.user.username,
                     'user_id': self.user.id
-                }
-            )
+                })
             
             # Leave room group
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
             )
+        
+        if self.owner is not None:
+            self.router.detach(self.document_id, self.channel_name)
+        if self.session is not None and self.session.moved_to is None:
+            # Hand this connection's section locks back to the room
+            for lock in self.session.release_locks(self.channel_name):
+                await self.broadcast_unlock(lock)
+            await edit_queue.flush(self.session.document_id)
+            await self.router.sessions.close(self.document_id)
+        elif self.session is not None or self.joined is not None:
+            # The owner releases our locks (and our place, if we joined)
+            owner = self.session.moved_to if self.session is not None else self.owner
+            await self.router.send(
+                owner, 'leave', self.document_id, self.channel_name, joined=self.joined == owner
+            )
+        self.session = None
+        if self.drain_timer is not None:
+            self.drain_timer.cancel()
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming WebSocket messages"""
+        start = time.perf_counter()
+        message_type = None
         try:
-            data = json.loads(text_data)
+            if bytes_data is not None:
+                data = wire.unpack(bytes_data)
+            else:
+                data = wire.loads(text_data)
             message_type = data.get('type')
             
-            if message_type == 'edit':
-                await self.handle_edit(data)
+            # Any message proves we're alive; refresh presence at most
+            # twice per heartbeat interval
+            now = time.monotonic()
+            if message_type == 'heartbeat' or now >= self.heartbeat_due:
+                self.heartbeat_due = now + settings.PRESENCE_HEARTBEAT_INTERVAL / 2
+                await presence.touch(self.room_group_name, self.channel_name)
+            
+            if message_type in ('edit', 'edits', 'lock', 'resync'):
+                await self.route(data)
             elif message_type == 'cursor':
                 await self.handle_cursor_position(data)
-            elif message_type == 'lock':
-                await self.handle_lock(data)
         except Exception as e:
+            handler_errors.labels(message_label(message_type)).inc()
             print(f"Error in receive: {e}")
             import traceback
             traceback.print_exc()
+        finally:
+            if settings.METRICS_ENABLED:
+                handler_seconds.labels(message_label(message_type)).observe(
+                    time.perf_counter() - start
+                )
     
-    async def handle_edit(self, data):
-        """Handle document edit with conflict resolution"""
-        try:
-            operation = data.get('operation')  # 'insert', 'delete', 'replace'
-            position = data.get('position')
-            content = data.get('content', '')
-            version = data.get('version')
-            timestamp = time.time()
-            
-            # Save edit to database for conflict resolution
-            await self.save_edit(operation, position, content)
-            
-            # Get current document version
-            current_version = await self.get_document_version()
-            
-            # Check for conflicts
-            if version and version < current_version:
-                # Conflict detected - apply operational transformation
-                transformed_data = await self.resolve_conflict(data)
-                data.update(transformed_data)
-            
-            # Update document
-            await self.update_document(data)
-            
-            # Broadcast to all users in the room
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'document_edit',
-                    'user': self.user.username,
-                    'user_id': self.user.id,
-                    'operation': operation,
-                    'position': position,
-                    'content': content,
-                    'timestamp': timestamp,
-                    'version': current_version + 1
-                }
+    async def route(self, data):
+        """Apply a session message here or send it to the owning worker"""
+        await self.follow_owner()
+        if self.queued is not None:
+            self.queued.append(data)
+        elif self.session is not None:
+            await self.handle_session_message(data)
+        else:
+            await self.router.send(
+                self.owner, 'op', self.document_id, self.channel_name,
+                user_id=self.user.id, user=self.user.username, data=data
             )
-        except Exception as e:
-            print(f"Error in handle_edit: {e}")
-            import traceback
-            traceback.print_exc()
     
-    async def handle_cursor_position(self, data):
-        """Broadcast cursor position to other users"""
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'cursor_update',
-                'user': self.user.username,
-                'user_id': self.user.id,
-                'position': data.get('position')
-            }
-        )
+    async def reroute(self, data):
+        # Our local session was handed off under us
+        await self.route(data)
     
-    async def handle_lock(self, data):
-        """Handle document locking mechanism"""
-        await self.channel_layer.group_send(
+    async def follow_owner(self):
+        """Move to the document's new owner after the ring changed"""
+        if self.session is not None:
+            if self.session.moved_to is None:
+                return
+            # Our ops were all applied before the handoff; none in flight
+            self.owner = self.router.owner(self.document_id)
+            self.switches += 1
+            self.session = None
+            await self.attach_session(resync=False)
+            return
+        owner = self.router.owner(self.document_id)
+        if owner == self.owner:
+            return
+        previous, self.owner = self.owner, owner
+        self.switches += 1
+        if previous is not None and self.router.is_alive(previous):
+            # Hold new messages until what we sent the old owner has landed
+            self.queued = []
+            await self.router.send(
+                previous, 'drain', self.document_id, self.channel_name, switch=self.switches
+            )
+            # The marker may wait out a handoff at the new owner first
+            self.drain_timer = asyncio.get_running_loop().call_later(
+                settings.SHARD_HANDOFF_TIMEOUT * 2,
+                self._drain_timed_out,
+                self.switches
+            )
+        else:
+            # The old owner died along with anything it hadn't flushed
+            await self.attach_session(resync=True)
+    
+    def _drain_timed_out(self, switch):
+        asyncio.get_running_loop().create_task(self.channel_layer.send(
+            self.channel_name, {'type': 'shard.drained', 'switch': switch, 'timed_out': True}
+        ))
+    
+    async def attach_session(self, resync):
+        """Open the owner's session here, or join it on the owning worker"""
+        if self.owner == self.router.worker_id:
+            self.session = await self.router.session_for(self.document_id, connect=True)
+            if resync and self.session is not None:
+                await self.send_resync()
+        else:
+            await self.router.send(
+                self.owner, 'join', self.document_id, self.channel_name, resync=resync
+            )
+            self.joined = self.owner
+    
+    async def send_payload(self, payload):
+        """Encode and send a frame to this client only"""
+        if self.binary:
+            await self.send(bytes_data=wire.pack(payload))
+        else:
+            await self.send(text_data=wire.dumps(payload))
+    
+    async def send_frame(self, event):
+        """Forward a frame that was pre-encoded by the sender"""
+        if self.binary:
+            await self.send(bytes_data=event['bytes'])
+        else:
+            await self.send(text_data=event['text'])
+    
+    async def handle_cursor_position(self, data):
+        """Record the cursor; the room's ticker broadcasts it on the next tick"""
+        cursor_ticker.update(
             self.room_group_name,
-            {
-                'type': 'lock_update',
-                'user': self.user.username,
-                'user_id': self.user.id,
-                'locked': data.get('locked', False),
-                'section': data.get('section')
-            }
+            self.user.id,
+            self.user.username,
+            data.get('position')
         )
     
     # WebSocket message handlers
-    async def user_joined(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_joined',
-            'user': event['user'],
-            'user_id': event['user_id']
-        }))
+    async def shard_rebalanced(self, event):
+        await self.follow_owner()
     
-    async def user_left(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_left',
-            'user': event['user'],
-            'user_id': event['user_id']
-        }))
+    async def shard_drained(self, event):
+        """Everything sent through the old owner has landed; send the rest"""
+        if self.queued is None or event['switch'] != self.switches:
+            return
+        self.drain_timer.cancel()
+        self.drain_timer = None
+        queued, self.queued = self.queued, None
+        if event.get('timed_out'):
+            # The client gets the owner's state; what it sent meanwhile is dropped
+            await self.attach_session(resync=True)
+            return
+        await self.attach_session(resync=False)
+        for data in queued:
+            await self.route(data)
     
-    async def document_edit(self, event):
-        # Don't send back to the same user
-        if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'edit',
-                'user': event['user'],
-                'operation': event['operation'],
-                'position': event['position'],
-                'content': event['content'],
-                'timestamp': event['timestamp'],
-                'version': event['version']
-            }))
-    
-    async def cursor_update(self, event):
-        if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'cursor',
-                'user': event['user'],
-                'position': event['position']
-            }))
-    
-    async def lock_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'lock',
-            'user': event['user'],
-            'locked': event['locked'],
-            'section': event['section']
-        }))
+    async def shard_bounced(self, event):
+        """Workers disagreed on the owner and dropped a message; start over"""
+        if self.drain_timer is not None:
+            self.drain_timer.cancel()
+            self.drain_timer = None
+        self.queued = None
+        self.owner = None
+        await self.follow_owner()
     
-    # Database operations
-    @database_sync_to_async
-    def check_document_access(self):
-        """Check if user has access to document"""
-        try:
-            document = Document.objects.get(id=self.document_id)
-            return document.owner == self.user or self.user in document.collaborators.all()
-        except Document.DoesNotExist:
-            return False
+    async def presence_expired(self, event):
+        """The presence sweep dropped this socket: it went quiet for PRESENCE_TTL"""
+        await self.close()
     
-    @database_sync_to_async
-    def save_edit(self, operation, position, content):
-        """Save edit to database"""
-        try:
-            document = Document.objects.get(id=self.document_id)
-            DocumentEdit.objects.create(
-                document=document,
-                user=self.user,
-                operation=operation,
-                position=position,
-                content=content,
-                applied=True
-            )
-        except Document.DoesNotExist:
-            pass
+    async def room_frame(self, event):
+        # Frames arrive pre-encoded; only drop this socket's own echoes
+        # (the user's other tabs still need them)
+        if event['skip_channel'] != self.channel_name:
+            await self.send_frame(event)
     
-    @database_sync_to_async
-    def get_document_version(self):
-        """Get current document version"""
-        try:
-            document = Document.objects.get(id=self.document_id)
-            return document.version
-        except Document.DoesNotExist:
-            return 0
+    async def cursor_frame(self, event):
+        if any(cursor['user_id'] == self.user.id for cursor in event['cursors']):
+            # We moved this tick too: re-encode without our own cursor
+            cursors = [
+                {'user': cursor['user'], 'position': cursor['position']}
+                for cursor in event['cursors']
+                if cursor['user_id'] != self.user.id
+            ]
+            if cursors:
+                await self.send_payload({'type': 'cursors', 'cursors': cursors})
+        else:
+            await self.send_frame(event)
+
+
+class ForwardedMessage(SessionMessageHandlers):
+    """A socket's message another worker forwarded to the document's owner
     
-    @database_sync_to_async
-    def update_document(self, data):
-        """Update document content"""
-        try:
-            document = Document.objects.get(id=self.document_id)
-            operation = data['operation']
-            position = data['position']
-            content = data['content']
-            
-            # Simple operational transformation
-            if operation == 'insert':
-                document.content = (
-                    document.content[:position] + 
-                    content + 
-                    document.content[position:]
-                )
-            elif operation == 'delete':
-                length = data.get('length', 1)
-                document.content = (
-                    document.content[:position] + 
-                    document.content[position + length:]
-                )
-            elif operation == 'replace':
-                length = data.get('length', 1)
-                document.content = (
-                    document.content[:position] + 
-                    content + 
-                    document.content[position + length:]
-                )
-            
-            document.version += 1
-            document.save()
-        except Document.DoesNotExist:
-            pass
+    Replies go straight to the socket's channel as pre-encoded frames;
+    broadcasts go to the room as usual. Created by api.sharding.
+    """
     
-    @database_sync_to_async
-    def resolve_conflict(self, data):
-        """Apply operational transformation for conflict resolution"""
-        try:
-            document = Document.objects.get(id=self.document_id)
-            # Get timestamp from data - it's already a number (time.time())
-            data_timestamp = data.get('timestamp', 0)
-            
-            # Get edits that happened after the user's edit (using numeric timestamp)
-            newer_edits = DocumentEdit.objects.filter(
-                document=document,
-                applied=True
-            ).order_by('timestamp')
-            
-            # Transform position based on newer edits
-            position = data['position']
-            for edit in newer_edits:
-                # Convert edit timestamp to float for comparison if it's a string
-                edit_timestamp = float(edit.timestamp.timestamp()) if hasattr(edit.timestamp, 'timestamp') else float(edit.timestamp)
-                
-                if edit_timestamp > data_timestamp:
-                    if edit.operation == 'insert' and edit.position <= position:
-                        position += len(edit.content)
-                    elif edit.operation == 'delete' and edit.position < position:
-                        position -= 1
-            
-            return {'position': position}
-        except Document.DoesNotExist:
-            return {}
-        except Exception as e:
-            print(f"Error in resolve_conflict: {e}")
-            import traceback
-            traceback.print_exc()
-            return {}
+    def __init__(self, router, session, message, channel_layer):
+        self.router = router
+        self.session = session
+        self.message = message
+        self.channel_layer = channel_layer
+        self.channel_name = message['origin']
+        self.room_group_name = f'document_{session.document_id}'
+        self.user = User(id=message.get('user_id'), username=message.get('user', ''))
+    
+    async def send_payload(self, payload):
+        await self.channel_layer.send(self.channel_name, {'type': 'send_frame', **wire.frame(payload)})
+    
+    async def reroute(self, data):
+        await self.router.forward(self.channel_layer, self.message)
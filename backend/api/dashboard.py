@@ -0,0 +1,67 @@
+import asyncio
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .instrumentation import group_send
+from .models import Document
+
+
+PUBLIC_GROUP = 'dashboard_public'
+
+
+def user_group(user_id):
+    return f'dashboard_{user_id}'
+
+
+def workspace_group(workspace_id):
+    return f'dashboard_workspace_{workspace_id}'
+
+
+def document_audience(document, user_ids=None):
+    """Dashboard groups that should hear about `document`
+
+    Public documents go to the one group every dashboard joins, workspace
+    documents to their workspace's group, and explicit collaborators that
+    the visibility doesn't already cover to their own dashboard group.
+    Pass `user_ids` to notify just those users (e.g. newly shared ones).
+    """
+    if user_ids is not None:
+        return [user_group(user_id) for user_id in user_ids]
+    if document.visibility == Document.VISIBILITY_PUBLIC:
+        return [PUBLIC_GROUP]
+
+    collaborators = document.collaborators.all()
+    groups = [user_group(document.owner_id)]
+    if document.visibility == Document.VISIBILITY_WORKSPACE and document.workspace_id:
+        groups = [workspace_group(document.workspace_id)]
+        collaborators = collaborators.exclude(workspaces=document.workspace_id)
+    groups.extend(
+        user_group(user_id)
+        for user_id in collaborators.values_list('id', flat=True)
+        if user_id != document.owner_id
+    )
+    return groups
+
+
+async def fan_out(groups, event):
+    """group_send to many groups, DASHBOARD_FANOUT_BATCH_SIZE at a time"""
+    channel_layer = get_channel_layer()
+    size = settings.DASHBOARD_FANOUT_BATCH_SIZE
+    for start in range(0, len(groups), size):
+        await asyncio.gather(*(
+            group_send(channel_layer, group, event)
+            for group in groups[start:start + size]
+        ))
+
+
+def notify(document, event_type, user_ids=None):
+    """Send a dashboard event about `document` from synchronous code"""
+    groups = document_audience(document, user_ids)
+    if groups:
+        async_to_sync(fan_out)(groups, {
+            'type': event_type,
+            'document_id': document.id,
+            'title': document.title
+        })
@@ -0,0 +1,142 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .metrics import registry
+
+
+# Hot-path metrics for the consumers, the channel layer, the database and
+# the REST views. Recording is a perf_counter pair and a histogram add;
+# METRICS_ENABLED = False turns all of it off.
+
+# Message types DocumentConsumer handles; anything else is labelled
+# 'unknown' so clients can't create label values
+MESSAGE_TYPES = frozenset(('edit', 'edits', 'cursor', 'lock', 'heartbeat', 'resync'))
+
+
+def message_label(message_type):
+    if isinstance(message_type, str) and message_type in MESSAGE_TYPES:
+        return message_type
+    return 'unknown'
+
+
+handler_seconds = registry.histogram(
+    'collabspace_ws_handler_seconds',
+    'Time DocumentConsumer.receive spends on one message, by message type',
+    ['type'],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+)
+handler_errors = registry.counter(
+    'collabspace_ws_handler_errors',
+    'Document socket messages whose handler raised, by message type',
+    ['type']
+)
+group_send_seconds = registry.histogram(
+    'collabspace_group_send_seconds',
+    'Channel layer group_send latency, by event type',
+    ['event'],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+)
+room_sockets = registry.gauge(
+    'collabspace_room_sockets',
+    'Document sockets connected to this worker, by document',
+    ['document']
+)
+dashboard_sockets = registry.gauge(
+    'collabspace_dashboard_sockets',
+    'Dashboard sockets connected to this worker'
+)
+edits_applied = registry.counter(
+    'collabspace_edits_applied',
+    'Edit ops applied to live document sessions'
+)
+edits_rejected = registry.counter(
+    'collabspace_edits_rejected',
+    'Edit messages rejected because they touched another user\'s section lock'
+)
+db_queries = registry.counter(
+    'collabspace_db_queries',
+    'Database queries, by the code path that issued them',
+    ['scope']
+)
+db_query_seconds = registry.histogram(
+    'collabspace_db_query_seconds',
+    'Database query time, by the code path that issued them',
+    ['scope']
+)
+http_request_seconds = registry.histogram(
+    'collabspace_http_request_seconds',
+    'REST request latency, by view, method and status class',
+    ['view', 'method', 'status']
+)
+
+# What the current query is being run for. Edits hit the database only in
+# the 'edit_flush' and 'session_flush' scopes, so DB work per edit is
+# rate(collabspace_db_queries_total{scope=~".*_flush"}) over
+# rate(collabspace_edits_applied_total).
+_db_scope = contextvars.ContextVar('db_scope', default='other')
+
+
+@contextmanager
+def db_scope(scope):
+    """Attribute queries run inside the block to `scope`"""
+    token = _db_scope.set(scope)
+    try:
+        yield
+    finally:
+        _db_scope.reset(token)
+
+
+def count_query(execute, sql, params, many, context):
+    """Connection execute wrapper feeding collabspace_db_queries"""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        scope = _db_scope.get()
+        db_queries.labels(scope).inc()
+        db_query_seconds.labels(scope).observe(time.perf_counter() - start)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # Wrappers live on the DatabaseWrapper, which outlives reconnects
+    if settings.METRICS_ENABLED and count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+async def group_send(channel_layer, group, message):
+    """channel_layer.group_send, timed by the event's type"""
+    if not settings.METRICS_ENABLED:
+        await channel_layer.group_send(group, message)
+        return
+    start = time.perf_counter()
+    try:
+        await channel_layer.group_send(group, message)
+    finally:
+        group_send_seconds.labels(message['type']).observe(time.perf_counter() - start)
+
+
+class RequestMetricsMiddleware:
+    """Records REST request latency by resolved view name"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        start = time.perf_counter()
+        with db_scope('http'):
+            response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        http_request_seconds.labels(
+            match.view_name if match is not None else 'unmatched',
+            request.method,
+            f'{response.status_code // 100}xx'
+        ).observe(time.perf_counter() - start)
+        return response
@@ -0,0 +1,215 @@
+import time
+from bisect import bisect_right
+from itertools import islice
+
+from django.conf import settings
+
+
+class LockedError(Exception):
+    """An edit touches a range locked by another user"""
+
+    def __init__(self, lock):
+        super().__init__(f'Section {lock.section!r} is locked by {lock.user}')
+        self.lock = lock
+
+
+class SectionLock:
+    __slots__ = ('channel', 'user_id', 'user', 'section', 'start', 'end', 'expires')
+
+    def __init__(self, channel, user_id, user, section, start, end, expires):
+        self.channel = channel
+        self.user_id = user_id
+        self.user = user
+        self.section = section
+        self.start = start
+        self.end = end
+        self.expires = expires
+
+    @property
+    def length(self):
+        return self.end - self.start
+
+    def as_event(self):
+        return {'section': self.section, 'position': self.start, 'length': self.length}
+
+    def unlock_event(self):
+        """The `lock` frame telling the room this lock is gone"""
+        return {
+            'type': 'lock',
+            'user': self.user,
+            'user_id': self.user_id,
+            'locked': False,
+            'section': self.section
+        }
+
+
+def _end(lock):
+    return lock.end
+
+
+def _map(x, op, absorb):
+    """Where offset `x` lands after `op`; `absorb` puts inserted text before it"""
+    if x < op.position:
+        return x
+    if x <= op.end:
+        return op.position + (len(op.text) if absorb else 0)
+    return x - op.length + len(op.text)
+
+
+class SectionLocks:
+    """Leased range locks on one document's text
+
+    Granted locks never overlap, so kept in document order both their
+    starts and their ends are sorted, and the locks touching a range are
+    found by bisecting on `end` (O(log n) plus the hits). Applied ops
+    move the ranges along with the text (`shift`), which touches only the
+    locks after the edit. Each lock is held by one connection for
+    LOCK_LEASE_SECONDS unless renewed; expired locks are ignored and
+    pruned when next found. Locks dropped without being released (pruned,
+    or their text deleted by `shift`) are kept in `lapsed` until the
+    session takes them to announce. Not thread-safe: the owning
+    DocumentSession calls it under its lock.
+    """
+
+    def __init__(self):
+        self.locks = []
+        self.held = {}
+        self.lapsed = []
+
+    def __len__(self):
+        return len(self.locks)
+
+    def overlapping(self, start, end):
+        """Live locks overlapping [start, end); an empty range is an insert point"""
+        now = time.monotonic()
+        found = []
+        expired = []
+        # An insert point only conflicts strictly inside a lock
+        limit = end if end > start else start
+        index = bisect_right(self.locks, start, key=_end)
+        while index < len(self.locks) and self.locks[index].start < limit:
+            lock = self.locks[index]
+            (expired if lock.expires <= now else found).append(lock)
+            index += 1
+        for lock in expired:
+            self.remove(lock)
+        self.lapsed.extend(expired)
+        return found
+
+    def acquire(self, channel, user_id, user, section, start, end):
+        """Grant or renew `section` over [start, end) for a connection
+
+        Returns (lock, None) when granted, or (None, conflicting lock).
+        Moving a held section to a new range keeps the old range if the
+        new one is taken.
+        """
+        current = self.held.get((channel, section))
+        for lock in self.overlapping(start, end):
+            if lock is not current:
+                return None, lock
+        # Look again: the old lock may have expired and been pruned above
+        current = self.held.get((channel, section))
+        if current is not None:
+            self.remove(current)
+        lock = SectionLock(
+            channel, user_id, user, section, start, end,
+            time.monotonic() + settings.LOCK_LEASE_SECONDS
+        )
+        self.locks.insert(bisect_right(self.locks, start, key=_end), lock)
+        self.held[(channel, section)] = lock
+        return lock, None
+
+    def release(self, channel, section):
+        """Drop a connection's lock on `section`; returns it if it was held"""
+        lock = self.held.get((channel, section))
+        if lock is not None:
+            self.remove(lock)
+        return lock
+
+    def release_channel(self, channel):
+        """Drop every lock a connection holds (it disconnected)"""
+        released = [lock for lock in self.locks if lock.channel == channel]
+        for lock in released:
+            self.remove(lock)
+        return released
+
+    def remove(self, lock):
+        self.locks.remove(lock)
+        del self.held[(lock.channel, lock.section)]
+
+    def take_lapsed(self):
+        """Locks pruned or emptied since the last call"""
+        lapsed, self.lapsed = self.lapsed, []
+        return lapsed
+
+    def check(self, op, user_id):
+        """Raise LockedError if `op` edits inside another user's lock"""
+        for lock in self.overlapping(op.position, op.end):
+            if lock.user_id != user_id:
+                raise LockedError(lock)
+
+    def check_batch(self, ops, user_id):
+        """`check` each op of a batch, where each applies after the previous"""
+        if len(ops) == 1:
+            return self.check(ops[0], user_id)
+        probe = self.copy()
+        for op in ops:
+            probe.check(op, user_id)
+            probe.shift(op, user_id)
+
+    def export(self):
+        """The live locks as plain data, with their leases as seconds left"""
+        now = time.monotonic()
+        return [
+            [lock.channel, lock.user_id, lock.user, lock.section, lock.start, lock.end, lock.expires - now]
+            for lock in self.locks
+            if lock.expires > now
+        ]
+
+    @classmethod
+    def load(cls, entries):
+        locks = cls()
+        now = time.monotonic()
+        for channel, user_id, user, section, start, end, lease in entries:
+            lock = SectionLock(channel, user_id, user, section, start, end, now + lease)
+            locks.locks.append(lock)
+            locks.held[(channel, section)] = lock
+        return locks
+
+    def copy(self):
+        other = SectionLocks()
+        for lock in self.locks:
+            clone = SectionLock(
+                lock.channel, lock.user_id, lock.user, lock.section, lock.start, lock.end, lock.expires
+            )
+            other.locks.append(clone)
+            other.held[(clone.channel, clone.section)] = clone
+        return other
+
+    def shift(self, op, user_id):
+        """Move the ranges past an op applied by `user_id`
+
+        Text inserted at a boundary joins the lock only when its holder
+        typed it. A lock whose text was all deleted (only its holder or a
+        whole-body REST save can do that) is dropped; returns those.
+        """
+        if op.is_noop or not self.locks:
+            return []
+        delta = len(op.text) - op.length
+        emptied = []
+        index = bisect_right(self.locks, op.position - 1, key=_end)
+        for lock in islice(self.locks, index, None):
+            if lock.start > op.end:
+                # Past the edit: just move with the text
+                lock.start += delta
+                lock.end += delta
+                continue
+            holder = lock.user_id == user_id
+            lock.start = _map(lock.start, op, not holder)
+            lock.end = _map(lock.end, op, holder)
+            if lock.end <= lock.start:
+                emptied.append(lock)
+        for lock in emptied:
+            self.remove(lock)
+        self.lapsed.extend(emptied)
+        return emptied
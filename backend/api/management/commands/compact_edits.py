@@ -0,0 +1,141 @@
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import Document, DocumentEdit, DocumentVersion
+from api.textbuffer import TextBuffer
+from api.versioning import reconstruct
+
+
+class Command(BaseCommand):
+    help = (
+        'Fold DocumentEdit rows older than the retention window into a '
+        'DocumentVersion keyframe and delete them (run it from cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days',
+            type=float,
+            default=settings.EDIT_RETENTION_DAYS,
+            help='Keep edits newer than this many days'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.EDIT_COMPACTION_BATCH_SIZE,
+            help='Rows deleted per transaction'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to sleep between batches'
+        )
+        parser.add_argument('--archive', help='Append deleted rows to this file as JSON lines')
+        parser.add_argument('--document', type=int, help='Only compact this document')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be compacted')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['retention_days'])
+        documents = Document.objects.order_by('id')
+        if options['document']:
+            documents = documents.filter(id=options['document'])
+
+        archive = open(options['archive'], 'a') if options['archive'] else None
+        total = 0
+        try:
+            for document_id in documents.values_list('id', flat=True).iterator():
+                total += self.compact_document(document_id, cutoff, options, archive)
+        finally:
+            if archive is not None:
+                archive.close()
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} edits older than {cutoff:%Y-%m-%d %H:%M}'))
+
+    def compact_document(self, document_id, cutoff, options, archive):
+        """Checkpoint one document at its newest expired edit and delete up to it"""
+        edits = DocumentEdit.objects.filter(document_id=document_id)
+        # Walks the (document, id) index back from the newest edit
+        upper = edits.filter(timestamp__lt=cutoff).order_by('-id').values_list('id', flat=True).first()
+        if upper is None:
+            return 0
+        expired = edits.filter(id__lte=upper, timestamp__lt=cutoff)
+        checkpoint = expired.exclude(version=None).order_by('-id').values('version', 'user_id').first()
+
+        if options['dry_run']:
+            count = expired.count()
+            self.stdout.write(f'document {document_id}: {count} edits to compact')
+            return count
+        if checkpoint is not None and not self.write_keyframe(document_id, checkpoint, upper):
+            return 0
+
+        deleted = 0
+        batch_size = options['batch_size']
+        while True:
+            with transaction.atomic():
+                ids = list(expired.order_by('id').values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                batch = expired.filter(id__lte=ids[-1])
+                if archive is not None:
+                    for row in batch.order_by('id').values():
+                        archive.write(json.dumps(row, default=str) + '\n')
+                deleted += batch.delete()[0]
+            if options['pause']:
+                time.sleep(options['pause'])
+        if archive is not None:
+            archive.flush()
+        self.stdout.write(f'document {document_id}: deleted {deleted} edits')
+        return deleted
+
+    def write_keyframe(self, document_id, checkpoint, upper):
+        """Store the content at the checkpoint version as a keyframe
+
+        The content is the nearest earlier DocumentVersion with the edits
+        after it replayed on top. Returns False (and keeps the edits) if
+        that chain has a gap, since the content couldn't be rebuilt later.
+        """
+        version = checkpoint['version']
+        versions = DocumentVersion.objects.filter(document_id=document_id)
+        if versions.filter(version_number=version).exists():
+            return True
+
+        base = versions.filter(version_number__lt=version).order_by('-version_number').first()
+        if base is None:
+            self.stderr.write(f'document {document_id}: no version before {version}, edits kept')
+            return False
+
+        buffer = TextBuffer(reconstruct(base))
+        expected = base.version_number + 1
+        replay = DocumentEdit.objects.filter(
+            document_id=document_id,
+            id__lte=upper,
+            version__gt=base.version_number,
+            version__lte=version
+        ).order_by('id').values_list('version', 'position', 'length', 'content')
+        for edit_version, position, length, content in replay.iterator(chunk_size=2000):
+            if edit_version != expected:
+                break
+            buffer.replace(position, length, content)
+            expected += 1
+        if expected != version + 1:
+            self.stderr.write(
+                f'document {document_id}: edit log has a gap at version {expected}, edits kept'
+            )
+            return False
+
+        DocumentVersion.objects.create(
+            document_id=document_id,
+            content=str(buffer),
+            keyframe_version=version,
+            version_number=version,
+            created_by_id=checkpoint['user_id']
+        )
+        return True
@@ -0,0 +1,109 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import DocumentVersion
+from api.versioning import apply_delta, encode_delta, reconstruct
+
+
+class Command(BaseCommand):
+    help = 'Re-encode DocumentVersion history as keyframes plus deltas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keyframe-interval',
+            type=int,
+            default=settings.DOCUMENT_VERSION_KEYFRAME_INTERVAL,
+            help='Write a full keyframe every N versions'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Rows written per bulk_update'
+        )
+        parser.add_argument('--document', type=int, help='Only re-encode this document')
+
+    def handle(self, *args, **options):
+        document_ids = DocumentVersion.objects.order_by().values_list('document_id', flat=True).distinct()
+        if options['document']:
+            document_ids = [options['document']]
+
+        before = after = 0
+        for document_id in document_ids:
+            stored, encoded = self.encode_document(
+                document_id, options['keyframe_interval'], options['batch_size']
+            )
+            before += stored
+            after += encoded
+            self.stdout.write(f'document {document_id}: {stored} -> {encoded} bytes')
+
+        self.stdout.write(self.style.SUCCESS(f'Version storage: {before} -> {after} bytes'))
+
+    @transaction.atomic
+    def encode_document(self, document_id, interval, batch_size):
+        rows = DocumentVersion.objects.filter(document_id=document_id).order_by('version_number')
+        # Materialized content of the previous version, for rows that are already deltas
+        contents = {}
+        previous = None
+        chain_length = keyframe_version = 0
+        stored = encoded = 0
+        pending = []
+
+        for row in rows.iterator(chunk_size=batch_size):
+            if row.delta is None:
+                content = row.content
+                stored += len(content)
+            else:
+                content = apply_delta(self.base_content(row, contents), row.delta)
+                stored += len(json.dumps(row.delta))
+
+            delta = None
+            if previous is not None and chain_length + 1 < interval:
+                delta = encode_delta(contents[previous], content)
+                if len(json.dumps(delta)) >= len(content):
+                    delta = None
+
+            if delta is None:
+                row.content, row.delta, row.base_version = content, None, None
+                keyframe_version = row.version_number
+                chain_length = 0
+                encoded += len(content)
+            else:
+                row.content, row.delta, row.base_version = '', delta, previous
+                chain_length += 1
+                encoded += len(json.dumps(delta))
+            row.keyframe_version = keyframe_version
+            row.chain_length = chain_length
+            pending.append(row)
+
+            contents[row.version_number] = content
+            contents.pop(previous, None)
+            previous = row.version_number
+
+            if len(pending) >= batch_size:
+                self.write(pending)
+                pending = []
+        self.write(pending)
+        return stored, encoded
+
+    def base_content(self, row, contents):
+        """Content of the version a stored delta is based on
+
+        Usually the previous row, but compact_edits may have inserted a
+        keyframe in between, so other bases are rebuilt from the table.
+        Rows already rewritten still encode the same content.
+        """
+        if row.base_version in contents:
+            return contents[row.base_version]
+        base = DocumentVersion.objects.get(document_id=row.document_id, version_number=row.base_version)
+        return reconstruct(base)
+
+    def write(self, rows):
+        DocumentVersion.objects.bulk_update(
+            rows,
+            ['content', 'delta', 'base_version', 'keyframe_version', 'chain_length'],
+            batch_size=len(rows) or 1
+        )
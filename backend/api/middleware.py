@@ -1,19 +1,68 @@
+from urllib.parse import parse_qs
+
 from channels.middleware import BaseMiddleware
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth.models import User
 
+from .cache import LRUTTLCache
+from .metrics import registry
+from .models import UserProfile
+
+
+# user_id -> User (with profile joined), so reconnect storms don't turn
+# into one SELECT per socket
+user_cache = LRUTTLCache(settings.WS_USER_CACHE_SIZE, settings.WS_USER_CACHE_TTL)
+user_cache_hits = registry.counter(
+    'collabspace_ws_user_cache_hits',
+    'WebSocket connects authenticated from the in-process user cache'
+)
+user_cache_misses = registry.counter(
+    'collabspace_ws_user_cache_misses',
+    'WebSocket connects that had to load the user from the database'
+)
+
 
 @database_sync_to_async
-def get_user_from_token(token_string):
+def load_user(user_id):
+    return User.objects.select_related('profile').get(id=user_id)
+
+
+async def get_user_from_token(token_string):
     """Get user from JWT token"""
     try:
-        access_token = AccessToken(token_string)
-        user = User.objects.get(id=access_token['user_id'])
-        return user
+        user_id = AccessToken(token_string)['user_id']
     except Exception:
         return AnonymousUser()
+    
+    user = user_cache.get(user_id)
+    if user is not None:
+        user_cache_hits.inc()
+        return user
+    
+    user_cache_misses.inc()
+    try:
+        user = await load_user(user_id)
+    except User.DoesNotExist:
+        return AnonymousUser()
+    user_cache.set(user_id, user)
+    return user
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    user_cache.delete(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+    user_cache.delete(instance.user_id)
 
 
 class JWTAuthMiddleware(BaseMiddleware):
@@ -21,13 +70,8 @@ class JWTAuthMiddleware(BaseMiddleware):
     
     async def __call__(self, scope, receive, send):
         # Get token from query string
-        query_string = scope.get('query_string', b'').decode()
-        token = None
-        
-        for param in query_string.split('&'):
-            if param.startswith('token='):
-                token = param.split('=')[1]
-                break
+        query = parse_qs(scope.get('query_string', b'').decode())
+        token = query.get('token', [None])[0]
         
         if token:
             scope['user'] = await get_user_from_token(token)
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentedit',
+            name='length',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='documentedit',
+            name='version',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
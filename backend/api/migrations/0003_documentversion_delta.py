@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:44
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_snapshots_as_keyframes(apps, schema_editor):
+    DocumentVersion = apps.get_model('api', 'DocumentVersion')
+    DocumentVersion.objects.update(keyframe_version=F('version_number'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_documentedit_length_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentversion',
+            name='base_version',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='chain_length',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='delta',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='keyframe_version',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='documentversion',
+            name='content',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(mark_snapshots_as_keyframes, migrations.RunPython.noop),
+    ]
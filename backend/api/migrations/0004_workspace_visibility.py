@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:48
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def collapse_auto_shares(apps, schema_editor):
+    """Documents auto-shared with every other user become public and drop
+    their collaborator rows; everything else keeps its exact audience."""
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Document = apps.get_model('api', 'Document')
+    Collaborator = Document.collaborators.through
+    others = User.objects.count() - 1
+    shared_with_everyone = list(
+        Document.objects.annotate(shares=Count('collaborators'))
+        .filter(shares__gte=max(others, 1))
+        .values_list('id', flat=True)
+    )
+    Document.objects.exclude(id__in=shared_with_everyone).update(visibility='private')
+    for start in range(0, len(shared_with_everyone), 500):
+        batch = shared_with_everyone[start:start + 500]
+        Document.objects.filter(id__in=batch).update(visibility='public')
+        Collaborator.objects.filter(document_id__in=batch).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0003_documentversion_delta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='visibility',
+            field=models.CharField(choices=[('public', 'Everyone'), ('workspace', 'Workspace members'), ('private', 'Owner and collaborators')], default='public', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='Workspace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('members', models.ManyToManyField(blank=True, related_name='workspaces', to=settings.AUTH_USER_MODEL)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='owned_workspaces', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='workspace',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='documents', to='api.workspace'),
+        ),
+        migrations.RunPython(collapse_auto_shares, migrations.RunPython.noop),
+    ]
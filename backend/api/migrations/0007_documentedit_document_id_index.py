@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_activitylog_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='documentedit',
+            index=models.Index(fields=['document', 'id'], name='documentedit_document_id'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:22
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+SEARCH_INDEX = django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='document_search_vector')
+
+
+def add_search_index(apps, schema_editor):
+    # tsvector/GIN only exist on Postgres; other databases use the fallback engine
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Document = apps.get_model('api', 'Document')
+    Document.objects.update(
+        search_vector=SearchVector('title', weight='A', config=settings.SEARCH_CONFIG)
+        + SearchVector('content', weight='B', config=settings.SEARCH_CONFIG)
+    )
+    schema_editor.add_index(Document, SEARCH_INDEX)
+
+
+def remove_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('api', 'Document'), SEARCH_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_documentedit_document_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='document', index=SEARCH_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(add_search_index, remove_search_index),
+            ],
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
 
 class UserProfile(models.Model):
     ROLE_CHOICES = [
@@ -16,26 +19,72 @@ class UserProfile(models.Model):
         return f"{self.user.username} - {self.role}"
 
 
+class Workspace(models.Model):
+    name = models.CharField(max_length=255)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_workspaces')
+    members = models.ManyToManyField(User, related_name='workspaces', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.name
+
+
+class DocumentManager(models.Manager):
+    def get_queryset(self):
+        # The search vector is only read by the database; don't ship it to
+        # Python with every document (and don't write a stale one back on save)
+        return super().get_queryset().defer('search_vector')
+
+
 class Document(models.Model):
+    """A document is visible to its owner, its explicit collaborators and,
+    depending on `visibility`, to everyone or to its workspace's members.
+    Collaborator rows are only needed when sharing is restricted."""
+    VISIBILITY_PUBLIC = 'public'
+    VISIBILITY_WORKSPACE = 'workspace'
+    VISIBILITY_PRIVATE = 'private'
+    VISIBILITY_CHOICES = [
+        (VISIBILITY_PUBLIC, 'Everyone'),
+        (VISIBILITY_WORKSPACE, 'Workspace members'),
+        (VISIBILITY_PRIVATE, 'Owner and collaborators'),
+    ]
+    
     title = models.CharField(max_length=255)
     content = models.TextField(blank=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_documents')
     collaborators = models.ManyToManyField(User, related_name='shared_documents', blank=True)
+    workspace = models.ForeignKey(Workspace, on_delete=models.SET_NULL, related_name='documents', null=True, blank=True)
+    visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default=VISIBILITY_PUBLIC)
     version = models.IntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Weighted title + content lexemes, maintained by api.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    
+    objects = DocumentManager()
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            GinIndex(fields=['search_vector'], name='document_search_vector'),
+        ]
     
     def __str__(self):
         return self.title
 
 
 class DocumentVersion(models.Model):
-    """Stores versions for conflict resolution"""
+    """Stores versions for conflict resolution
+    
+    Keyframes hold the full `content`; every other row holds a `delta`
+    against `base_version`. See api.versioning for reading and writing.
+    """
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='versions')
-    content = models.TextField()
+    content = models.TextField(blank=True)
+    delta = models.JSONField(null=True, blank=True)
+    base_version = models.IntegerField(null=True, blank=True)
+    keyframe_version = models.IntegerField(null=True, blank=True)
+    chain_length = models.PositiveIntegerField(default=0)
     version_number = models.IntegerField()
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -51,12 +100,18 @@ class DocumentEdit(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     operation = models.CharField(max_length=20)  # 'insert', 'delete', 'replace'
     position = models.IntegerField()
+    length = models.IntegerField(default=0)
     content = models.TextField(blank=True)
+    version = models.IntegerField(null=True, blank=True)  # Version this edit produced
     timestamp = models.DateTimeField(auto_now_add=True)
     applied = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Per-document range scans in id order (replay, compaction)
+            models.Index(fields=['document', 'id'], name='documentedit_document_id'),
+        ]
 
 
 class FileUpload(models.Model):
@@ -84,10 +139,17 @@ class ActivityLog(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='activities', null=True, blank=True)
     action = models.CharField(max_length=20, choices=ACTION_CHOICES)
     description = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the activity happens; rows may be inserted later in batches
+    timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-timestamp']
+        # Serve the keyset-paginated feed: newest first, id breaks ties
+        indexes = [
+            models.Index(fields=['document', '-timestamp', '-id'], name='activity_document_recent'),
+            models.Index(fields=['user', '-timestamp', '-id'], name='activity_user_recent'),
+            models.Index(fields=['-timestamp', '-id'], name='activity_recent'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.action} - {self.timestamp}"
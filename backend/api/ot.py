@@ -0,0 +1,163 @@
+from collections import deque, namedtuple
+from itertools import islice
+
+
+class StaleVersionError(Exception):
+    """The client's base version is older than the retained op log"""
+
+
+class Operation(namedtuple('Operation', ['position', 'length', 'text'])):
+    """Single-range edit: at `position` remove `length` chars, insert `text`
+
+    Insert, delete and replace are all special cases of this one shape, so
+    transforming any pair of ops stays closed over it.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_edit(cls, operation, position, content='', length=1):
+        position = max(0, int(position or 0))
+        content = content or ''
+        if operation == 'insert':
+            return cls(position, 0, content)
+        if operation == 'delete':
+            return cls(position, max(0, int(length)), '')
+        if operation == 'replace':
+            return cls(position, max(0, int(length)), content)
+        raise ValueError(f'Unknown operation: {operation}')
+
+    @property
+    def end(self):
+        return self.position + self.length
+
+    @property
+    def operation(self):
+        if not self.length:
+            return 'insert'
+        if not self.text:
+            return 'delete'
+        return 'replace'
+
+    @property
+    def is_noop(self):
+        return not self.length and not self.text
+
+    def clamp(self, size):
+        """Fit the op into a document of `size` characters"""
+        position = min(self.position, size)
+        return self._replace(position=position, length=min(self.length, size - position))
+
+    def apply(self, text):
+        return text[:self.position] + self.text + text[self.end:]
+
+
+NOOP = Operation(0, 0, '')
+
+
+def transform(op, other, priority=False):
+    """Rewrite `op` so it applies after `other`; both share the same base
+
+    `priority` breaks ties (two inserts at one point, or identical ranges)
+    in favour of `op`. Where one op's range swallows the other's, the
+    outer op wins and the inner one becomes a no-op, which keeps every
+    result a single range while still converging:
+
+        transform(b, a).apply(a.apply(s)) == transform(a, b, True).apply(b.apply(s))
+    """
+    if op.is_noop or other.is_noop:
+        return op
+    delta = len(other.text) - other.length
+    tie = op.position == other.position
+
+    # Two pure inserts at the same point
+    if tie and not op.length and not other.length:
+        return op if priority else op._replace(position=op.position + len(other.text))
+    # Entirely before / after the other range
+    if op.end <= other.position:
+        return op
+    if op.position >= other.end:
+        return op._replace(position=op.position + delta)
+
+    contains = op.position <= other.position and other.end <= op.end
+    contained = other.position <= op.position and op.end <= other.end
+    if contains and contained:
+        contains = priority
+    if contains:
+        return op._replace(length=op.length + delta)
+    if contained:
+        return NOOP
+    if op.position < other.position:
+        # Overlap on our right: keep the part before the other range
+        return op._replace(length=other.position - op.position)
+    # Overlap on our left: keep the part after the other range
+    return Operation(other.position + len(other.text), op.end - other.end, op.text)
+
+
+def transform_all(op, others, priority=False):
+    for other in others:
+        op = transform(op, other, priority)
+    return op
+
+
+class OpLog:
+    """Recently applied ops indexed by the version each one produced
+
+    Only ops newer than a client's base version are ever touched, so the
+    cost of transforming an edit depends on how far behind the client is,
+    not on how long the document's history is.
+    """
+
+    def __init__(self, version, maxlen=None):
+        self.ops = deque(maxlen=maxlen)
+        self.version = version
+
+    def __len__(self):
+        return len(self.ops)
+
+    @property
+    def oldest_version(self):
+        """Earliest base version that can still be transformed"""
+        return self.version - len(self.ops)
+
+    def append(self, op):
+        self.ops.append(op)
+        self.version += 1
+        return self.version
+
+    def since(self, version):
+        """Ops applied after `version`, oldest first"""
+        behind = self.version - version
+        if behind <= 0:
+            return []
+        if behind > len(self.ops):
+            raise StaleVersionError(
+                f'Base version {version} predates the op log (oldest {self.oldest_version})'
+            )
+        ops = list(islice(reversed(self.ops), behind))
+        ops.reverse()
+        return ops
+
+    def rebase(self, op, base_version):
+        """Transform an incoming op against everything applied since its base"""
+        if base_version is None:
+            return op
+        return transform_all(op, self.since(base_version))
+
+    def rebase_batch(self, ops, base_version):
+        """Rebase a client's sequence of ops (each on top of the previous one)
+
+        The concurrent ops are carried forward past every op of the batch,
+        so later ops in the batch are transformed in the right context.
+        """
+        if base_version is None:
+            return list(ops)
+        concurrent = self.since(base_version)
+        rebased = []
+        for op in ops:
+            carried = []
+            for other in concurrent:
+                carried.append(transform(other, op, True))
+                op = transform(op, other, False)
+            concurrent = carried
+            rebased.append(op)
+        return rebased
@@ -1,5 +1,6 @@
 from functools import wraps
 from rest_framework.permissions import BasePermission
+from .access import has_document_access
 
 class IsAdminUser(BasePermission):
     """Admin role required"""
@@ -19,7 +20,7 @@ class IsEditorOrAdmin(BasePermission):
 class IsDocumentOwnerOrCollaborator(BasePermission):
     """Check if user is owner or collaborator of document"""
     def has_object_permission(self, request, view, obj):
-        return obj.owner == request.user or request.user in obj.collaborators.all()
+        return has_document_access(request.user, obj.pk)
 
 
 def require_role(*roles):
@@ -0,0 +1,311 @@
+import asyncio
+import json
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import wire
+from .instrumentation import group_send
+
+
+class RoomCursors:
+    __slots__ = ('cursors', 'dirty', 'task')
+
+    def __init__(self):
+        self.cursors = {}
+        self.dirty = set()
+        self.task = None
+
+
+class CursorTicker:
+    """Coalesces cursor moves per room into one broadcast per tick
+
+    Only the latest position per user is kept. Every CURSOR_TICK_INTERVAL_MS
+    a room with changes sends a single ``cursor_frame`` group event carrying
+    the cursors that moved; rooms with no changes send nothing, and a room's
+    tick task exits after CURSOR_TICK_IDLE_TICKS quiet ticks.
+    """
+
+    def __init__(self):
+        self.rooms = {}
+
+    def update(self, room, user_id, user, position):
+        state = self.rooms.get(room)
+        if state is None:
+            state = self.rooms[room] = RoomCursors()
+        state.cursors[user_id] = {'user': user, 'user_id': user_id, 'position': position}
+        state.dirty.add(user_id)
+        if state.task is None:
+            state.task = asyncio.get_running_loop().create_task(self.run(room, state))
+
+    def remove(self, room, user_id):
+        state = self.rooms.get(room)
+        if state is None:
+            return
+        state.cursors.pop(user_id, None)
+        state.dirty.discard(user_id)
+        if not state.cursors and state.task is None:
+            del self.rooms[room]
+
+    def take_frame(self, state):
+        frame = [state.cursors[user_id] for user_id in state.dirty if user_id in state.cursors]
+        state.dirty = set()
+        return frame
+
+    async def run(self, room, state):
+        channel_layer = get_channel_layer()
+        interval = settings.CURSOR_TICK_INTERVAL_MS / 1000
+        idle = 0
+        try:
+            while idle < settings.CURSOR_TICK_IDLE_TICKS:
+                await asyncio.sleep(interval)
+                frame = self.take_frame(state)
+                if not frame:
+                    idle += 1
+                    continue
+                idle = 0
+                await presence.set_cursors(room, {
+                    cursor['user_id']: cursor['position'] for cursor in frame
+                })
+                # Pre-encode once; consumers forward it unless they are in it
+                await group_send(channel_layer, room, {
+                    'type': 'cursor_frame',
+                    'cursors': frame,
+                    **wire.frame({
+                        'type': 'cursors',
+                        'cursors': [
+                            {'user': cursor['user'], 'position': cursor['position']}
+                            for cursor in frame
+                        ]
+                    })
+                })
+        finally:
+            state.task = None
+            if not state.cursors and self.rooms.get(room) is state:
+                del self.rooms[room]
+
+
+cursor_ticker = CursorTicker()
+
+
+def _snapshot(members, cursors, exclude_user_id):
+    """One entry per user in the room, with their last known cursor"""
+    users = {}
+    for member in members:
+        user_id = member['user_id']
+        if user_id != exclude_user_id and user_id not in users:
+            users[user_id] = {
+                'user': member['user'],
+                'user_id': user_id,
+                'position': cursors.get(user_id)
+            }
+    return list(users.values())
+
+
+class InMemoryPresence:
+    """Room membership within a single worker process
+
+    Members are keyed by channel name, so a user with two tabs open stays
+    present until both are gone.
+    """
+
+    def __init__(self):
+        self.rooms = {}
+        self.cursors = {}
+
+    async def join(self, room, channel, user_id, user):
+        """Register a connection; returns (snapshot of the others, first)"""
+        members = self.rooms.setdefault(room, {})
+        first = all(member['user_id'] != user_id for member in members.values())
+        snapshot = _snapshot(members.values(), self.cursors.get(room, {}), user_id)
+        members[channel] = {'user': user, 'user_id': user_id, 'last_seen': time.time()}
+        return snapshot, first
+
+    async def leave(self, room, channel):
+        """Drop a connection; returns the member if it was the user's last one"""
+        members = self.rooms.get(room, {})
+        member = members.pop(channel, None)
+        if not members:
+            self.rooms.pop(room, None)
+            self.cursors.pop(room, None)
+            return member
+        if member is None or any(other['user_id'] == member['user_id'] for other in members.values()):
+            return None
+        self.cursors.get(room, {}).pop(member['user_id'], None)
+        return member
+
+    async def touch(self, room, channel):
+        member = self.rooms.get(room, {}).get(channel)
+        if member is not None:
+            member['last_seen'] = time.time()
+
+    async def set_cursors(self, room, cursors):
+        if room in self.rooms:
+            self.cursors.setdefault(room, {}).update(cursors)
+
+    async def expire(self, deadline):
+        """Remove connections not seen since `deadline`
+
+        Returns (room, channel, member) for each; member is None when the
+        user still has another live connection in the room.
+        """
+        expired = []
+        for room, members in list(self.rooms.items()):
+            for channel, member in list(members.items()):
+                if member['last_seen'] < deadline:
+                    expired.append((room, channel, await self.leave(room, channel)))
+        return expired
+
+
+class RedisPresence:
+    """Room membership shared by every worker through Redis
+
+    Per room: a hash of channel -> member, a sorted set of channel -> last
+    heartbeat and a hash of user_id -> last cursor. A set of rooms lets any
+    worker sweep the ghosts left behind by one that crashed.
+    """
+
+    def __init__(self, url, prefix='presence'):
+        import redis.asyncio
+
+        self.redis = redis.asyncio.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.rooms_key = f'{prefix}:rooms'
+
+    def keys(self, room):
+        return (
+            f'{self.prefix}:{room}:members',
+            f'{self.prefix}:{room}:seen',
+            f'{self.prefix}:{room}:cursors',
+        )
+
+    async def live_members(self, room):
+        """({channel: member} for connections within PRESENCE_TTL, {user_id: cursor})"""
+        members_key, seen_key, cursors_key = self.keys(room)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(members_key)
+            pipe.zrangebyscore(seen_key, time.time() - settings.PRESENCE_TTL, '+inf')
+            pipe.hgetall(cursors_key)
+            members, live, cursors = await pipe.execute()
+        return (
+            {channel: json.loads(members[channel]) for channel in live if channel in members},
+            {int(user_id): json.loads(position) for user_id, position in cursors.items()}
+        )
+
+    async def join(self, room, channel, user_id, user):
+        members_key, seen_key, _ = self.keys(room)
+        members, cursors = await self.live_members(room)
+        first = all(member['user_id'] != user_id for member in members.values())
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(members_key, channel, json.dumps({'user': user, 'user_id': user_id}))
+            pipe.zadd(seen_key, {channel: time.time()})
+            pipe.sadd(self.rooms_key, room)
+            await pipe.execute()
+        return _snapshot(members.values(), cursors, user_id), first
+
+    async def leave(self, room, channel):
+        members_key, seen_key, cursors_key = self.keys(room)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hget(members_key, channel)
+            pipe.hdel(members_key, channel)
+            pipe.zrem(seen_key, channel)
+            member, _, _ = await pipe.execute()
+        if member is None:
+            return None
+        member = json.loads(member)
+        members, _ = await self.live_members(room)
+        if not members:
+            await self.redis.srem(self.rooms_key, room)
+            await self.redis.delete(members_key, seen_key, cursors_key)
+            return member
+        if any(other['user_id'] == member['user_id'] for other in members.values()):
+            return None
+        await self.redis.hdel(cursors_key, member['user_id'])
+        return member
+
+    async def touch(self, room, channel):
+        await self.redis.zadd(self.keys(room)[1], {channel: time.time()}, xx=True)
+
+    async def set_cursors(self, room, cursors):
+        if cursors:
+            await self.redis.hset(self.keys(room)[2], mapping={
+                user_id: json.dumps(position) for user_id, position in cursors.items()
+            })
+
+    async def expire(self, deadline):
+        expired = []
+        for room in await self.redis.smembers(self.rooms_key):
+            seen_key = self.keys(room)[1]
+            for channel in await self.redis.zrangebyscore(seen_key, '-inf', deadline):
+                # Every worker sweeps; only the one whose ZREM wins reports it
+                if await self.redis.zrem(seen_key, channel):
+                    expired.append((room, channel, await self.leave(room, channel)))
+        return expired
+
+
+class PresenceRegistry:
+    """Who is in each document room, so joining clients get one snapshot
+
+    Connections heartbeat through `touch`. A sweeper task drops the ones
+    silent for PRESENCE_TTL seconds (e.g. sockets of a worker that died
+    without running disconnect), removes them from the room group, closes
+    any that are still open and tells the room they left. Membership
+    lives in this process by default, or in Redis (PRESENCE_BACKEND =
+    'redis') when workers share rooms.
+    """
+
+    def __init__(self):
+        self._backend = None
+        self.sweeper = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            if settings.PRESENCE_BACKEND == 'redis':
+                self._backend = RedisPresence(settings.PRESENCE_REDIS_URL)
+            else:
+                self._backend = InMemoryPresence()
+        return self._backend
+
+    async def join(self, room, channel, user_id, user):
+        if self.sweeper is None or self.sweeper.done():
+            self.sweeper = asyncio.get_running_loop().create_task(self.sweep())
+        return await self.backend.join(room, channel, user_id, user)
+
+    async def leave(self, room, channel):
+        return await self.backend.leave(room, channel)
+
+    async def touch(self, room, channel):
+        await self.backend.touch(room, channel)
+
+    async def set_cursors(self, room, cursors):
+        await self.backend.set_cursors(room, cursors)
+
+    async def sweep(self):
+        channel_layer = get_channel_layer()
+        while True:
+            await asyncio.sleep(settings.PRESENCE_SWEEP_INTERVAL)
+            try:
+                expired = await self.backend.expire(time.time() - settings.PRESENCE_TTL)
+                for room, channel, member in expired:
+                    await channel_layer.group_discard(room, channel)
+                    # A socket that is still open (half-open, or its client
+                    # hung) gets closed so its consumer's disconnect runs
+                    await channel_layer.send(channel, {'type': 'presence_expired'})
+                    if member is not None:
+                        cursor_ticker.remove(room, member['user_id'])
+                        await group_send(channel_layer, room, {
+                            'type': 'room_frame',
+                            'skip_channel': None,
+                            **wire.frame({
+                                'type': 'user_left',
+                                'user': member['user'],
+                                'user_id': member['user_id']
+                            })
+                        })
+            except Exception as e:
+                print(f"Error sweeping presence: {e}")
+
+
+presence = PresenceRegistry()
@@ -0,0 +1,80 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+
+
+class PostgresSearch:
+    """Ranked full-text search over Document.search_vector (GIN indexed)
+
+    The vector weights the title above the content. It is rewritten with
+    the content whenever a document is saved: in the same UPDATE when the
+    WebSocket session flushes, and by `reindex` after REST saves.
+    Queries use websearch syntax ("quoted phrases", -exclusions, OR).
+    """
+
+    def vector(self, content=None):
+        # Column references in an UPDATE's SET read the old row, so pass
+        # the new content when it is written by the same statement
+        body = F('content') if content is None else Value(content)
+        return (
+            SearchVector('title', weight='A', config=settings.SEARCH_CONFIG)
+            + SearchVector(body, weight='B', config=settings.SEARCH_CONFIG)
+        )
+
+    def index_fields(self, content=None):
+        """Extra fields for an UPDATE that writes `content`"""
+        return {'search_vector': self.vector(content)}
+
+    def reindex(self, queryset):
+        queryset.update(search_vector=self.vector())
+
+    def search(self, queryset, text):
+        query = SearchQuery(text, search_type='websearch', config=settings.SEARCH_CONFIG)
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-updated_at')
+
+
+class FallbackSearch:
+    """Case-insensitive substring search for SQLite test and benchmark runs
+
+    Every word must appear in the title or the content; title matches rank
+    higher. Nothing is indexed, so each search scans the visible documents.
+    """
+
+    def index_fields(self, content=None):
+        return {}
+
+    def reindex(self, queryset):
+        pass
+
+    def search(self, queryset, text):
+        terms = re.findall(r'\w+', text)
+        if not terms:
+            return queryset.none()
+        rank = Value(0.0)
+        for term in terms:
+            queryset = queryset.filter(Q(title__icontains=term) | Q(content__icontains=term))
+            rank = rank + Case(
+                When(title__icontains=term, then=Value(1.0)),
+                default=Value(0.1),
+                output_field=FloatField()
+            )
+        return queryset.annotate(rank=rank).order_by('-rank', '-updated_at')
+
+
+SEARCH_ENGINES = {
+    'postgres': PostgresSearch,
+    'fallback': FallbackSearch,
+}
+
+
+def get_search_engine():
+    """The SEARCH_ENGINE backend; 'auto' picks by database vendor"""
+    name = settings.SEARCH_ENGINE
+    if name == 'auto':
+        name = 'postgres' if connection.vendor == 'postgresql' else 'fallback'
+    return SEARCH_ENGINES[name]()
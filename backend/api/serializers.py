@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import UserProfile, Document, DocumentVersion, FileUpload, ActivityLog
+from .models import UserProfile, Workspace, Document, DocumentVersion, FileUpload, ActivityLog
+from .versioning import reconstruct
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -39,6 +40,15 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
+class WorkspaceSerializer(serializers.ModelSerializer):
+    owner = UserSerializer(read_only=True)
+    member_count = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = Workspace
+        fields = ['id', 'name', 'owner', 'member_count', 'created_at']
+
+
 class DocumentSerializer(serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
     collaborators = UserSerializer(many=True, read_only=True)
@@ -51,9 +61,21 @@ class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
         fields = ['id', 'title', 'content', 'owner', 'collaborators', 
-                  'collaborator_ids', 'version', 'created_at', 'updated_at']
+                  'collaborator_ids', 'workspace', 'visibility', 'version',
+                  'created_at', 'updated_at']
         read_only_fields = ['owner', 'version']
     
+    def validate(self, attrs):
+        workspace = attrs.get('workspace', getattr(self.instance, 'workspace', None))
+        visibility = attrs.get('visibility', getattr(self.instance, 'visibility', Document.VISIBILITY_PUBLIC))
+        if visibility == Document.VISIBILITY_WORKSPACE and workspace is None:
+            raise serializers.ValidationError({'workspace': 'Workspace visibility requires a workspace'})
+        request = self.context.get('request')
+        if 'workspace' in attrs and workspace is not None and request is not None:
+            if not workspace.members.filter(pk=request.user.pk).exists():
+                raise serializers.ValidationError({'workspace': 'You are not a member of this workspace'})
+        return attrs
+    
     def create(self, validated_data):
         collaborator_ids = validated_data.pop('collaborator_ids', [])
         document = Document.objects.create(**validated_data)
@@ -62,12 +84,38 @@ class DocumentSerializer(serializers.ModelSerializer):
         return document
 
 
+class DocumentSummarySerializer(serializers.ModelSerializer):
+    """Lightweight list representation: no content, collaborators as a count"""
+    owner = UserSerializer(read_only=True)
+    collaborator_count = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = Document
+        fields = ['id', 'title', 'owner', 'collaborator_count', 'workspace',
+                  'visibility', 'version', 'created_at', 'updated_at']
+
+
+class DocumentSearchSerializer(DocumentSummarySerializer):
+    rank = serializers.FloatField(read_only=True)
+    
+    class Meta(DocumentSummarySerializer.Meta):
+        fields = DocumentSummarySerializer.Meta.fields + ['rank']
+
+
 class DocumentVersionSerializer(serializers.ModelSerializer):
     created_by = UserSerializer(read_only=True)
+    content = serializers.SerializerMethodField()
     
     class Meta:
         model = DocumentVersion
         fields = ['id', 'content', 'version_number', 'created_by', 'created_at']
+    
+    def get_content(self, obj):
+        # Views can pre-materialize a whole page of versions in one query
+        contents = self.context.get('contents') or {}
+        if obj.version_number in contents:
+            return contents[obj.version_number]
+        return reconstruct(obj)
 
 
 class FileUploadSerializer(serializers.ModelSerializer):
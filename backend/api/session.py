@@ -0,0 +1,332 @@
+import asyncio
+import threading
+from collections import OrderedDict
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .instrumentation import db_scope
+from .locks import SectionLocks
+from .models import Document
+from .ot import NOOP, Operation, OpLog
+from .search import get_search_engine
+from .textbuffer import TextBuffer
+
+
+class SessionMovedError(Exception):
+    """The session was handed to another worker (see api.sharding)"""
+
+    def __init__(self, owner):
+        super().__init__(f'Session moved to worker {owner}')
+        self.owner = owner
+
+
+class DocumentSession:
+    """Authoritative in-memory state of a document while it has live editors"""
+
+    def __init__(self, document_id, content, version):
+        self.document_id = document_id
+        self.buffer = TextBuffer(content)
+        self.log = OpLog(version, maxlen=settings.DOCUMENT_SESSION_OP_LOG_SIZE)
+        self.persisted_version = version
+        self.acks = OrderedDict()
+        self.locks = SectionLocks()
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.flush_handle = None
+        self.flush_task = None
+        self.moved_to = None
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a session handed over by another worker (see `export`)"""
+        ops = [Operation(*op) for op in state['ops']]
+        session = cls(state['document_id'], state['content'], state['version'] - len(ops))
+        for op in ops:
+            session.log.append(op)
+        session.persisted_version = state['persisted_version']
+        session.acks.update(((user_id, op_id), version) for user_id, op_id, version in state['acks'])
+        session.locks = SectionLocks.load(state['locks'])
+        return session
+
+    @property
+    def version(self):
+        return self.log.version
+
+    @property
+    def dirty(self):
+        return self.version != self.persisted_version
+
+    @property
+    def unflushed_ops(self):
+        return self.version - self.persisted_version
+
+    def apply(self, op, base_version=None, user_id=None):
+        """Rebase a single op onto the current version, apply it and log it
+
+        Returns the op as applied and the version it produced. Raises
+        StaleVersionError if `base_version` has fallen out of the op log,
+        or LockedError if the op lands in a section another user locked.
+        """
+        applied, version = self.apply_batch([op], base_version, user_id=user_id)
+        return applied[0], version
+
+    def apply_batch(self, ops, base_version=None, op_id=None, user_id=None):
+        """Atomically rebase and apply an ordered batch of ops
+
+        Returns (applied ops, new version). A batch whose `op_id` was
+        already applied (a client retransmit) is not applied again and
+        returns (None, version it produced the first time). If any op
+        lands in another user's section lock (checked when `user_id` is
+        given), nothing is applied and LockedError is raised.
+        """
+        with self.lock:
+            self.check_moved()
+            if op_id is not None and op_id in self.acks:
+                return None, self.acks[op_id]
+            size = len(self.buffer)
+            rebased = []
+            for op in self.log.rebase_batch(ops, base_version or None):
+                op = op.clamp(size)
+                size += len(op.text) - op.length
+                rebased.append(op)
+            if user_id is not None and self.locks:
+                self.locks.check_batch(rebased, user_id)
+            for op in rebased:
+                if not op.is_noop:
+                    self.buffer.replace(op.position, op.length, op.text)
+                self.log.append(op)
+                self.locks.shift(op, user_id)
+            if op_id is not None:
+                self.acks[op_id] = self.version
+                if len(self.acks) > settings.DOCUMENT_SESSION_OP_LOG_SIZE:
+                    self.acks.popitem(last=False)
+            return rebased, self.version
+
+    def overwrite(self, content=None):
+        """Record a REST save as a whole-body replace; None keeps the live body"""
+        with self.lock:
+            self.check_moved()
+            if content is None:
+                # Title-only save: bump the version without touching the body
+                content = str(self.buffer)
+                self.log.append(NOOP)
+            else:
+                op = Operation(0, len(self.buffer), content)
+                self.log.append(op)
+                self.buffer = TextBuffer(content)
+                # The whole body was replaced, so every section lock lapses
+                self.locks.shift(op, None)
+            self.persisted_version = self.version
+            return content, self.version
+
+    def acquire_lock(self, channel, user_id, user, section, op, base_version=None):
+        """Lock the range `op` covers (as of `base_version`) for a connection
+
+        Returns (lock, conflicting lock, version the lock's range is at).
+        Both locks are None when the range is empty, e.g. because a
+        concurrent edit deleted it.
+        """
+        with self.lock:
+            self.check_moved()
+            op = self.log.rebase(op, base_version or None).clamp(len(self.buffer))
+            if not op.length:
+                return None, None, self.version
+            lock, conflict = self.locks.acquire(channel, user_id, user, section, op.position, op.end)
+            return lock, conflict, self.version
+
+    def release_lock(self, channel, section):
+        with self.lock:
+            self.check_moved()
+            return self.locks.release(channel, section)
+
+    def release_locks(self, channel):
+        with self.lock:
+            return self.locks.release_channel(channel)
+
+    def take_lapsed_locks(self):
+        """Locks dropped since the last call, unannounced
+
+        Their lease ran out, or their text was deleted by an edit or an
+        `overwrite`.
+        """
+        with self.lock:
+            return self.locks.take_lapsed()
+
+    def snapshot(self):
+        """Consistent (content, version) pair for persisting"""
+        with self.lock:
+            return str(self.buffer), self.version
+
+    def check_moved(self):
+        if self.moved_to is not None:
+            raise SessionMovedError(self.moved_to)
+
+    def export(self, owner):
+        """Stop applying ops here and return the state for `owner`
+
+        Anything that touches the session afterwards raises
+        SessionMovedError, so the exported state is final.
+        """
+        with self.lock:
+            self.moved_to = owner
+            return {
+                'document_id': self.document_id,
+                'content': str(self.buffer),
+                'version': self.version,
+                'persisted_version': self.persisted_version,
+                'ops': [list(op) for op in self.log.ops],
+                'acks': [[user_id, op_id, version] for (user_id, op_id), version in self.acks.items()],
+                'locks': self.locks.export(),
+            }
+
+
+class DocumentSessionRegistry:
+    """Per-process registry of live document sessions with write-behind flushing"""
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, document_id):
+        with self.lock:
+            return self.sessions.get(int(document_id))
+
+    def all(self):
+        with self.lock:
+            return list(self.sessions.values())
+
+    async def open(self, document_id, connect=True):
+        """Get or load the session for a document; `connect` registers a connection"""
+        document_id = int(document_id)
+        session = self.get(document_id)
+        if session is None:
+            loaded = await self.load(document_id)
+            if loaded is None:
+                return None
+            with self.lock:
+                session = self.sessions.setdefault(document_id, loaded)
+        if connect:
+            with self.lock:
+                session.connections += 1
+        return session
+
+    def install(self, session):
+        """Adopt a session handed over by another worker; False if one is live here"""
+        with self.lock:
+            if session.document_id in self.sessions:
+                return False
+            self.sessions[session.document_id] = session
+            return True
+
+    def release(self, session, owner):
+        """Drop a session that now belongs to `owner`; returns its state"""
+        state = session.export(owner)
+        with self.lock:
+            if self.sessions.get(session.document_id) is session:
+                del self.sessions[session.document_id]
+        if session.flush_handle is not None:
+            session.flush_handle.cancel()
+            session.flush_handle = None
+        return state
+
+    async def close(self, document_id):
+        """Drop a connection and flush/evict the session once nobody is left"""
+        document_id = int(document_id)
+        with self.lock:
+            session = self.sessions.get(document_id)
+            if session is None:
+                return
+            session.connections -= 1
+            if session.connections > 0:
+                return
+        await self.flush(session)
+        with self.lock:
+            # Someone may have rejoined while we were flushing
+            if session.connections <= 0 and self.sessions.get(document_id) is session:
+                del self.sessions[document_id]
+
+    async def apply_edit(self, session, op, base_version=None, user_id=None):
+        """Apply an edit to the session and schedule a debounced flush"""
+        applied = session.apply(op, base_version, user_id)
+        self.schedule_flush(session)
+        return applied
+
+    async def apply_edits(self, session, ops, base_version=None, op_id=None, user_id=None):
+        """Apply a batch of edits to the session and schedule a debounced flush"""
+        applied, version = session.apply_batch(ops, base_version, op_id, user_id)
+        if applied:
+            self.schedule_flush(session)
+        return applied, version
+
+    def schedule_flush(self, session):
+        """Flush after DOCUMENT_SESSION_FLUSH_INTERVAL or DOCUMENT_SESSION_FLUSH_OPS ops"""
+        if session.flush_task is not None and not session.flush_task.done():
+            return
+        loop = asyncio.get_running_loop()
+        if session.unflushed_ops >= settings.DOCUMENT_SESSION_FLUSH_OPS:
+            if session.flush_handle is not None:
+                session.flush_handle.cancel()
+                session.flush_handle = None
+            session.flush_task = loop.create_task(self.flush(session))
+        elif session.flush_handle is None:
+            session.flush_handle = loop.call_later(
+                settings.DOCUMENT_SESSION_FLUSH_INTERVAL,
+                self._flush_later,
+                session
+            )
+
+    def _flush_later(self, session):
+        session.flush_handle = None
+        session.flush_task = asyncio.get_running_loop().create_task(self.flush(session))
+
+    async def flush(self, session):
+        """Write the session's content and version back to Postgres"""
+        if session.flush_handle is not None:
+            session.flush_handle.cancel()
+            session.flush_handle = None
+        if not session.dirty:
+            return
+        content, version = session.snapshot()
+        await database_sync_to_async(self.persist)(session.document_id, content, version)
+        with session.lock:
+            session.persisted_version = max(session.persisted_version, version)
+
+    def flush_all_sync(self):
+        """Blocking flush of every dirty session, for process shutdown"""
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            if session.dirty:
+                content, version = session.snapshot()
+                self.persist(session.document_id, content, version)
+                session.persisted_version = version
+
+    @database_sync_to_async
+    def load(self, document_id):
+        with db_scope('session_load'):
+            row = Document.objects.filter(id=document_id).values('content', 'version').first()
+        if row is None:
+            return None
+        return DocumentSession(document_id, row['content'], row['version'])
+
+    def persist(self, document_id, content, version):
+        with db_scope('session_flush'):
+            # The search vector is refreshed by the same UPDATE
+            Document.objects.filter(id=document_id, version__lt=version).update(
+                content=content,
+                version=version,
+                updated_at=timezone.now(),
+                **get_search_engine().index_fields(content)
+            )
+
+    def overlay(self, document):
+        """Copy live content/version onto a Document instance for REST reads"""
+        session = self.get(document.id)
+        if session is not None:
+            document.content, document.version = session.snapshot()
+        return document
+
+
+document_sessions = DocumentSessionRegistry()
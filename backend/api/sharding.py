@@ -0,0 +1,571 @@
+import asyncio
+import hashlib
+import os
+import socket
+import time
+from bisect import bisect
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .instrumentation import group_send
+from .metrics import registry
+from .session import DocumentSession, SessionMovedError, document_sessions
+from . import wire
+
+
+# A forwarded message that has bounced this often between workers with
+# different views of the ring is dropped and its sender resyncs
+MAX_HOPS = 3
+
+shard_forwards = registry.counter(
+    'collabspace_shard_forwards',
+    'Messages sent to the worker owning a document, by kind',
+    ['kind']
+)
+shard_handoffs = registry.counter(
+    'collabspace_shard_handoffs',
+    'Live document sessions handed to a new owning worker'
+)
+shard_workers = registry.gauge(
+    'collabspace_shard_workers',
+    'Workers in this worker\'s view of the hash ring'
+)
+
+
+class ShardUnavailableError(Exception):
+    """This worker could not join the shard ring within SHARD_START_TIMEOUT"""
+
+
+def _point(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hashing of document rooms onto worker ids
+
+    Each worker gets SHARD_VIRTUAL_NODES points on the ring and owns the
+    rooms that hash up to each of them, so a worker joining or leaving
+    moves only its share of the rooms. Every process computes the same
+    owners from the same set of workers.
+    """
+
+    def __init__(self, workers=()):
+        self.workers = frozenset(workers)
+        points = sorted(
+            (_point(f'{worker}#{index}'), worker)
+            for worker in self.workers
+            for index in range(settings.SHARD_VIRTUAL_NODES)
+        )
+        self.points = [point for point, _ in points]
+        self.owners = [worker for _, worker in points]
+        self.epoch = _point(','.join(sorted(self.workers)))
+
+    def owner(self, document_id):
+        if not self.points:
+            return None
+        index = bisect(self.points, _point(f'document_{document_id}'))
+        return self.owners[index % len(self.owners)]
+
+
+class InMemoryMembership:
+    """Worker registry shared by the routers of a single process"""
+
+    def __init__(self):
+        self.workers = {}
+
+    async def heartbeat(self, worker_id, channel):
+        self.workers[worker_id] = (channel, time.time())
+
+    async def leave(self, worker_id):
+        self.workers.pop(worker_id, None)
+
+    async def live(self):
+        """{worker id: worker channel} for workers seen within SHARD_WORKER_TTL"""
+        deadline = time.time() - settings.SHARD_WORKER_TTL
+        return {
+            worker_id: channel
+            for worker_id, (channel, seen) in self.workers.items()
+            if seen >= deadline
+        }
+
+
+class RedisMembership:
+    """Worker registry shared through Redis
+
+    A hash of worker id -> worker channel and a sorted set of worker id ->
+    last heartbeat; any worker drops the entries of ones that stopped.
+    """
+
+    def __init__(self, url, prefix='shards'):
+        import redis.asyncio
+
+        self.redis = redis.asyncio.from_url(url, decode_responses=True)
+        self.channels_key = f'{prefix}:channels'
+        self.seen_key = f'{prefix}:seen'
+
+    async def heartbeat(self, worker_id, channel):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(self.channels_key, worker_id, channel)
+            pipe.zadd(self.seen_key, {worker_id: time.time()})
+            await pipe.execute()
+
+    async def leave(self, worker_id):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hdel(self.channels_key, worker_id)
+            pipe.zrem(self.seen_key, worker_id)
+            await pipe.execute()
+
+    async def live(self):
+        deadline = time.time() - settings.SHARD_WORKER_TTL
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zrangebyscore(self.seen_key, deadline, '+inf')
+            pipe.zrangebyscore(self.seen_key, '-inf', f'({deadline}')
+            pipe.hgetall(self.channels_key)
+            live, dead, channels = await pipe.execute()
+        if dead:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hdel(self.channels_key, *dead)
+                pipe.zrem(self.seen_key, *dead)
+                await pipe.execute()
+        return {worker_id: channels[worker_id] for worker_id in live if worker_id in channels}
+
+
+memory_membership = InMemoryMembership()
+
+
+class ShardRouter:
+    """Owns live document sessions by consistent hashing across workers
+
+    Workers heartbeat into a registry (SHARD_BACKEND) and build the same
+    HashRing from it. The owner of a document keeps its DocumentSession;
+    sockets on other workers send their edit, edits and lock messages to
+    the owner's worker channel, where they are handled in arrival order
+    per document and answered straight to the socket's channel. Room
+    broadcasts work as before, since groups span workers.
+
+    When the ring changes, each worker hands the sessions it no longer
+    owns to their new owners (content, op log, acks and locks, so clients
+    keep rebasing) and then tells every worker it is done. A new owner
+    waits up to SHARD_HANDOFF_TIMEOUT for that before loading a room from
+    the database. Sockets that used the old owner send it a drain marker
+    and hold their messages until it comes back through the new owner, so
+    each client's ops stay in order. A worker that dies hands nothing
+    off: its rooms are reloaded from the database and their clients
+    resynced. With SHARD_BACKEND = 'none' this worker owns every room.
+    """
+
+    def __init__(self, sessions, worker_id=None, membership=None):
+        self.sessions = sessions
+        self.worker_id = worker_id or settings.SHARD_WORKER_ID or f'{socket.gethostname()}-{os.getpid()}'
+        self._membership = membership
+        self.channel = None
+        self.channels = {}
+        self.ring = HashRing()
+        self.previous = HashRing()
+        self.changed_at = 0.0
+        self.done = {}
+        self.attached = {}
+        self.queues = {}
+        self.task = None
+        self.receiver = None
+        self.ready = None
+        self.handoff = None
+        self.refreshing = None
+
+    @property
+    def enabled(self):
+        return settings.SHARD_BACKEND != 'none'
+
+    @property
+    def membership(self):
+        if self._membership is None:
+            if settings.SHARD_BACKEND == 'redis':
+                self._membership = RedisMembership(settings.SHARD_REDIS_URL)
+            else:
+                self._membership = memory_membership
+        return self._membership
+
+    def owner(self, document_id):
+        if not self.enabled:
+            return self.worker_id
+        return self.ring.owner(document_id)
+
+    def is_alive(self, worker_id):
+        return worker_id in self.channels
+
+    async def start(self):
+        """Join the ring (once per process) and wait until it is known
+
+        Raises ShardUnavailableError if the membership registry doesn't
+        answer within SHARD_START_TIMEOUT; the ring keeps being retried in
+        the background, so a later call can still succeed.
+        """
+        if not self.enabled:
+            return
+        if self.task is None:
+            self.ready = asyncio.Event()
+            self.handoff = asyncio.Condition()
+            self.refreshing = asyncio.Lock()
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        try:
+            await asyncio.wait_for(self.ready.wait(), settings.SHARD_START_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise ShardUnavailableError(
+                f'Worker {self.worker_id} has not joined the shard ring'
+            ) from None
+
+    async def run(self):
+        channel_layer = get_channel_layer()
+        self.channel = await channel_layer.new_channel()
+        self.receiver = asyncio.get_running_loop().create_task(self.receive(channel_layer))
+        while True:
+            try:
+                await self.refresh(channel_layer)
+                self.ready.set()
+            except Exception as e:
+                print(f"Error refreshing shard ring: {e}")
+            await asyncio.sleep(settings.SHARD_HEARTBEAT_INTERVAL)
+
+    async def stop(self):
+        """Leave the ring cleanly, handing every session to its next owner"""
+        if self.task is None:
+            return
+        self.task.cancel()
+        self.task = None
+        await self.membership.leave(self.worker_id)
+        self.channels.pop(self.worker_id, None)
+        if self.channels:
+            await self.rebalance(get_channel_layer(), HashRing(self.channels))
+            # Keep forwarding what is still on its way here until the
+            # other workers have noticed we left
+            await asyncio.sleep(settings.SHARD_HEARTBEAT_INTERVAL * 2)
+        self.receiver.cancel()
+
+    async def refresh(self, channel_layer):
+        """Heartbeat and re-read the membership, rebalancing if it changed
+
+        Also called when another worker sent us something for a room we
+        don't own, since then one of the two views is behind.
+        """
+        async with self.refreshing:
+            if self.task is None:
+                # Stopped: don't heartbeat back into the ring
+                return
+            await self.membership.heartbeat(self.worker_id, self.channel)
+            channels = await self.membership.live()
+            channels[self.worker_id] = self.channel
+            self.channels = channels
+            if frozenset(channels) != self.ring.workers:
+                await self.rebalance(channel_layer, HashRing(channels))
+
+    async def rebalance(self, channel_layer, ring):
+        """Move to a new ring: hand off the sessions we lost, then say so"""
+        # On our first view, the rooms we own came from the ring without us
+        self.previous = self.ring if self.ring.workers else HashRing(ring.workers - {self.worker_id})
+        self.ring = ring
+        self.changed_at = time.monotonic()
+        shard_workers.set(len(ring.workers))
+
+        for session in self.sessions.all():
+            owner = ring.owner(session.document_id)
+            if owner != self.worker_id and session.moved_to is None:
+                await self.hand_off(channel_layer, session, owner)
+        for worker_id, channel in self.channels.items():
+            if worker_id != self.worker_id:
+                await channel_layer.send(channel, {
+                    'type': 'shard.done',
+                    'worker': self.worker_id,
+                    'epoch': ring.epoch
+                })
+        # Sockets here follow their rooms to the new owners
+        for document_id, channels in list(self.attached.items()):
+            if self.previous.owner(document_id) != ring.owner(document_id):
+                for channel in channels:
+                    await channel_layer.send(channel, {'type': 'shard.rebalanced'})
+        async with self.handoff:
+            self.handoff.notify_all()
+
+    async def hand_off(self, channel_layer, session, owner):
+        """Pass a live session to its new owner, then persist it here too"""
+        state = self.sessions.release(session, owner)
+        await channel_layer.send(self.channels[owner], {'type': 'shard.handoff', 'hops': 0, **state})
+        shard_handoffs.inc()
+        # The new owner flushes it as well; this covers it dying first.
+        # Not awaited, so the new owners hear we're done sooner
+        asyncio.get_running_loop().create_task(self.sessions.flush(session))
+
+    async def receive(self, channel_layer):
+        while True:
+            message = await channel_layer.receive(self.channel)
+            try:
+                if message['type'] == 'shard.handoff':
+                    await self.accept_handoff(channel_layer, message)
+                elif message['type'] == 'shard.done':
+                    self.done[message['worker']] = message['epoch']
+                    async with self.handoff:
+                        self.handoff.notify_all()
+                else:
+                    self.dispatch(channel_layer, message)
+            except Exception as e:
+                print(f"Error receiving shard message: {e}")
+
+    async def accept_handoff(self, channel_layer, state):
+        document_id = state['document_id']
+        if self.owner(document_id) != self.worker_id:
+            await self.refresh(channel_layer)
+        owner = self.owner(document_id)
+        if owner != self.worker_id and state['hops'] < MAX_HOPS:
+            # The ring moved on again; pass it along
+            await channel_layer.send(self.channels[owner], {**state, 'hops': state['hops'] + 1})
+            return
+        if not self.sessions.install(DocumentSession.from_state(state)):
+            print(f"Dropped late handoff of document {document_id}: it was already loaded here")
+        async with self.handoff:
+            self.handoff.notify_all()
+
+    def dispatch(self, channel_layer, message):
+        """Handle a message in a task, in arrival order per document"""
+        document_id = message['document_id']
+        queue = self.queues.get(document_id)
+        if queue is None:
+            queue = self.queues[document_id] = [asyncio.Lock(), 0]
+        queue[1] += 1
+        asyncio.get_running_loop().create_task(self.process(channel_layer, message, queue))
+
+    async def process(self, channel_layer, message, queue):
+        # asyncio.Lock wakes waiters first come, first served
+        try:
+            async with queue[0]:
+                await self.handle(channel_layer, message)
+        except Exception as e:
+            print(f"Error handling {message['type']}: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            queue[1] -= 1
+            if not queue[1] and self.queues.get(message['document_id']) is queue:
+                del self.queues[message['document_id']]
+
+    async def handle(self, channel_layer, message):
+        from .consumers import ForwardedMessage
+
+        kind = message['type']
+        document_id = message['document_id']
+        session = self.sessions.get(document_id)
+        if session is None and self.owner(document_id) != self.worker_id:
+            await self.refresh(channel_layer)
+        if session is None and self.owner(document_id) != self.worker_id:
+            if kind == 'shard.call':
+                await channel_layer.send(message['origin'], {'type': 'shard.reply'})
+            else:
+                await self.forward(channel_layer, message)
+            return
+
+        if kind == 'shard.leave':
+            if session is not None:
+                forwarded = ForwardedMessage(self, session, message, channel_layer)
+                for lock in session.release_locks(message['origin']):
+                    await forwarded.broadcast_unlock(lock)
+                if message['joined']:
+                    await self.sessions.close(document_id)
+            return
+        if kind == 'shard.call':
+            await self.answer(channel_layer, message, session)
+            return
+
+        session = await self.session_for(document_id, connect=kind == 'shard.join')
+        if session is None:
+            return
+        forwarded = ForwardedMessage(self, session, message, channel_layer)
+        if kind == 'shard.join':
+            if message['resync']:
+                await forwarded.send_resync()
+        elif kind == 'shard.drain':
+            await channel_layer.send(message['origin'], {
+                'type': 'shard.drained',
+                'switch': message['switch']
+            })
+        else:
+            await forwarded.handle_session_message(message['data'])
+
+    async def forward(self, channel_layer, message):
+        """Pass a message on to the owner in our view of the ring"""
+        if message['hops'] >= MAX_HOPS:
+            if message['type'] != 'shard.leave':
+                await channel_layer.send(message['origin'], {'type': 'shard.bounced'})
+            return
+        shard_forwards.labels(message['type'][len('shard.'):]).inc()
+        message = {**message, 'hops': message['hops'] + 1}
+        if message['type'] == 'shard.leave':
+            # The socket joined the session here, before it moved on
+            message['joined'] = False
+        await channel_layer.send(self.channels[self.owner(message['document_id'])], message)
+
+    async def send(self, worker_id, kind, document_id, origin, **fields):
+        """Send a socket's message about a document to a worker"""
+        channel = self.channels.get(worker_id)
+        if channel is None:
+            # Gone since the socket looked; its successor will forward it
+            channel = self.channels[self.owner(document_id)]
+        shard_forwards.labels(kind).inc()
+        await get_channel_layer().send(channel, {
+            'type': f'shard.{kind}',
+            'document_id': int(document_id),
+            'origin': origin,
+            'hops': 0,
+            **fields
+        })
+
+    async def session_for(self, document_id, connect=False):
+        """This worker's session for a room it owns, once any handoff is in"""
+        if self.sessions.get(document_id) is None:
+            await self.await_handoff(int(document_id))
+        return await self.sessions.open(document_id, connect)
+
+    async def await_handoff(self, document_id):
+        """Give the room's previous owner time to hand its session over"""
+        if not self.enabled:
+            return
+        previous = self.previous.owner(document_id)
+        if previous is None or previous == self.worker_id or not self.is_alive(previous):
+            return
+
+        def arrived():
+            return (
+                self.done.get(previous) == self.ring.epoch
+                or self.sessions.get(document_id) is not None
+            )
+
+        remaining = self.changed_at + settings.SHARD_HANDOFF_TIMEOUT - time.monotonic()
+        if arrived() or remaining <= 0:
+            return
+        async with self.handoff:
+            try:
+                await asyncio.wait_for(self.handoff.wait_for(arrived), remaining)
+            except asyncio.TimeoutError:
+                print(f"No handoff of document {document_id} from {previous}; loading it from the database")
+
+    def attach(self, document_id, channel):
+        """Tell this socket when its room changes owner"""
+        self.attached.setdefault(int(document_id), set()).add(channel)
+
+    def detach(self, document_id, channel):
+        channels = self.attached.get(int(document_id))
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.attached[int(document_id)]
+
+    async def answer(self, channel_layer, message, session):
+        """Run a REST view's call against the live session, if there is one"""
+        reply = {'type': 'shard.reply'}
+        if session is not None:
+            try:
+                if message['method'] == 'overwrite':
+                    reply['content'], reply['version'] = session.overwrite(message['content'])
+                    await self.announce_lapsed_locks(session)
+                else:
+                    reply['content'], reply['version'] = session.snapshot()
+            except SessionMovedError:
+                pass
+        await channel_layer.send(message['origin'], reply)
+
+    async def announce_lapsed_locks(self, session):
+        """Tell the room about the section locks an overwrite lapsed"""
+        for lock in session.take_lapsed_locks():
+            await group_send(get_channel_layer(), f'document_{session.document_id}', {
+                'type': 'room_frame',
+                'skip_channel': None,
+                **wire.frame(lock.unlock_event())
+            })
+
+    async def call(self, document_id, method, **fields):
+        """`snapshot` or `overwrite` the live session on the owning worker
+
+        Returns its (content, version), or None if the room isn't live.
+        """
+        await self.start()
+        if self.owner(document_id) == self.worker_id:
+            session = self.sessions.get(document_id)
+            if session is None:
+                return None
+            try:
+                if method == 'overwrite':
+                    live = session.overwrite(fields['content'])
+                    await self.announce_lapsed_locks(session)
+                    return live
+                return session.snapshot()
+            except SessionMovedError:
+                return None
+
+        channel_layer = get_channel_layer()
+        reply_channel = await channel_layer.new_channel()
+        await self.send(self.owner(document_id), 'call', document_id, reply_channel, method=method, **fields)
+        try:
+            reply = await asyncio.wait_for(channel_layer.receive(reply_channel), settings.SHARD_CALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"No reply from the owner of document {document_id} to {method}")
+            return None
+        if 'version' not in reply:
+            return None
+        return reply['content'], reply['version']
+
+    def join(self):
+        """`start` for REST views, so they fail before writing anything"""
+        if self.enabled:
+            async_to_sync(self.start)()
+
+    def overlay(self, document):
+        """Copy live content/version onto a Document instance for REST reads"""
+        if not self.enabled:
+            return self.sessions.overlay(document)
+        live = async_to_sync(self.call)(document.id, 'snapshot')
+        if live is not None:
+            document.content, document.version = live
+        return document
+
+    def overwrite(self, document_id, content=None):
+        """Record a REST save on the live session and resync its editors
+
+        The save replaces the whole body, so the room is also told its
+        section locks are gone. Returns the session's (content, version), or None if there isn't one.
+        """
+        if not self.enabled:
+            session = self.sessions.get(document_id)
+            live = None
+            if session is not None:
+                live = session.overwrite(content)
+                async_to_sync(self.announce_lapsed_locks)(session)
+        else:
+            live = async_to_sync(self.call)(document_id, 'overwrite', content=content)
+        if live is not None:
+            # Editors restart from the saved body; no edit frame covers it
+            async_to_sync(group_send)(get_channel_layer(), f'document_{document_id}', {
+                'type': 'room_frame',
+                'skip_channel': None,
+                **wire.frame({'type': 'resync', 'content': live[0], 'version': live[1]})
+            })
+        return live
+
+
+shard_router = ShardRouter(document_sessions)
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan: hand sessions off before the worker exits
+
+    Only servers that speak the lifespan protocol (uvicorn, hypercorn)
+    call this. Daphne and runserver don't, so a worker they stop leaves
+    the ring like a crashed one: its rooms are reloaded from the database
+    once SHARD_WORKER_TTL passes and their clients resynced.
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shard_router.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,226 @@
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class S3UploadStorage:
+    """Uploads to the S3 bucket through one pooled client
+
+    boto3 clients are thread-safe, so every request and upload part
+    shares a single client and its connection pool instead of building a
+    new one (and new TLS connections) per upload.
+    """
+
+    def __init__(self):
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = settings.AWS_STORAGE_BUCKET_NAME
+        self.client = boto3.client(
+            's3',
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            region_name=settings.AWS_S3_REGION_NAME,
+            config=Config(max_pool_connections=settings.UPLOAD_WORKERS)
+        )
+
+    @staticmethod
+    def is_configured():
+        return bool(settings.AWS_ACCESS_KEY_ID)
+
+    def url(self, key):
+        return f'https://{self.bucket}.s3.amazonaws.com/{key}'
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def begin(self, key):
+        return self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+
+    def upload_part(self, key, upload_id, number, data):
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data
+        )
+        return {'PartNumber': number, 'ETag': response['ETag']}
+
+    def complete(self, key, upload_id, parts):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])}
+        )
+
+    def abort(self, key, upload_id):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+class LocalUploadStorage:
+    """Filesystem stand-in for S3 under UPLOAD_LOCAL_ROOT
+
+    Parts are written concurrently at their final offsets (every part but
+    the last is exactly UPLOAD_PART_SIZE), so it exercises the same
+    parallel path as S3 for development and offline benchmarks.
+    """
+
+    def __init__(self, root=None):
+        self.root = str(root or settings.UPLOAD_LOCAL_ROOT)
+
+    @staticmethod
+    def is_configured():
+        return True
+
+    def path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f'Invalid upload key {key!r}')
+        return path
+
+    def url(self, key):
+        return f'{settings.MEDIA_URL}{key}'
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def begin(self, key):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # One part file per upload, so concurrent uploads of a name don't clash
+        fd, part_path = tempfile.mkstemp(
+            prefix=f'.{os.path.basename(path)}.', suffix='.part', dir=os.path.dirname(path)
+        )
+        os.fchmod(fd, 0o644)
+        os.close(fd)
+        return part_path
+
+    def upload_part(self, key, upload_id, number, data):
+        fd = os.open(upload_id, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, (number - 1) * settings.UPLOAD_PART_SIZE)
+        finally:
+            os.close(fd)
+        return {'PartNumber': number}
+
+    def complete(self, key, upload_id, parts):
+        os.replace(upload_id, self.path(key))
+
+    def abort(self, key, upload_id):
+        try:
+            os.remove(upload_id)
+        except FileNotFoundError:
+            pass
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+UPLOAD_STORAGES = {
+    's3': S3UploadStorage,
+    'local': LocalUploadStorage,
+}
+
+_storage = None
+_storage_lock = threading.Lock()
+_executor = None
+
+
+def get_storage():
+    """The configured UPLOAD_STORAGE backend, created once per process"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = UPLOAD_STORAGES[settings.UPLOAD_STORAGE]()
+    return _storage
+
+
+def get_executor():
+    """Thread pool shared by every upload's part transfers"""
+    global _executor
+    if _executor is None:
+        with _storage_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.UPLOAD_WORKERS,
+                    thread_name_prefix='upload-part'
+                )
+    return _executor
+
+
+class ParallelUpload:
+    """Streams bytes to storage as concurrent multipart parts
+
+    Data is cut into UPLOAD_PART_SIZE parts; at most UPLOAD_CONCURRENCY
+    parts per upload are in flight, and `write` blocks while they are, so
+    memory stays around (UPLOAD_CONCURRENCY + 1) * UPLOAD_PART_SIZE no
+    matter how big the file is. Files smaller than one part are sent with
+    a single put.
+    """
+
+    def __init__(self, key, storage=None):
+        self.key = key
+        self.storage = storage or get_storage()
+        self.part_size = settings.UPLOAD_PART_SIZE
+        self.slots = threading.BoundedSemaphore(settings.UPLOAD_CONCURRENCY)
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.futures = []
+        self.size = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= self.part_size:
+            with memoryview(self.buffer) as view:
+                part = bytes(view[:self.part_size])
+            del self.buffer[:self.part_size]
+            self.submit(part)
+
+    def submit(self, part):
+        if self.upload_id is None:
+            self.upload_id = self.storage.begin(self.key)
+        self.slots.acquire()
+        number = len(self.futures) + 1
+        future = get_executor().submit(self.storage.upload_part, self.key, self.upload_id, number, part)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def complete(self):
+        """Send what is left and finish the upload; returns the file's URL"""
+        try:
+            if self.upload_id is None:
+                self.storage.put(self.key, bytes(self.buffer))
+            else:
+                if self.buffer:
+                    self.submit(bytes(self.buffer))
+                parts = [future.result() for future in self.futures]
+                self.storage.complete(self.key, self.upload_id, parts)
+        except Exception:
+            self.abort()
+            raise
+        # Finished: there is no multipart upload left to abort
+        self.upload_id = None
+        self.futures = []
+        self.buffer = bytearray()
+        return self.storage.url(self.key)
+
+    def abort(self):
+        for future in self.futures:
+            future.cancel()
+        if self.upload_id is not None:
+            for future in self.futures:
+                if not future.cancelled():
+                    future.exception()
+            self.storage.abort(self.key, self.upload_id)
+            self.upload_id = None
+
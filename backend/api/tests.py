@@ -0,0 +1,239 @@
+import random
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .locks import SectionLocks
+from .models import Document, UserProfile
+from .ot import Operation, OpLog, StaleVersionError, transform
+from .session import DocumentSession
+from .views import DocumentViewSet
+
+
+def random_op(rng, size):
+    position = rng.randint(0, size)
+    length = rng.randint(0, min(4, size - position)) if rng.random() < 0.5 else 0
+    text = ''.join(rng.choice('xyz') for _ in range(rng.choice([0, 1, 1, 2, 5])))
+    if not length and not text:
+        text = 'q'
+    return Operation(position, length, text)
+
+
+class Client:
+    """Editor with one batch of ops in flight and later edits buffered
+
+    Mirrors EditSync in frontend/src/services/ot.js: a batch is sent on
+    the version the client has seen, and remote ops are carried past the
+    unacknowledged ones the way the server rebases those against them.
+    """
+
+    def __init__(self, name, text, version, batch_size):
+        self.name = name
+        self.text = text
+        self.version = version
+        self.batch_size = batch_size
+        self.inflight = []
+        self.buffer = []
+        self.next_op_id = 1
+
+    def edit(self, op, outbox):
+        self.text = op.apply(self.text)
+        self.buffer.append(op)
+        self.flush(outbox)
+
+    def flush(self, outbox):
+        if not self.inflight and self.buffer:
+            self.inflight = self.buffer[:self.batch_size]
+            self.buffer = self.buffer[self.batch_size:]
+            outbox.append((self.name, (self.name, self.next_op_id), self.inflight, self.version))
+            self.next_op_id += 1
+
+    def receive(self, origin, ops, version, outbox):
+        self.version = version
+        if origin == self.name:
+            # Our own batch coming back is the ack
+            self.inflight = []
+            self.flush(outbox)
+            return
+        for op in ops:
+            pending = []
+            for mine in self.inflight + self.buffer:
+                pending.append(transform(mine, op, False))
+                op = transform(op, mine, True)
+            self.inflight, self.buffer = pending[:len(self.inflight)], pending[len(self.inflight):]
+            self.text = op.apply(self.text)
+
+
+def simulate(rng):
+    """One randomized session; returns (server text, {client: text})"""
+    text = ''.join(rng.choice('abcdef') for _ in range(rng.randint(0, 20)))
+    session = DocumentSession(1, text, 1)
+    batch_size = rng.choice([1, 1, 3, 8])
+    clients = [Client(name, text, 1, batch_size) for name in range(rng.randint(2, 5))]
+    outbox = []
+    inboxes = {client.name: [] for client in clients}
+
+    def deliver(origin, op_id, ops, base):
+        applied, version = session.apply_batch(ops, base, op_id)
+        for inbox in inboxes.values():
+            inbox.append((origin, applied, version))
+
+    for _ in range(rng.randint(10, 80)):
+        action = rng.random()
+        client = rng.choice(clients)
+        if action < 0.4:
+            client.edit(random_op(rng, len(client.text)), outbox)
+        elif action < 0.7 and outbox:
+            deliver(*outbox.pop(0))
+        elif inboxes[client.name]:
+            client.receive(*inboxes[client.name].pop(0), outbox)
+    # Drain everything still in flight
+    while outbox or any(inboxes.values()):
+        while outbox:
+            deliver(*outbox.pop(0))
+        for client in clients:
+            while inboxes[client.name]:
+                client.receive(*inboxes[client.name].pop(0), outbox)
+    return str(session.buffer), {client.name: client.text for client in clients}
+
+
+class TransformTests(SimpleTestCase):
+    def test_transform_converges_for_random_pairs(self):
+        rng = random.Random(3)
+        for _ in range(5000):
+            text = ''.join(rng.choice('abcdef') for _ in range(rng.randint(0, 12)))
+            a, b = random_op(rng, len(text)), random_op(rng, len(text))
+            left = transform(b, a).apply(a.apply(text))
+            right = transform(a, b, True).apply(b.apply(text))
+            self.assertEqual(left, right, (text, a, b))
+
+    def test_rebase_batch_carries_concurrent_ops_past_earlier_batch_ops(self):
+        log = OpLog(1)
+        log.append(Operation(0, 0, 'ab'))
+        # Typed "xy" at the start of version 1, as two ops
+        batch = log.rebase_batch([Operation(0, 0, 'x'), Operation(1, 0, 'y')], 1)
+        text = 'ab'
+        for op in batch:
+            text = op.apply(text)
+        self.assertEqual(text, 'abxy')
+
+    def test_rebase_rejects_versions_outside_the_log(self):
+        log = OpLog(1, maxlen=2)
+        for _ in range(3):
+            log.append(Operation(0, 0, 'a'))
+        with self.assertRaises(StaleVersionError):
+            log.rebase(Operation(0, 0, 'b'), 1)
+
+
+class ConvergenceTests(SimpleTestCase):
+    """Concurrent, interleaved editors through a real DocumentSession"""
+
+    def test_replicas_match_the_session(self):
+        for seed in range(300):
+            with self.subTest(seed=seed):
+                server, clients = simulate(random.Random(seed))
+                for name, text in clients.items():
+                    self.assertEqual(text, server, f'client {name} diverged')
+
+    def test_single_edits_are_based_on_the_acked_version(self):
+        session = DocumentSession(1, 'hello', 1)
+        _, version = session.apply_batch([Operation(5, 0, '!')], 1, op_id=(1, 1))
+        self.assertEqual(version, 2)
+        # A concurrent edit still based on version 1 lands after it
+        session.apply_batch([Operation(0, 0, '>')], 1, op_id=(2, 1))
+        # The first editor's next op is based on its ack, not on version 1
+        session.apply_batch([Operation(6, 0, '?')], version, op_id=(1, 2))
+        self.assertEqual(str(session.buffer), '>hello!?')
+
+    def test_retransmitted_batch_is_acked_without_reapplying(self):
+        session = DocumentSession(1, '', 1)
+        session.apply_batch([Operation(0, 0, 'a')], 1, op_id=(1, 1))
+        applied, version = session.apply_batch([Operation(0, 0, 'a')], 1, op_id=(1, 1))
+        self.assertIsNone(applied)
+        self.assertEqual((str(session.buffer), version), ('a', 2))
+
+
+class LapsedLockTests(SimpleTestCase):
+    """Locks dropped without a release are handed over to be announced"""
+
+    def test_expired_lease_is_lapsed_when_found(self):
+        locks = SectionLocks()
+        lock, _ = locks.acquire('a', 1, 'alice', 'intro', 0, 5)
+        lock.expires = 0
+        granted, conflict = locks.acquire('b', 2, 'bob', 'intro', 2, 4)
+        self.assertIsNotNone(granted)
+        self.assertIsNone(conflict)
+        self.assertEqual(locks.take_lapsed(), [lock])
+        self.assertEqual(locks.take_lapsed(), [])
+
+    def test_holder_deleting_the_text_lapses_the_lock(self):
+        session = DocumentSession(1, 'hello world', 1)
+        lock, _, version = session.acquire_lock('a', 1, 'alice', 'intro', Operation(0, 5, ''))
+        session.apply_batch([Operation(0, 5, '')], version, user_id=1)
+        self.assertEqual(session.take_lapsed_locks(), [lock])
+
+    def test_overwrite_lapses_every_lock(self):
+        session = DocumentSession(1, 'hello world', 1)
+        first, _, _ = session.acquire_lock('a', 1, 'alice', 'intro', Operation(0, 5, ''))
+        second, _, _ = session.acquire_lock('b', 2, 'bob', 'outro', Operation(6, 5, ''))
+        session.overwrite('fresh')
+        self.assertEqual(session.take_lapsed_locks(), [first, second])
+        self.assertEqual(len(session.locks), 0)
+
+
+# Documents visible to the user, then collaborators and their profiles
+FULL_LIST_QUERIES = 3
+# One annotated query: no content, collaborators counted
+SUMMARY_LIST_QUERIES = 1
+
+
+def make_user(username):
+    user = User.objects.create_user(username, f'{username}@example.com', username)
+    UserProfile.objects.create(user=user, role='editor')
+    return user
+
+
+class DocumentListQueryTests(TestCase):
+    """Listing documents costs the same queries however many there are"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('owner')
+        cls.collaborators = [make_user(f'collaborator{index}') for index in range(3)]
+
+    def add_documents(self, count):
+        documents = Document.objects.bulk_create(
+            Document(title=f'doc {index}', content='x' * 100, owner=self.owner) for index in range(count)
+        )
+        through = Document.collaborators.through
+        through.objects.bulk_create(
+            through(document_id=document.id, user_id=user.id)
+            for document in documents for user in self.collaborators
+        )
+
+    def list_documents(self, queries, **params):
+        request = APIRequestFactory().get('/api/documents/', params)
+        force_authenticate(request, user=self.owner)
+        with self.assertNumQueries(queries):
+            response = DocumentViewSet.as_view({'get': 'list'})(request)
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_full_list(self):
+        for total in (1, 10, 50):
+            self.add_documents(total - Document.objects.count())
+            with self.subTest(documents=total):
+                documents = self.list_documents(FULL_LIST_QUERIES)
+                self.assertEqual(len(documents), total)
+                self.assertEqual(len(documents[0]['collaborators']), 3)
+
+    def test_summary_list(self):
+        for total in (1, 10, 50):
+            self.add_documents(total - Document.objects.count())
+            with self.subTest(documents=total):
+                documents = self.list_documents(SUMMARY_LIST_QUERIES, summary=1)
+                self.assertEqual(len(documents), total)
+                self.assertEqual(documents[0]['collaborator_count'], 3)
+                self.assertNotIn('content', documents[0])
@@ -0,0 +1,186 @@
+import random
+
+
+CHUNK_SIZE = 512
+
+_random = random.Random()
+
+
+class _Node:
+    __slots__ = ('text', 'priority', 'left', 'right', 'size')
+
+    def __init__(self, text, priority=None):
+        self.text = text
+        self.priority = _random.random() if priority is None else priority
+        self.left = None
+        self.right = None
+        self.size = len(text)
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _update(node):
+    node.size = len(node.text) + _size(node.left) + _size(node.right)
+
+
+def _merge(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _split(node, position):
+    """Split into (first `position` chars, rest), cutting a chunk if needed"""
+    if node is None:
+        return None, None
+    left_size = _size(node.left)
+    if position <= left_size:
+        left, right = _split(node.left, position)
+        node.left = right
+        _update(node)
+        return left, node
+    end = left_size + len(node.text)
+    if position >= end:
+        left, right = _split(node.right, position - end)
+        node.right = left
+        _update(node)
+        return node, right
+    offset = position - left_size
+    tail = _Node(node.text[offset:])
+    node.text = node.text[:offset]
+    right = _merge(tail, node.right)
+    node.right = None
+    _update(node)
+    return node, right
+
+
+def _edit_in_chunk(node, position, length, text):
+    """Edit in place when the range falls inside one chunk that has room"""
+    if node is None:
+        return False
+    left_size = _size(node.left)
+    end = left_size + len(node.text)
+    if position < left_size:
+        if position + length > left_size:
+            return False
+        edited = _edit_in_chunk(node.left, position, length, text)
+    elif position + length <= end and (position < end or not length):
+        offset = position - left_size
+        if len(node.text) - length + len(text) > CHUNK_SIZE:
+            return False
+        node.text = node.text[:offset] + text + node.text[offset + length:]
+        edited = True
+    elif position >= end:
+        edited = _edit_in_chunk(node.right, position - end, length, text)
+    else:
+        return False
+    if edited:
+        _update(node)
+    return edited
+
+
+def _collect(node, start, end, parts):
+    if node is None or start >= node.size or end <= 0:
+        return
+    left_size = _size(node.left)
+    if start < left_size:
+        _collect(node.left, start, end, parts)
+    text_end = left_size + len(node.text)
+    if start < text_end and end > left_size:
+        parts.append(node.text[max(0, start - left_size):end - left_size])
+    if end > text_end:
+        _collect(node.right, start - text_end, end - text_end, parts)
+
+
+def _build(text):
+    """Build a treap from a string in O(n) (Cartesian tree over chunk priorities)"""
+    stack = []
+    for start in range(0, len(text), CHUNK_SIZE):
+        node = _Node(text[start:start + CHUNK_SIZE])
+        last = None
+        while stack and stack[-1].priority < node.priority:
+            last = stack.pop()
+            _update(last)
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+    while len(stack) > 1:
+        _update(stack.pop())
+    if not stack:
+        return None
+    root = stack[0]
+    _update(root)
+    return root
+
+
+class TextBuffer:
+    """Rope of text chunks (an implicit treap) with O(log n) positional edits
+
+    Edits never copy the whole body; ``str(buffer)`` materializes the text
+    and is cached until the next edit, so it is only paid when persisting
+    or serving a REST read.
+    """
+
+    def __init__(self, text=''):
+        self.root = _build(text)
+        self._text = text
+
+    def __len__(self):
+        return _size(self.root)
+
+    def __str__(self):
+        if self._text is None:
+            parts = []
+            stack = []
+            node = self.root
+            while stack or node is not None:
+                while node is not None:
+                    stack.append(node)
+                    node = node.left
+                node = stack.pop()
+                parts.append(node.text)
+                node = node.right
+            self._text = ''.join(parts)
+        return self._text
+
+    def __repr__(self):
+        return f'TextBuffer(len={len(self)})'
+
+    def _clamp(self, position):
+        return max(0, min(position, len(self)))
+
+    def replace(self, position, length, text):
+        """Replace `length` chars at `position` with `text`"""
+        position = self._clamp(position)
+        length = max(0, min(length, len(self) - position))
+        if not length and not text:
+            return
+        self._text = None
+        if _edit_in_chunk(self.root, position, length, text):
+            return
+        left, rest = _split(self.root, position)
+        _, right = _split(rest, length)
+        self.root = _merge(_merge(left, _build(text)), right)
+
+    def insert(self, position, text):
+        self.replace(position, 0, text)
+
+    def delete(self, position, length=1):
+        self.replace(position, length, '')
+
+    def substring(self, start, end):
+        """Text in [start, end) without materializing the whole body"""
+        parts = []
+        _collect(self.root, self._clamp(start), self._clamp(end), parts)
+        return ''.join(parts)
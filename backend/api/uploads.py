@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .activity import activity_log
+from .dashboard import user_group
+from .instrumentation import group_send
+from .metrics import registry
+from .models import FileUpload
+from .storage import ParallelUpload
+
+
+upload_jobs_pending = registry.gauge(
+    'collabspace_upload_jobs_pending',
+    'Upload jobs queued or running'
+)
+upload_jobs_rejected = registry.counter(
+    'collabspace_upload_jobs_rejected',
+    'Uploads refused because the job queue was full'
+)
+upload_job_seconds = registry.histogram(
+    'collabspace_upload_job_seconds',
+    'Time from job start to the file being in storage',
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+
+
+class UploadJobQueue:
+    """Moves spooled uploads to storage off the request thread
+
+    The view spools the request body to a temporary file and hands it
+    over here; UPLOAD_JOB_WORKERS threads transfer files with
+    ParallelUpload, at most UPLOAD_JOB_QUEUE_SIZE jobs are accepted at a
+    time, and progress, completion and failure are pushed to the
+    uploader's dashboard_<user_id> group. FileUpload and ActivityLog rows
+    are written once the file is in storage.
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, document, user, path, file_name, size):
+        """Queue a transfer of the file at `path`; returns its job ID, or None when full"""
+        with self.lock:
+            if self.pending >= settings.UPLOAD_JOB_QUEUE_SIZE:
+                upload_jobs_rejected.inc()
+                return None
+            self.pending += 1
+            upload_jobs_pending.set(self.pending)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=settings.UPLOAD_JOB_WORKERS,
+                    thread_name_prefix='upload-job'
+                )
+        job_id = uuid.uuid4().hex
+        self.executor.submit(self.run, {
+            'job_id': job_id,
+            'document_id': document.id,
+            'user_id': user.id,
+            'file_name': file_name,
+            'total': size,
+        }, path)
+        return job_id
+
+    def notify(self, job, event_type, **fields):
+        async_to_sync(group_send)(
+            get_channel_layer(),
+            user_group(job['user_id']),
+            {'type': event_type, **job, **fields}
+        )
+
+    def discard(self, upload, stored):
+        """Abort an unfinished transfer, or delete a stored file no row points to"""
+        try:
+            if stored:
+                upload.storage.delete(upload.key)
+            else:
+                upload.abort()
+        except Exception as e:
+            print(f"Could not clean up upload {upload.key}: {e}")
+
+    def run(self, job, path):
+        start = time.perf_counter()
+        upload = ParallelUpload(f"documents/{job['document_id']}/{job['file_name']}")
+        file_url = file_upload = None
+        try:
+            close_old_connections()
+            sent = 0
+            report_at = 0
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(settings.UPLOAD_PART_SIZE)
+                    if not chunk:
+                        break
+                    upload.write(chunk)
+                    sent += len(chunk)
+                    if time.monotonic() >= report_at:
+                        report_at = time.monotonic() + settings.UPLOAD_PROGRESS_INTERVAL
+                        self.notify(job, 'upload_progress', sent=sent)
+            file_url = upload.complete()
+            upload_job_seconds.observe(time.perf_counter() - start)
+
+            file_upload = FileUpload.objects.create(
+                document_id=job['document_id'],
+                uploaded_by_id=job['user_id'],
+                file_name=job['file_name'],
+                file_url=file_url,
+                file_size=job['total']
+            )
+            activity_log.record(
+                user_id=job['user_id'],
+                document_id=job['document_id'],
+                action='upload',
+                description=f"Uploaded file \"{job['file_name']}\""
+            )
+            self.notify(job, 'upload_complete', file_upload_id=file_upload.id, file_url=file_url)
+        except Exception as e:
+            print(f"Upload job {job['job_id']} failed: {e}")
+            if file_upload is None:
+                self.discard(upload, file_url is not None)
+            self.notify(job, 'upload_failed', error=str(e))
+        finally:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            connection.close()
+            with self.lock:
+                self.pending -= 1
+                upload_jobs_pending.set(self.pending)
+
+
+upload_jobs = UploadJobQueue()
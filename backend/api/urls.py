@@ -3,11 +3,14 @@ from rest_framework.routers import DefaultRouter
 from . import views
 
 router = DefaultRouter()
+router.register(r'workspaces', views.WorkspaceViewSet, basename='workspace')
 router.register(r'documents', views.DocumentViewSet, basename='document')
 router.register(r'activities', views.ActivityLogViewSet, basename='activity')
 
 urlpatterns = [
     path('register/', views.register, name='register'),
     path('me/', views.current_user, name='current_user'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('metrics/prometheus/', views.prometheus_metrics, name='metrics-prometheus'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,166 @@
+import json
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Document, DocumentVersion
+
+
+def _common_prefix(a, b):
+    """Length of the common prefix, by binary search over C-level slice compares"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _common_suffix(a, b, limit):
+    low, high = 0, min(len(a), len(b), limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:] == b[len(b) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _append(delta, item):
+    """Append a copy range or literal, merging it with a neighbour of the same kind"""
+    if delta:
+        last = delta[-1]
+        if isinstance(item, str) and isinstance(last, str):
+            delta[-1] = last + item
+            return
+        if isinstance(item, list) and isinstance(last, list) and last[1] == item[0]:
+            last[1] = item[1]
+            return
+    delta.append(item)
+
+
+def encode_delta(old, new):
+    """Instructions that turn `old` into `new`
+
+    ``[start, end]`` copies ``old[start:end]`` and a string is inserted
+    as-is. Edits are usually local, so the common prefix/suffix is trimmed
+    first and only the middle is diffed line by line.
+    """
+    prefix = _common_prefix(old, new)
+    suffix = _common_suffix(old, new, min(len(old), len(new)) - prefix)
+    old_middle = old[prefix:len(old) - suffix]
+    new_middle = new[prefix:len(new) - suffix]
+
+    delta = []
+    if prefix:
+        _append(delta, [0, prefix])
+    if old_middle and new_middle:
+        old_lines = old_middle.splitlines(keepends=True)
+        new_lines = new_middle.splitlines(keepends=True)
+        offsets = [prefix]
+        for line in old_lines:
+            offsets.append(offsets[-1] + len(line))
+        matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                _append(delta, [offsets[i1], offsets[i2]])
+            elif j1 < j2:
+                _append(delta, ''.join(new_lines[j1:j2]))
+    elif new_middle:
+        _append(delta, new_middle)
+    if suffix:
+        _append(delta, [len(old) - suffix, len(old)])
+    return delta
+
+
+def apply_delta(old, delta):
+    return ''.join(old[item[0]:item[1]] if isinstance(item, list) else item for item in delta)
+
+
+def create_version(document, content, version_number, user):
+    """Store a version as a delta on the previous one, or as a keyframe
+
+    A keyframe is written for the first version, every
+    DOCUMENT_VERSION_KEYFRAME_INTERVAL versions, and whenever the delta
+    would not be smaller than the content itself.
+    """
+    with transaction.atomic():
+        # Serialize version writers per document so deltas chain correctly
+        list(Document.objects.select_for_update().filter(pk=document.pk).values_list('pk'))
+        previous = DocumentVersion.objects.filter(
+            document=document,
+            version_number__lt=version_number
+        ).order_by('-version_number').first()
+
+        if previous is not None and previous.chain_length + 1 < settings.DOCUMENT_VERSION_KEYFRAME_INTERVAL:
+            delta = encode_delta(reconstruct(previous), content)
+            if len(json.dumps(delta)) < len(content):
+                return DocumentVersion.objects.create(
+                    document=document,
+                    delta=delta,
+                    base_version=previous.version_number,
+                    keyframe_version=previous.keyframe_version,
+                    chain_length=previous.chain_length + 1,
+                    version_number=version_number,
+                    created_by=user
+                )
+
+        return DocumentVersion.objects.create(
+            document=document,
+            content=content,
+            keyframe_version=version_number,
+            version_number=version_number,
+            created_by=user
+        )
+
+
+def _chain_rows(document_id, start, end):
+    rows = DocumentVersion.objects.filter(
+        document_id=document_id,
+        version_number__gte=start,
+        version_number__lte=end
+    ).only('content', 'delta', 'base_version', 'keyframe_version', 'version_number')
+    return {row.version_number: row for row in rows}
+
+
+def _materialize(row, rows, cache):
+    """Content of `row`, walking base pointers back to its keyframe"""
+    chain = []
+    while row.version_number not in cache and row.delta is not None:
+        chain.append(row)
+        row = rows[row.base_version]
+    content = cache.get(row.version_number, row.content)
+    cache[row.version_number] = content
+    for row in reversed(chain):
+        content = apply_delta(content, row.delta)
+        cache[row.version_number] = content
+    return content
+
+
+def reconstruct(version):
+    """Full content of a DocumentVersion: one keyframe plus at most K deltas"""
+    if version.delta is None:
+        return version.content
+    rows = _chain_rows(version.document_id, version.keyframe_version, version.version_number)
+    return _materialize(rows[version.version_number], rows, {})
+
+
+def contents_for(document_id, versions):
+    """{version_number: content} for several versions with one chain query"""
+    versions = list(versions)
+    if not versions:
+        return {}
+    rows = _chain_rows(
+        document_id,
+        min(version.keyframe_version for version in versions),
+        max(version.version_number for version in versions)
+    )
+    cache = {}
+    return {
+        version.version_number: _materialize(rows[version.version_number], rows, cache)
+        for version in versions
+    }
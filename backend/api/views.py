@@ -1,18 +1,41 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import APIException
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.contrib.auth.models import User
-from django.db.models import Q
-import boto3
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import HttpResponse, HttpResponseNotFound
+from asgiref.sync import async_to_sync
+import hmac
+import os
 
-from .models import Document, DocumentVersion, FileUpload, ActivityLog, UserProfile
+from .models import Workspace, Document, ActivityLog, UserProfile
 from .serializers import (
-    DocumentSerializer, UserSerializer, RegisterSerializer,
-    FileUploadSerializer, ActivityLogSerializer, DocumentVersionSerializer
+    WorkspaceSerializer, DocumentSerializer, DocumentSummarySerializer, DocumentSearchSerializer,
+    UserSerializer, RegisterSerializer, ActivityLogSerializer,
+    DocumentVersionSerializer
 )
-from .permissions import IsEditorOrAdmin, IsDocumentOwnerOrCollaborator
+from .access import document_visible, visible_documents
+from .activity import activity_log
+from . import dashboard
+from .permissions import IsAdminUser, IsEditorOrAdmin, IsDocumentOwnerOrCollaborator
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry
+from .pagination import TimestampCursorPagination
+from .search import get_search_engine
+from .sharding import ShardUnavailableError, shard_router
+from .storage import UPLOAD_STORAGES
+from .uploads import upload_jobs
+from .versioning import contents_for, create_version
+
+
+class ShardUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Live document sessions are unavailable, try again later.'
+    default_code = 'shard_unavailable'
 
 
 @api_view(['POST'])
@@ -36,29 +59,58 @@ def current_user(request):
     return Response(UserSerializer(request.user).data)
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """Process-local performance metrics (write-behind queues etc.)"""
+    return Response(registry.collect())
+
+
+def prometheus_metrics(request):
+    """The same metrics in Prometheus text format, for scrapers
+    
+    Scrapers authenticate with a static "Authorization: Bearer <METRICS_TOKEN>"
+    header instead of a JWT; the endpoint doesn't exist while METRICS_TOKEN
+    is unset.
+    """
+    expected = f'Bearer {settings.METRICS_TOKEN}'
+    supplied = request.headers.get('Authorization', '')
+    if not settings.METRICS_TOKEN or not hmac.compare_digest(supplied.encode(), expected.encode()):
+        return HttpResponseNotFound()
+    return HttpResponse(registry.exposition(), content_type=METRICS_CONTENT_TYPE)
+
+
 class DocumentViewSet(viewsets.ModelViewSet):
     serializer_class = DocumentSerializer
     permission_classes = [IsAuthenticated, IsEditorOrAdmin]
     
     def get_queryset(self):
         """Get documents owned by or shared with the user"""
-        return Document.objects.filter(
-            Q(owner=self.request.user) | Q(collaborators=self.request.user)
-        ).distinct()
+        queryset = visible_documents(self.request.user).select_related('owner__profile')
+        
+        if self.action != 'list':
+            return queryset
+        if self.is_summary():
+            return queryset.defer('content').annotate(
+                collaborator_count=Count('collaborators')
+            )
+        return queryset.prefetch_related('collaborators__profile')
+    
+    def is_summary(self):
+        """?summary=1 lists documents without content or collaborator objects"""
+        return self.request.query_params.get('summary') in ('1', 'true')
+    
+    def get_serializer_class(self):
+        if self.action == 'list' and self.is_summary():
+            return DocumentSummarySerializer
+        return DocumentSerializer
     
     def perform_create(self, serializer):
         """Create document and log activity"""
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        
+        # Visibility replaces per-user share rows, so this is O(1) in users
         document = serializer.save(owner=self.request.user)
         
-        # Auto-share with all users for simplicity
-        from django.contrib.auth.models import User
-        all_users = User.objects.exclude(id=self.request.user.id)
-        document.collaborators.set(all_users)
-        
-        ActivityLog.objects.create(
+        activity_log.record(
             user=self.request.user,
             document=document,
             action='create',
@@ -66,44 +118,59 @@ class DocumentViewSet(viewsets.ModelViewSet):
         )
         
         # Create initial version
-        DocumentVersion.objects.create(
-            document=document,
-            content=document.content,
-            version_number=1,
-            created_by=self.request.user
-        )
+        create_version(document, document.content, 1, self.request.user)
+        get_search_engine().reindex(Document.objects.filter(pk=document.pk))
         
-        # Broadcast to all dashboards
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            'documents_global',
-            {
-                'type': 'document_created',
-                'document_id': document.id,
-                'title': document.title
-            }
-        )
+        # Notify only the dashboards that can see the new document
+        dashboard.notify(document, 'document_created')
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Serve the live in-memory content when the document is being edited"""
+        try:
+            document = shard_router.overlay(self.get_object())
+        except ShardUnavailableError:
+            raise ShardUnavailable()
+        serializer = self.get_serializer(document)
+        return Response(serializer.data)
     
     def perform_update(self, serializer):
         """Update document and create new version"""
+        audience = (serializer.instance.visibility, serializer.instance.workspace_id)
+        requested = (
+            serializer.validated_data.get('visibility', audience[0]),
+            getattr(serializer.validated_data.get('workspace', serializer.instance.workspace), 'pk', None)
+        )
+        # Who can see the document is the owner's call, like sharing it
+        if requested != audience and serializer.instance.owner_id != self.request.user.id:
+            self.permission_denied(self.request, message='Only owner can change document visibility or workspace')
+        try:
+            # Refuse before saving if the live session can't be reached
+            shard_router.join()
+        except ShardUnavailableError:
+            raise ShardUnavailable()
         document = serializer.save()
-        document.version += 1
+        # Keep live editors and the write-behind flush in step with this
+        # save, on whichever worker owns the room
+        live = shard_router.overwrite(document.id, serializer.validated_data.get('content'))
+        if live is not None:
+            document.content, document.version = live
+        else:
+            document.version += 1
         document.save()
+        get_search_engine().reindex(Document.objects.filter(pk=document.pk))
         
-        # Create version snapshot
-        DocumentVersion.objects.create(
-            document=document,
-            content=document.content,
-            version_number=document.version,
-            created_by=self.request.user
-        )
+        # Create version snapshot (stored as a delta between keyframes)
+        create_version(document, document.content, document.version, self.request.user)
         
-        ActivityLog.objects.create(
+        activity_log.record(
             user=self.request.user,
             document=document,
             action='edit',
             description=f'Edited document "{document.title}"'
         )
+        
+        if (document.visibility, document.workspace_id) != audience:
+            dashboard.notify(document, 'document_shared')
     
     @action(detail=True, methods=['post'])
     def share(self, request, pk=None):
@@ -119,27 +186,71 @@ class DocumentViewSet(viewsets.ModelViewSet):
         users = User.objects.filter(id__in=user_ids)
         document.collaborators.add(*users)
         
-        ActivityLog.objects.create(
+        activity_log.record(
             user=request.user,
             document=document,
             action='share',
             description=f'Shared document with {len(users)} users'
         )
+        dashboard.notify(document, 'document_shared', user_ids=[user.id for user in users])
         
         return Response({'message': 'Document shared successfully'})
     
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Documents the user can see that match ?q=, best match first"""
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response(
+                {'error': 'Query parameter "q" is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = min(int(request.query_params.get('limit', settings.SEARCH_RESULTS_LIMIT)),
+                        settings.SEARCH_RESULTS_LIMIT)
+        except ValueError:
+            limit = settings.SEARCH_RESULTS_LIMIT
+        
+        # Collaborators are counted per result row, after ranking and limiting
+        collaborators = Document.collaborators.through.objects.filter(
+            document_id=OuterRef('pk')
+        ).order_by().values('document_id').annotate(count=Count('*')).values('count')
+        results = get_search_engine().search(
+            visible_documents(request.user).defer('content').select_related('owner__profile'),
+            text
+        ).annotate(collaborator_count=Coalesce(Subquery(collaborators), 0))[:max(limit, 1)]
+        return Response(DocumentSearchSerializer(results, many=True).data)
+    
     @action(detail=True, methods=['get'])
     def versions(self, request, pk=None):
         """Get document version history"""
         document = self.get_object()
         versions = document.versions.all()[:10]  # Last 10 versions
-        serializer = DocumentVersionSerializer(versions, many=True)
+        serializer = DocumentVersionSerializer(
+            versions,
+            many=True,
+            context={'contents': contents_for(document.id, versions)}
+        )
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
     def upload_file(self, request, pk=None):
-        """Upload file to S3 and attach to document"""
+        """Accept a file and transfer it to storage in the background
+        
+        Returns a job ID straight away; progress and completion arrive as
+        upload_* events on the uploader's dashboard socket.
+        """
         document = self.get_object()
+        
+        if not UPLOAD_STORAGES[settings.UPLOAD_STORAGE].is_configured():
+            return Response(
+                {'error': 'AWS S3 not configured. Please set AWS credentials.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        
+        # Spool every file to disk, however small, so the job can read it
+        # after this request has finished
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
         file = request.FILES.get('file')
         
         if not file:
@@ -148,63 +259,71 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Upload to S3 if configured, otherwise return error
-        if not settings.AWS_ACCESS_KEY_ID:
+        # Keep a second link to the temp file: Django deletes the original
+        # name when the request closes, the job deletes this one when done
+        path = f'{file.temporary_file_path()}.job'
+        os.link(file.temporary_file_path(), path)
+        
+        job_id = upload_jobs.submit(document, request.user, path, file.name, file.size)
+        if job_id is None:
+            os.remove(path)
             return Response(
-                {'error': 'AWS S3 not configured. Please set AWS credentials.'},
+                {'error': 'Too many uploads in progress, try again later'},
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
         
-        try:
-            s3_client = boto3.client(
-                's3',
-                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                region_name=settings.AWS_S3_REGION_NAME
-            )
-            
-            file_key = f'documents/{document.id}/{file.name}'
-            s3_client.upload_fileobj(
-                file,
-                settings.AWS_STORAGE_BUCKET_NAME,
-                file_key
-            )
-            
-            file_url = f'https://{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/{file_key}'
-            
-            file_upload = FileUpload.objects.create(
-                document=document,
-                uploaded_by=request.user,
-                file_name=file.name,
-                file_url=file_url,
-                file_size=file.size
-            )
-            
-            ActivityLog.objects.create(
-                user=request.user,
-                document=document,
-                action='upload',
-                description=f'Uploaded file "{file.name}"'
-            )
-            
-            return Response(FileUploadSerializer(file_upload).data)
-            
-        except Exception as e:
-            return Response(
-                {'error': f'Upload failed: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        return Response(
+            {'job_id': job_id, 'status': 'queued', 'file_name': file.name, 'file_size': file.size},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class WorkspaceViewSet(viewsets.ModelViewSet):
+    serializer_class = WorkspaceSerializer
+    permission_classes = [IsAuthenticated, IsEditorOrAdmin]
+    
+    def get_queryset(self):
+        """Workspaces the user belongs to"""
+        return Workspace.objects.filter(
+            id__in=Workspace.members.through.objects.filter(
+                user=self.request.user
+            ).values('workspace_id')
+        ).select_related('owner__profile').annotate(member_count=Count('members'))
+    
+    def perform_create(self, serializer):
+        workspace = serializer.save(owner=self.request.user)
+        workspace.members.add(self.request.user)
+        workspace.member_count = 1
+    
+    def check_object_permissions(self, request, obj):
+        super().check_object_permissions(request, obj)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and obj.owner != request.user:
+            self.permission_denied(request, message='Only owner can modify workspace')
+    
+    @action(detail=True, methods=['post'])
+    def members(self, request, pk=None):
+        """Add members to the workspace"""
+        workspace = self.get_object()
+        users = User.objects.filter(id__in=request.data.get('user_ids', []))
+        workspace.members.add(*users)
+        async_to_sync(dashboard.fan_out)(
+            [dashboard.user_group(user.id) for user in users],
+            {'type': 'workspace_joined', 'workspace_id': workspace.id}
+        )
+        return Response({'message': f'Added {len(users)} members'})
 
 
 class ActivityLogViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = ActivityLogSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = TimestampCursorPagination
     
     def get_queryset(self):
-        """Get activity logs for documents user has access to"""
-        user_documents = Document.objects.filter(
-            Q(owner=self.request.user) | Q(collaborators=self.request.user)
-        )
-        return ActivityLog.objects.filter(
-            Q(user=self.request.user) | Q(document__in=user_documents)
-        ).distinct()[:50]  # Last 50 activities
+        """Activity for documents the user can see, optionally for one document"""
+        queryset = ActivityLog.objects.filter(
+            Q(user=self.request.user) | document_visible(self.request.user.id)
+        ).select_related('user__profile', 'document')
+        document_id = self.request.query_params.get('document')
+        if document_id and document_id.isdigit():
+            queryset = queryset.filter(document_id=document_id)
+        return queryset
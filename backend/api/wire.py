@@ -0,0 +1,89 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON_PROTOCOL = 'collabspace.json.v1'
+MSGPACK_PROTOCOL = 'collabspace.msgpack.v1'
+
+# Short keys used on the MessagePack protocol; keep in sync with
+# frontend/src/services/wire.js
+FIELD_CODES = {
+    'type': 't',
+    'user': 'u',
+    'user_id': 'i',
+    'operation': 'o',
+    'position': 'p',
+    'length': 'l',
+    'content': 'c',
+    'timestamp': 'ts',
+    'version': 'v',
+    'locked': 'k',
+    'section': 's',
+    'cursors': 'cs',
+    'ops': 'os',
+    'op_id': 'id',
+    'users': 'us',
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+
+
+def negotiate(offered):
+    """Pick the subprotocol for a connection from the client's offer"""
+    if msgpack is not None and MSGPACK_PROTOCOL in offered:
+        return MSGPACK_PROTOCOL
+    if JSON_PROTOCOL in offered:
+        return JSON_PROTOCOL
+    return None
+
+
+def dumps(payload):
+    """Encode an outbound WebSocket frame as JSON text (orjson when available)"""
+    if orjson is not None:
+        return orjson.dumps(payload).decode()
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def loads(text):
+    """Decode an inbound JSON WebSocket frame"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _rename(value, names):
+    if type(value) is dict:
+        return {
+            names.get(key, key): _rename(item, names) if type(item) in _CONTAINERS else item
+            for key, item in value.items()
+        }
+    return [_rename(item, names) if type(item) in _CONTAINERS else item for item in value]
+
+
+_CONTAINERS = (dict, list)
+
+
+def pack(payload):
+    """Encode an outbound frame as MessagePack with short field codes"""
+    return msgpack.packb(_rename(payload, FIELD_CODES))
+
+
+def unpack(data):
+    """Decode an inbound MessagePack frame back to long field names"""
+    return _rename(msgpack.unpackb(data), FIELD_NAMES)
+
+
+def frame(payload):
+    """Pre-encode a broadcast once per protocol for a channel-layer event"""
+    encoded = {'text': dumps(payload)}
+    if msgpack is not None:
+        encoded['bytes'] = pack(payload)
+    return encoded
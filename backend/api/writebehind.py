@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+import traceback
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .instrumentation import db_scope
+from .metrics import registry
+from .models import DocumentEdit
+
+
+edit_queue_depth = registry.gauge(
+    'collabspace_edit_queue_depth',
+    'DocumentEdit rows waiting for the write-behind flush'
+)
+edit_flush_seconds = registry.histogram(
+    'collabspace_edit_flush_seconds',
+    'Time spent bulk-inserting one batch of DocumentEdit rows'
+)
+edit_flush_rows = registry.counter(
+    'collabspace_edit_flush_rows',
+    'DocumentEdit rows written by the write-behind flush'
+)
+edit_flush_errors = registry.counter(
+    'collabspace_edit_flush_errors',
+    'Write-behind batches that failed to insert'
+)
+
+
+class EditWriteBehindQueue:
+    """Collects DocumentEdit rows per document and bulk-inserts them
+
+    A document's batch is flushed once it reaches EDIT_WRITE_BEHIND_BATCH_SIZE
+    rows or EDIT_WRITE_BEHIND_INTERVAL seconds after its first pending row,
+    whichever comes first, plus explicitly on disconnect and at shutdown.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.timers = {}
+        self.lock = threading.Lock()
+        self.depth = 0
+
+    def enqueue(self, edit):
+        """Queue an unsaved DocumentEdit; must be called from the event loop"""
+        document_id = edit.document_id
+        with self.lock:
+            batch = self.pending.setdefault(document_id, [])
+            batch.append(edit)
+            self.depth += 1
+            edit_queue_depth.set(self.depth)
+            size = len(batch)
+
+        loop = asyncio.get_running_loop()
+        if size >= settings.EDIT_WRITE_BEHIND_BATCH_SIZE:
+            loop.create_task(self.flush(document_id))
+        elif document_id not in self.timers:
+            self.timers[document_id] = loop.call_later(
+                settings.EDIT_WRITE_BEHIND_INTERVAL,
+                self._flush_later,
+                document_id
+            )
+
+    def _flush_later(self, document_id):
+        self.timers.pop(document_id, None)
+        asyncio.get_running_loop().create_task(self.flush(document_id))
+
+    def take(self, document_id=None):
+        """Remove and return pending batches ({document_id: [edits]})"""
+        with self.lock:
+            if document_id is None:
+                batches, self.pending = self.pending, {}
+            else:
+                batch = self.pending.pop(document_id, None)
+                batches = {document_id: batch} if batch else {}
+            self.depth -= sum(len(batch) for batch in batches.values())
+            edit_queue_depth.set(self.depth)
+        for key in batches:
+            timer = self.timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+        return batches
+
+    async def flush(self, document_id=None):
+        """Flush one document's batch, or everything when document_id is None"""
+        batches = self.take(document_id)
+        if batches:
+            await database_sync_to_async(self.write)(batches)
+
+    def flush_sync(self):
+        """Blocking flush of everything, for shutdown when no loop is running"""
+        with self.lock:
+            batches, self.pending = self.pending, {}
+            self.depth = 0
+            edit_queue_depth.set(0)
+        self.timers.clear()
+        if batches:
+            self.write(batches)
+
+    def write(self, batches):
+        for document_id, edits in batches.items():
+            start = time.perf_counter()
+            try:
+                with db_scope('edit_flush'), transaction.atomic():
+                    DocumentEdit.objects.bulk_create(edits)
+            except Exception as e:
+                # Most likely the document was deleted while edits were queued
+                edit_flush_errors.inc()
+                print(f"Error flushing {len(edits)} edits for document {document_id}: {e}")
+                traceback.print_exc()
+                continue
+            edit_flush_seconds.observe(time.perf_counter() - start)
+            edit_flush_rows.inc(len(edits))
+
+
+edit_queue = EditWriteBehindQueue()
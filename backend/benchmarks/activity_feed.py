@@ -0,0 +1,115 @@
+"""Activity feed latency as the ActivityLog table grows
+
+Usage (from backend/):
+    python -m benchmarks.activity_feed [--sizes 10000 100000 1000000]
+
+Seeds ActivityLog rows across users and documents (mostly public, some
+private) and times, per table size: the old feed query (OR across user
+and collaborator join, DISTINCT, slice to 50), the first page of the
+keyset-paginated /api/activities/ endpoint, and a page deep in the feed.
+Set BENCHMARK_DB to a file path to keep the seeded database around.
+"""
+import argparse
+import random
+import time
+from datetime import timedelta
+
+from benchmarks.django_setup import setup
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--documents', type=int, default=2000)
+    parser.add_argument('--depth', type=int, default=5000, help='Rows to skip for the deep page')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=5)
+    args = parser.parse_args()
+
+    setup()
+    from django.contrib.auth.models import User
+    from django.db.models import Q
+    from django.utils import timezone
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from api.access import document_visible
+    from api.models import ActivityLog, Document, UserProfile
+    from api.pagination import TimestampCursorPagination
+    from api.views import ActivityLogViewSet
+
+    rng = random.Random(args.seed)
+    users = User.objects.bulk_create(User(username=f'user{index}') for index in range(args.users))
+    UserProfile.objects.bulk_create(UserProfile(user=user) for user in users)
+    documents = Document.objects.bulk_create(
+        Document(
+            title=f'doc {index}',
+            owner=rng.choice(users),
+            visibility=Document.VISIBILITY_PRIVATE if index % 10 == 0 else Document.VISIBILITY_PUBLIC
+        )
+        for index in range(args.documents)
+    )
+    through = Document.collaborators.through
+    through.objects.bulk_create(
+        through(document_id=document.id, user_id=user.id)
+        for document in documents if document.visibility == Document.VISIBILITY_PRIVATE
+        for user in rng.sample(users, 3)
+    )
+
+    reader = users[0]
+    factory = APIRequestFactory()
+    view = ActivityLogViewSet.as_view({'get': 'list'})
+
+    def feed(cursor=None):
+        request = factory.get('/api/activities/', {'cursor': cursor} if cursor else {})
+        force_authenticate(request, user=reader)
+        response = view(request)
+        assert response.status_code == 200 and len(response.data['results']) == 50
+        return response
+
+    def legacy():
+        user_documents = Document.objects.filter(Q(owner=reader) | Q(collaborators=reader))
+        return list(ActivityLog.objects.filter(
+            Q(user=reader) | Q(document__in=user_documents)
+        ).distinct()[:50])
+
+    print(f'{"rows":>10} {"legacy ms":>10} {"page 1 ms":>10} {"deep page ms":>13}')
+    start_time = timezone.now() - timedelta(days=365)
+    for size in sorted(args.sizes):
+        seeded = ActivityLog.objects.count()
+        for offset in range(seeded, size, 50_000):
+            ActivityLog.objects.bulk_create(
+                ActivityLog(
+                    user=rng.choice(users),
+                    document=rng.choice(documents),
+                    action='edit',
+                    description='Edited document',
+                    timestamp=start_time + timedelta(seconds=(offset + index) // 3)
+                )
+                for index in range(min(50_000, size - offset))
+            )
+
+        # Cursor of the row `depth` positions down this reader's feed
+        anchor = ActivityLog.objects.filter(
+            Q(user=reader) | document_visible(reader.id)
+        ).order_by('-timestamp', '-id')[args.depth]
+        cursor = TimestampCursorPagination().encode_cursor(anchor)
+
+        print(
+            f'{size:>10} {timed(legacy, args.repeat):>10.2f} '
+            f'{timed(feed, args.repeat):>10.2f} {timed(lambda: feed(cursor), args.repeat):>13.2f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+import os
+
+
+def setup():
+    """Configure Django against benchmarks.settings and build a fresh schema"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('migrate', verbosity=0)
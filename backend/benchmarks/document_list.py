@@ -0,0 +1,75 @@
+"""Document list endpoint: queries and latency as the user's library grows
+
+Usage (from backend/):
+    python -m benchmarks.document_list [--sizes 10 100 1000] [--collaborators 5]
+
+Seeds documents shared with a handful of collaborators and lists them
+through DocumentViewSet in full and ?summary=1 mode, reporting queries,
+latency and response size per list. That the query count doesn't grow
+with the list (no N+1) is checked by DocumentListQueryTests in api.tests.
+"""
+import argparse
+import time
+
+from benchmarks.django_setup import setup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--collaborators', type=int, default=5)
+    parser.add_argument('--content', type=int, default=20_000, help='Characters of content per document')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup()
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from api.models import Document, UserProfile
+    from api.views import DocumentViewSet
+
+    def make_user(username):
+        user = User.objects.create_user(username, f'{username}@example.com', username)
+        UserProfile.objects.create(user=user, role='editor')
+        return user
+
+    owner = make_user('owner')
+    collaborators = [make_user(f'collaborator{index}') for index in range(args.collaborators)]
+    factory = APIRequestFactory()
+    view = DocumentViewSet.as_view({'get': 'list'})
+    content = 'x' * args.content
+
+    print(f'{"documents":>10} {"mode":>8} {"queries":>8} {"p50 ms":>8} {"KB":>8}')
+    for size in sorted(args.sizes):
+        missing = size - Document.objects.count()
+        documents = Document.objects.bulk_create(
+            Document(title=f'doc {index}', content=content, owner=owner) for index in range(missing)
+        )
+        through = Document.collaborators.through
+        through.objects.bulk_create(
+            through(document_id=document.id, user_id=user.id)
+            for document in documents for user in collaborators
+        )
+
+        for mode, query in (('full', {}), ('summary', {'summary': 1})):
+            timings = []
+            for _ in range(args.repeat):
+                request = factory.get('/api/documents/', query)
+                force_authenticate(request, user=owner)
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = view(request)
+                    response.render()
+                    timings.append(time.perf_counter() - start)
+            timings.sort()
+            print(
+                f'{size:>10} {mode:>8} {len(captured):>8} '
+                f'{timings[len(timings) // 2] * 1e3:>8.1f} {len(response.content) / 1024:>8.0f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
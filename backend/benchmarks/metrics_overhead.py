@@ -0,0 +1,178 @@
+"""Cost of the hot-path instrumentation: METRICS_ENABLED off vs. on
+
+Usage (from backend/):
+    python -m benchmarks.metrics_overhead [--messages 5000] [--queries 2000] [--requests 300]
+
+Times each operation with instrumentation off and on, alternating rounds
+in one process so machine noise hits both sides alike, and reports the
+best round of each:
+
+  record                 one handler-latency observation on its own
+                         (two perf_counter calls, label lookup, bucket add)
+  edit / cursor / lock   DocumentConsumer.receive on a socket in a room of
+                         --peers sockets (in-memory channel layer): handler
+                         histogram plus timed group_send
+  query                  a primary-key lookup, with and without the
+                         connection's counting execute wrapper
+  request                GET /api/documents/<id>/ through the Django test
+                         client and RequestMetricsMiddleware
+
+It also times one Prometheus scrape once --rooms rooms have socket gauges.
+Edits are flushed on a worker thread, which can't see an in-memory SQLite
+database, so this uses a temporary file unless BENCHMARK_DB names one.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.django_setup import setup
+
+
+def per_call(function, count):
+    start = time.perf_counter()
+    function(count)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000, help='Socket messages per type per round')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--peers', type=int, default=10, help='Sockets in the benchmark room')
+    parser.add_argument('--rooms', type=int, default=1000, help='Rooms with a socket gauge when scraping')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    database = None
+    if not os.getenv('BENCHMARK_DB'):
+        database = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False).name
+        os.environ['BENCHMARK_DB'] = database
+    try:
+        benchmark(args)
+    finally:
+        if database is not None:
+            os.remove(database)
+
+
+def benchmark(args):
+    setup()
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from api.consumers import DocumentConsumer
+    from api.instrumentation import count_query, handler_seconds, room_sockets
+    from api.metrics import registry
+    from api.models import Document, UserProfile
+    from api.session import document_sessions
+
+    settings.DEBUG = False
+    user = User.objects.create(username='bench')
+    UserProfile.objects.create(user=user, role='editor')
+    document = Document.objects.create(title='bench', content='x' * 2000, owner=user)
+    channel_layer = get_channel_layer()
+
+    async def discard(message):
+        pass
+
+    async def open_consumer():
+        consumer = DocumentConsumer()
+        consumer.scope = {'user': user}
+        consumer.user = user
+        consumer.document_id = document.id
+        consumer.room_group_name = f'document_{document.id}'
+        consumer.channel_layer = channel_layer
+        consumer.channel_name = await channel_layer.new_channel()
+        consumer.session = await document_sessions.open(document.id)
+        consumer.binary = False
+        # Replies to this socket itself (acks) go nowhere
+        consumer.base_send = discard
+        consumer.heartbeat_due = float('inf')
+        await channel_layer.group_add(consumer.room_group_name, consumer.channel_name)
+        for _ in range(args.peers - 1):
+            await channel_layer.group_add(consumer.room_group_name, await channel_layer.new_channel())
+        return consumer
+
+    messages = {
+        'edit': json.dumps({'type': 'edit', 'operation': 'insert', 'position': 0, 'content': 'a'}),
+        'cursor': json.dumps({'type': 'cursor', 'position': 10}),
+        'lock': json.dumps({'type': 'lock', 'locked': True, 'section': 'intro', 'position': 0, 'length': 10}),
+    }
+
+    def record(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            handler_seconds.labels('edit').observe(time.perf_counter() - start)
+
+    def queries(count):
+        for _ in range(count):
+            Document.objects.filter(id=document.id).values_list('id', flat=True).first()
+
+    client = Client(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+    def requests(count):
+        for _ in range(count):
+            assert client.get(f'/api/documents/{document.id}/').status_code == 200
+
+    def set_enabled(enabled):
+        settings.METRICS_ENABLED = enabled
+        connection.ensure_connection()
+        connection.execute_wrappers[:] = [count_query] if enabled else []
+
+    def report(name, timings):
+        off, on = min(timings[False]), min(timings[True])
+        overhead = on - off
+        percent = f'{overhead / off * 100:>10.1f}%' if off else f'{"-":>11}'
+        print(f'{name:>10} {off:>9.2f} {on:>9.2f} {overhead:>12.2f} {percent}')
+
+    async def socket_rounds():
+        # One event loop throughout, so write-behind timers keep firing
+        consumer = await open_consumer()
+        results = {}
+        for kind, text in messages.items():
+            timings = {False: [], True: []}
+            # The first round only warms up
+            for round in range(args.repeat + 1):
+                for enabled in (False, True):
+                    settings.METRICS_ENABLED = enabled
+                    start = time.perf_counter()
+                    for _ in range(args.messages):
+                        await consumer.receive(text_data=text)
+                    if round:
+                        timings[enabled].append((time.perf_counter() - start) / args.messages * 1e6)
+            results[kind] = timings
+        await document_sessions.close(document.id)
+        return results
+
+    print(f'{"operation":>10} {"off us":>9} {"on us":>9} {"overhead us":>12} {"overhead %":>11}')
+    set_enabled(True)
+    report('record', {False: [0.0], True: [per_call(record, args.messages * 10) for _ in range(args.repeat)]})
+    for kind, timings in async_to_sync(socket_rounds)().items():
+        report(kind, timings)
+    for name, function, count in (('query', queries, args.queries), ('request', requests, args.requests)):
+        timings = {False: [], True: []}
+        for _ in range(args.repeat):
+            for enabled in (False, True):
+                set_enabled(enabled)
+                timings[enabled].append(per_call(function, count))
+        report(name, timings)
+
+    for room in range(args.rooms):
+        room_sockets.labels(room).set(1)
+    start = time.perf_counter()
+    exposition = registry.exposition()
+    print(
+        f'Prometheus scrape with {args.rooms} rooms: {(time.perf_counter() - start) * 1e3:.2f} ms, '
+        f'{len(exposition) / 1024:.0f} KB'
+    )
+
+
+if __name__ == '__main__':
+    main()
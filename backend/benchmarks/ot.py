@@ -0,0 +1,73 @@
+"""OT engine: transform cost vs. history length
+
+Usage (from backend/):
+    python -m benchmarks.ot [--lag 10] [--history 1000 10000 100000 1000000]
+
+Times rebasing one incoming op `--lag` versions behind against an OpLog
+of each size, next to the old resolve_conflict's scan over every edit.
+Convergence is checked by the tests in api.tests:
+    python manage.py test api --settings=benchmarks.settings
+"""
+import argparse
+import random
+import time
+
+from api.ot import Operation, OpLog
+
+
+def random_op(rng, size):
+    position = rng.randint(0, size)
+    length = rng.randint(0, min(4, size - position)) if rng.random() < 0.5 else 0
+    text = ''.join(rng.choice('xyz') for _ in range(rng.choice([0, 1, 1, 2, 5])))
+    if not length and not text:
+        text = 'q'
+    return Operation(position, length, text)
+
+
+def legacy_scan(history, position):
+    """Cost model of the old resolve_conflict: walk every edit ever made"""
+    for op in history:
+        if not op.length and op.position <= position:
+            position += len(op.text)
+        elif op.length and op.position < position:
+            position -= 1
+    return position
+
+
+def bench_transform(history_sizes, lag, repeat, seed):
+    rng = random.Random(seed)
+    print(f'{"history":>10} {"lag":>5} {"rebase us":>10} {"legacy scan us":>15}')
+    for history in history_sizes:
+        log = OpLog(1)
+        ops = [random_op(rng, 1000) for _ in range(history)]
+        for op in ops:
+            log.append(op)
+        incoming = random_op(rng, 1000)
+        base = log.version - lag
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            log.rebase(incoming, base)
+        rebase = (time.perf_counter() - start) / repeat
+
+        legacy_repeat = max(1, repeat * 1000 // history)
+        start = time.perf_counter()
+        for _ in range(legacy_repeat):
+            legacy_scan(ops, incoming.position)
+        legacy = (time.perf_counter() - start) / legacy_repeat
+        print(f'{history:>10} {lag:>5} {rebase * 1e6:>10.2f} {legacy * 1e6:>15.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lag', type=int, default=10)
+    parser.add_argument('--history', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    bench_transform(args.history, args.lag, args.repeat, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Document search latency and index maintenance cost at 100k documents
+
+Usage (from backend/):
+    python -m benchmarks.search [--documents 100000] [--words 80]
+    BENCHMARK_DATABASE=postgres POSTGRES_DB=collabspace_bench python -m benchmarks.search
+
+Seeds documents whose titles and bodies are drawn from a Zipf-distributed
+vocabulary (a tenth of them private to other users), then times
+/api/documents/search/ for a common, a mid-frequency and a rare word and
+a two-word query, plus one session flush (the UPDATE that also rewrites
+the search vector on Postgres).
+
+On SQLite only the fallback substring engine exists. With
+BENCHMARK_DATABASE=postgres the same queries run through both the
+fallback and the tsvector/GIN engine; point POSTGRES_DB at a scratch
+database, since it is migrated and seeded.
+"""
+import argparse
+import random
+import time
+
+from benchmarks.django_setup import setup
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1e3, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=100_000)
+    parser.add_argument('--words', type=int, default=80, help='Words of content per document')
+    parser.add_argument('--vocabulary', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=23)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from api.models import Document, UserProfile
+    from api.search import get_search_engine
+    from api.session import document_sessions
+    from api.views import DocumentViewSet
+
+    rng = random.Random(args.seed)
+    vocabulary = [f'w{index}x' for index in range(args.vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(args.vocabulary)]
+
+    def words(count):
+        return ' '.join(rng.choices(vocabulary, weights, k=count))
+
+    users = User.objects.bulk_create(User(username=f'user{index}') for index in range(args.users))
+    UserProfile.objects.bulk_create(UserProfile(user=user, role='editor') for user in users)
+    start = time.perf_counter()
+    for offset in range(0, args.documents, 5000):
+        Document.objects.bulk_create(
+            Document(
+                title=words(4),
+                content=words(args.words),
+                owner=rng.choice(users),
+                visibility=Document.VISIBILITY_PRIVATE if index % 10 == 0 else Document.VISIBILITY_PUBLIC
+            )
+            for index in range(offset, min(offset + 5000, args.documents))
+        )
+    seeded = time.perf_counter() - start
+
+    engines = ['fallback']
+    if connection.vendor == 'postgresql':
+        engines.append('postgres')
+        settings.SEARCH_ENGINE = 'postgres'
+        start = time.perf_counter()
+        get_search_engine().reindex(Document.objects.all())
+        print(f'Seeded {args.documents} documents in {seeded:.1f} s, indexed in {time.perf_counter() - start:.1f} s')
+    else:
+        print(f'Seeded {args.documents} documents in {seeded:.1f} s (SQLite: fallback engine only)')
+
+    reader = users[0]
+    factory = APIRequestFactory()
+    view = DocumentViewSet.as_view({'get': 'search'})
+    queries = [
+        ('common', vocabulary[0]),
+        ('mid', vocabulary[100]),
+        ('rare', vocabulary[3000]),
+        ('two words', f'{vocabulary[5]} {vocabulary[50]}'),
+    ]
+
+    def search(text):
+        request = factory.get('/api/documents/search/', {'q': text})
+        force_authenticate(request, user=reader)
+        response = view(request)
+        assert response.status_code == 200
+        return len(response.data)
+
+    document = Document.objects.order_by('id').first()
+    content = words(args.words)
+    version = [document.version]
+
+    def flush():
+        version[0] += 1
+        document_sessions.persist(document.id, content, version[0])
+
+    print(f'{"engine":>9} {"query":>10} {"hits":>5} {"ms":>9}')
+    for engine in engines:
+        settings.SEARCH_ENGINE = engine
+        for name, text in queries:
+            elapsed, hits = timed(lambda: search(text), args.repeat)
+            print(f'{engine:>9} {name:>10} {hits:>5} {elapsed:>9.2f}')
+        elapsed, _ = timed(flush, args.repeat)
+        print(f'{engine:>9} {"flush":>10} {"":>5} {elapsed:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Section locks: randomized invariant check + edit cost vs. locks held
+
+Usage (from backend/):
+    python -m benchmarks.section_locks [--rounds 20000] [--locks 0 10 100 1000] [--ops 20000]
+
+The invariant check drives one DocumentSession with random locks,
+releases and edits from several users and asserts after every step that
+locks stay disjoint, sorted and inside the document, and that no edit
+from another user ever changed a locked range's text. The timing part
+applies typing-like edits to a session holding N locks spread over the
+document and compares the bisecting check with a linear scan of all
+locks.
+"""
+import argparse
+import random
+import time
+
+from benchmarks.django_setup import setup
+
+
+def check_invariants(session, texts):
+    locks = session.locks.locks
+    for before, after in zip(locks, locks[1:]):
+        assert before.end <= after.start, 'locks overlap or are out of order'
+    content = str(session.buffer)
+    for lock in locks:
+        assert 0 <= lock.start < lock.end <= len(content), 'lock outside the document'
+        expected = texts.get((lock.channel, lock.section))
+        if expected is not None:
+            assert content[lock.start:lock.end] == expected, 'locked text changed under its lock'
+
+
+def invariants(rounds, seed):
+    from api.locks import LockedError
+    from api.ot import Operation
+    from api.session import DocumentSession
+
+    rng = random.Random(seed)
+    session = DocumentSession(1, 'x' * 2000, 1)
+    # Text of each lock as its holder last saw it, to catch foreign edits
+    texts = {}
+    rejected = 0
+    for _ in range(rounds):
+        size = len(session.buffer)
+        user = rng.randint(1, 6)
+        channel = f'channel{user}'
+        roll = rng.random()
+        if roll < 0.1:
+            section = rng.choice('abc')
+            lock, _, _ = session.acquire_lock(
+                channel, user, f'user{user}', section,
+                Operation(rng.randint(0, size), rng.randint(1, 40), '')
+            )
+            if lock is not None:
+                texts[(channel, section)] = str(session.buffer)[lock.start:lock.end]
+        elif roll < 0.13:
+            for lock in session.release_locks(channel):
+                texts.pop((lock.channel, lock.section), None)
+        else:
+            position = rng.randint(0, size)
+            length = rng.randint(0, min(5, size - position)) if rng.random() < 0.4 else 0
+            text = 'q' * rng.choice([0, 1, 1, 2])
+            if not length and not text:
+                text = 'q'
+            try:
+                session.apply(Operation(position, length, text), None, user)
+            except LockedError:
+                rejected += 1
+            # The holder's own edits are allowed to change their text
+            content = str(session.buffer)
+            for lock in session.locks.locks:
+                if lock.user_id == user:
+                    texts[(lock.channel, lock.section)] = content[lock.start:lock.end]
+            texts = {key: value for key, value in texts.items() if key in session.locks.held}
+        check_invariants(session, texts)
+    return rejected
+
+
+def linear_check(locks, op, user_id):
+    """Reference: scan every lock"""
+    for lock in locks.locks:
+        if op.length:
+            inside = lock.start < op.end and op.position < lock.end
+        else:
+            inside = lock.start < op.position < lock.end
+        if inside and lock.user_id != user_id:
+            return lock
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20000)
+    parser.add_argument('--locks', type=int, nargs='+', default=[0, 10, 100, 1000])
+    parser.add_argument('--ops', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=24)
+    args = parser.parse_args()
+
+    setup()
+    from api.locks import LockedError
+    from api.ot import Operation
+    from api.session import DocumentSession
+
+    rejected = invariants(args.rounds, args.seed)
+    print(f'Invariants held over {args.rounds} random steps ({rejected} edits rejected)')
+
+    print(f'{"locks":>6} {"apply us/op":>12} {"bisect us":>10} {"linear us":>10}')
+    rng = random.Random(args.seed)
+    for count in args.locks:
+        size = max(100_000, count * 20)
+        session = DocumentSession(1, 'x' * size, 1)
+        for index in range(count):
+            start = index * (size // max(count, 1))
+            session.acquire_lock(f'channel{index}', index + 2, 'holder', 'section', Operation(start, 5, ''))
+        ops = [Operation(rng.randint(0, size), 0, 'a') for _ in range(args.ops)]
+
+        start = time.perf_counter()
+        for op in ops:
+            try:
+                session.apply(op, None, 1)
+            except LockedError:
+                pass
+        applied = (time.perf_counter() - start) / args.ops * 1e6
+
+        start = time.perf_counter()
+        for op in ops:
+            try:
+                session.locks.check(op, 1)
+            except LockedError:
+                pass
+        bisect = (time.perf_counter() - start) / args.ops * 1e6
+
+        start = time.perf_counter()
+        for op in ops:
+            linear_check(session.locks, op, 1)
+        linear = (time.perf_counter() - start) / args.ops * 1e6
+        print(f'{count:>6} {applied:>12.2f} {bisect:>10.2f} {linear:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+"""Settings for running benchmarks offline: SQLite and the in-memory channel layer"""
+import os
+
+from collabspace.settings import *  # noqa: F401,F403
+
+# BENCHMARK_DATABASE=postgres keeps the POSTGRES_* database from the main
+# settings, for benchmarks of Postgres-only features (e.g. full-text search)
+if os.getenv('BENCHMARK_DATABASE') != 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('BENCHMARK_DB', ':memory:'),
+        }
+    }
+
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
+# An in-memory SQLite database is private to one connection, so the
+# background ActivityLog writer thread would not see the schema
+ACTIVITY_LOG_SYNC = True
@@ -0,0 +1,393 @@
+"""Document sharding: edits converge while workers join, leave and crash
+
+Usage (from backend/):
+    python -m benchmarks.sharding [--workers 3] [--rooms 12] [--clients 6]
+        [--phase 2] [--rate 3] [--no-crash]
+
+Runs several ShardRouters in one process, each with its own session
+registry and its own DocumentConsumer application (as_asgi(router=...)),
+sharing the in-memory channel layer and an InMemoryMembership. Clients
+are spread over the workers, so most of their messages are forwarded to
+the owning worker. Every client sends batches inserting a unique marker
+at position 0, which need no rebasing, so each room's text must end up
+as the markers in descending order of the versions they were acked at,
+followed by the seed. One client per room on the first worker holds a
+section lock over the seed's start throughout.
+
+The phases are steady load, a worker joining, a worker stopping
+gracefully (its clients reconnect elsewhere first, as with a rolling
+restart) and, unless --no-crash, a worker dying without handing
+anything off. Afterwards every room is flushed and checked: owner's
+text equals the database; no marker applied twice; markers in version
+order; every acked marker present (apart from ones lost with the
+crashed worker's unflushed sessions); and the section locks still held
+over untouched text. Exits non-zero on any violation.
+
+The Redis membership (SHARD_BACKEND = 'redis') is not exercised here;
+it needs a Redis server and one process per worker.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+
+from benchmarks.django_setup import setup
+
+MARKER = re.compile(r'<(\d+)\.(\d+)>')
+SEED = 'x' * 200
+LOCKED = 5
+
+
+class Client:
+    def __init__(self, index, room, token):
+        self.index = index
+        self.room = room
+        self.token = token
+        self.worker = None
+        self.communicator = None
+        self.reader = None
+        self.sequence = 0
+        self.pending = {}
+        self.acked = {}
+        self.resyncs = 0
+        self.rejected = 0
+        self.lost = 0
+        self.section = None
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.paused = asyncio.Event()
+        self.paused.set()
+
+    async def connect(self, worker):
+        from channels.testing import WebsocketCommunicator
+
+        self.worker = worker
+        self.communicator = WebsocketCommunicator(
+            worker.application, f'/ws/document/{self.room.id}/?token={self.token}'
+        )
+        connected, _ = await self.communicator.connect()
+        assert connected, f'client {self.index} was refused by {worker.router.worker_id}'
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def read(self):
+        while True:
+            message = await self.communicator.receive_output(timeout=3600)
+            if message['type'] != 'websocket.send':
+                return
+            data = json.loads(message['text'])
+            kind = data['type']
+            if kind == 'ack':
+                marker = self.pending.pop(data['op_id'], None)
+                if marker is not None:
+                    self.acked[marker] = data['version']
+                if not self.pending:
+                    self.idle.set()
+            elif kind == 'resync':
+                self.resyncs += 1
+            elif kind == 'edit_rejected':
+                self.rejected += 1
+
+    async def lock(self):
+        self.section = f'section{self.index}'
+        await self.communicator.send_to(text_data=json.dumps({
+            'type': 'lock', 'locked': True, 'section': self.section, 'position': 0, 'length': LOCKED
+        }))
+
+    async def edit(self):
+        self.sequence += 1
+        marker = f'<{self.index}.{self.sequence}>'
+        self.pending[self.sequence] = marker
+        self.idle.clear()
+        await self.communicator.send_to(text_data=json.dumps({
+            'type': 'edits',
+            'op_id': self.sequence,
+            'ops': [{'operation': 'insert', 'position': 0, 'content': marker}]
+        }))
+
+    async def settle(self, timeout):
+        """Wait for outstanding acks; the rest were lost"""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.lost += len(self.pending)
+            self.pending.clear()
+            self.idle.set()
+
+    async def move(self, worker, timeout):
+        """Close this socket once its edits are acked and reconnect to `worker`"""
+        self.paused.clear()
+        await self.settle(timeout)
+        await self.communicator.disconnect()
+        self.reader.cancel()
+        await self.connect(worker)
+        self.paused.set()
+
+    async def drop(self, worker):
+        """The socket's worker died: reconnect without waiting for anything"""
+        self.paused.clear()
+        self.reader.cancel()
+        self.lost += len(self.pending)
+        self.pending.clear()
+        self.idle.set()
+        await self.connect(worker)
+        self.paused.set()
+
+    async def run(self, rate, stop):
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), random.expovariate(rate))
+                return
+            except asyncio.TimeoutError:
+                pass
+            await self.paused.wait()
+            await self.edit()
+
+
+class Worker:
+    def __init__(self, worker_id, membership):
+        from channels.routing import URLRouter
+        from django.urls import path
+
+        from api.consumers import DocumentConsumer
+        from api.middleware import JWTAuthMiddleware
+        from api.session import DocumentSessionRegistry
+        from api.sharding import ShardRouter
+
+        self.router = ShardRouter(DocumentSessionRegistry(), worker_id, membership)
+        self.application = JWTAuthMiddleware(URLRouter([
+            path('ws/document/<int:document_id>/', DocumentConsumer.as_asgi(router=self.router)),
+        ]))
+
+    async def crash(self, clients):
+        """Stop dead: no leave, no handoff, no flush, sockets gone"""
+        self.router.task.cancel()
+        self.router.receiver.cancel()
+        for session in self.router.sessions.all():
+            if session.flush_handle is not None:
+                session.flush_handle.cancel()
+            if session.flush_task is not None:
+                session.flush_task.cancel()
+        for client in clients:
+            if client.worker is self:
+                client.communicator.future.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=3, help='Workers at the start (at least 3)')
+    parser.add_argument('--rooms', type=int, default=12)
+    parser.add_argument('--clients', type=int, default=6, help='Sockets per room')
+    parser.add_argument('--phase', type=float, default=2, help='Seconds of load per phase')
+    parser.add_argument('--rate', type=float, default=3, help='Edits per second per socket')
+    parser.add_argument('--no-crash', dest='crash', action='store_false')
+    parser.add_argument('--seed', type=int, default=25)
+    args = parser.parse_args()
+    assert args.workers >= 3, 'one worker stops and one crashes, so start at least 3'
+
+    random.seed(args.seed)
+    database = None
+    if not os.getenv('BENCHMARK_DB'):
+        database = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False).name
+        os.environ['BENCHMARK_DB'] = database
+    try:
+        # Consumers and routers print as sockets and workers come and go
+        with contextlib.redirect_stdout(sys.stderr):
+            report, failures = asyncio.run(run(args))
+    finally:
+        if database is not None:
+            os.remove(database)
+
+    print(json.dumps(report, indent=2))
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+async def run(args):
+    from asgiref.sync import sync_to_async
+
+    await sync_to_async(setup)()
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    settings.SHARD_BACKEND = 'memory'
+    settings.SHARD_HEARTBEAT_INTERVAL = 0.2
+    settings.SHARD_WORKER_TTL = 1.0
+    settings.SHARD_HANDOFF_TIMEOUT = 1.0
+    settings.SHARD_CALL_TIMEOUT = 1.0
+    settings.DOCUMENT_SESSION_FLUSH_INTERVAL = 0.5
+    settings.CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {'capacity': 10_000},
+        },
+    }
+
+    from api.models import Document, UserProfile
+    from api.sharding import InMemoryMembership, shard_forwards, shard_handoffs
+    from api.writebehind import edit_queue
+
+    def seed():
+        users = User.objects.bulk_create(
+            User(username=f'shard{index}') for index in range(args.rooms * args.clients)
+        )
+        UserProfile.objects.bulk_create(UserProfile(user=user, role='editor') for user in users)
+        rooms = Document.objects.bulk_create(
+            Document(title=f'shard {index}', content=SEED, owner=users[0]) for index in range(args.rooms)
+        )
+        return users, rooms
+
+    users, rooms = await sync_to_async(seed)()
+    membership = InMemoryMembership()
+    workers = [Worker(f'w{index}', membership) for index in range(args.workers)]
+    for worker in workers:
+        await worker.router.start()
+    await asyncio.sleep(settings.SHARD_HEARTBEAT_INTERVAL * 3)
+
+    clients = []
+    for room_index, room in enumerate(rooms):
+        for slot in range(args.clients):
+            index = room_index * args.clients + slot
+            client = Client(index, room, str(AccessToken.for_user(users[index])))
+            await client.connect(workers[slot % len(workers)])
+            clients.append(client)
+    # Slot 0 of each room sits on w0, which neither stops nor crashes
+    holders = clients[::args.clients]
+    for client in holders:
+        await client.lock()
+
+    stop = asyncio.Event()
+    senders = [asyncio.ensure_future(client.run(args.rate, stop)) for client in clients]
+    phases = []
+
+    def phase(name):
+        phases.append({
+            'phase': name,
+            'workers': sorted(workers[0].router.ring.workers),
+            'edits_acked': sum(len(client.acked) for client in clients),
+        })
+
+    await asyncio.sleep(args.phase)
+    phase('steady')
+
+    joined = Worker(f'w{len(workers)}', membership)
+    workers.append(joined)
+    await joined.router.start()
+    await asyncio.sleep(args.phase)
+    phase('join')
+
+    # Rolling restart of w1: its sockets reconnect elsewhere, then it leaves
+    leaving = workers[1]
+    others = [worker for worker in workers if worker is not leaving]
+    await asyncio.gather(*(
+        client.move(others[client.index % len(others)], settings.SHARD_HANDOFF_TIMEOUT * 2)
+        for client in clients
+        if client.worker is leaving
+    ))
+    await leaving.router.stop()
+    workers.remove(leaving)
+    await asyncio.sleep(args.phase)
+    phase('graceful stop')
+
+    crashed = None
+    if args.crash:
+        crashed = workers[1]
+        owned = {room.id for room in rooms if crashed.router.owner(room.id) == crashed.router.worker_id}
+        await crashed.crash(clients)
+        workers.remove(crashed)
+        await asyncio.gather(*(
+            client.drop(workers[client.index % len(workers)])
+            for client in clients
+            if client.worker is crashed
+        ))
+        await asyncio.sleep(settings.SHARD_WORKER_TTL + args.phase)
+        phase('crash')
+
+    stop.set()
+    await asyncio.gather(*senders)
+    await asyncio.gather(*(client.settle(settings.SHARD_HANDOFF_TIMEOUT * 3) for client in clients))
+
+    # Every live session and queued edit row goes to the database
+    await edit_queue.flush()
+    for worker in workers:
+        for session in worker.router.sessions.all():
+            if session.moved_to is None:
+                await worker.router.sessions.flush(session)
+
+    def contents():
+        return dict(Document.objects.filter(id__in=[room.id for room in rooms]).values_list('id', 'content'))
+
+    stored = await sync_to_async(contents)()
+    failures = []
+    rings = {frozenset(worker.router.ring.workers) for worker in workers}
+    if len(rings) != 1:
+        failures.append(f'workers disagree on the ring: {rings}')
+
+    acked = {}
+    for client in clients:
+        for marker, version in client.acked.items():
+            acked[(client.room.id, marker)] = version
+    lost_acked = 0
+    for room in rooms:
+        owner = next(worker for worker in workers if worker.router.worker_id == workers[0].router.owner(room.id))
+        session = owner.router.sessions.get(room.id)
+        text = session.snapshot()[0] if session is not None else stored[room.id]
+        if text != stored[room.id]:
+            failures.append(f'room {room.id}: live text differs from the database')
+        if not text.endswith(SEED[LOCKED:]):
+            failures.append(f'room {room.id}: seed text was edited')
+        markers = [match.group(0) for match in MARKER.finditer(text)]
+        if ''.join(markers) + SEED != text:
+            failures.append(f'room {room.id}: a marker was split or mangled')
+        if len(markers) != len(set(markers)):
+            failures.append(f'room {room.id}: a marker was applied twice')
+        versions = [acked.get((room.id, marker)) for marker in markers]
+        known = [version for version in versions if version is not None]
+        if known != sorted(known, reverse=True):
+            failures.append(f'room {room.id}: markers are out of version order')
+        present = set(markers)
+        missing = [
+            marker for (room_id, marker) in acked
+            if room_id == room.id and marker not in present
+        ]
+        if missing and (crashed is None or room.id not in owned):
+            failures.append(f'room {room.id}: {len(missing)} acked edits are missing')
+        lost_acked += len(missing)
+
+        holder = holders[rooms.index(room)]
+        held = [lock for lock in session.locks.locks if lock.section == holder.section] if session is not None else []
+        if session is None or not held:
+            if crashed is None or room.id not in owned:
+                failures.append(f'room {room.id}: section lock was lost')
+        elif MARKER.sub('', text[held[0].start:held[0].end]) != SEED[:LOCKED]:
+            # The holder's own inserts at the lock's start join it
+            failures.append(f'room {room.id}: locked text changed')
+
+    sent = sum(client.sequence for client in clients)
+    report = {
+        'phases': phases,
+        'edits_sent': sent,
+        'edits_acked': sum(len(client.acked) for client in clients),
+        'edits_unacked': sum(client.lost for client in clients),
+        'acked_edits_lost_in_crash': lost_acked,
+        'rooms_on_crashed_worker': len(owned) if crashed is not None else 0,
+        'resyncs': sum(client.resyncs for client in clients),
+        'edits_rejected': sum(client.rejected for client in clients),
+        'handoffs': shard_handoffs.labels().value,
+        'forwards': {kind[0]: child.value for kind, child in shard_forwards.children.items()},
+        'failures': len(failures),
+    }
+    if not args.crash and report['edits_unacked']:
+        failures.append(f"{report['edits_unacked']} edits were never acked without any crash")
+    return report, failures
+
+
+if __name__ == '__main__':
+    main()
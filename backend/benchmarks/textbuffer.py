@@ -0,0 +1,80 @@
+"""Micro-benchmark: TextBuffer edits vs. the old str-slicing approach
+
+Usage (from backend/):
+    python -m benchmarks.textbuffer [--sizes 10000 100000 1000000] [--ops 2000]
+"""
+import argparse
+import random
+import string
+import time
+
+from api.textbuffer import TextBuffer
+
+
+def make_ops(size, count, seed):
+    """Typing-like workload: mostly 1-char inserts/deletes around a moving cursor"""
+    rng = random.Random(seed)
+    ops = []
+    length = size
+    cursor = rng.randint(0, size)
+    for _ in range(count):
+        if rng.random() < 0.05:
+            cursor = rng.randint(0, length)
+        if rng.random() < 0.8 or length == 0:
+            ops.append(('insert', cursor, rng.choice(string.ascii_letters)))
+            length += 1
+            cursor += 1
+        else:
+            cursor = max(0, cursor - 1)
+            ops.append(('delete', cursor, ''))
+            length -= 1
+    return ops
+
+
+def run_slicing(text, ops):
+    for operation, position, content in ops:
+        if operation == 'insert':
+            text = text[:position] + content + text[position:]
+        else:
+            text = text[:position] + text[position + 1:]
+    return text
+
+
+def run_buffer(text, ops):
+    buffer = TextBuffer(text)
+    for operation, position, content in ops:
+        if operation == 'insert':
+            buffer.insert(position, content)
+        else:
+            buffer.delete(position, 1)
+    return str(buffer)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000, 4_000_000])
+    parser.add_argument('--ops', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f'{"doc size":>10} {"ops":>6} {"slicing us/op":>14} {"buffer us/op":>13} {"speedup":>8}')
+    for size in args.sizes:
+        text = ''.join(random.Random(args.seed).choices(string.ascii_letters + ' \n', k=size))
+        ops = make_ops(size, args.ops, args.seed)
+        expected, slicing = timed(run_slicing, text, ops)
+        actual, buffered = timed(run_buffer, text, ops)
+        assert actual == expected, 'TextBuffer diverged from the slicing reference'
+        print(
+            f'{size:>10} {args.ops:>6} {slicing / args.ops * 1e6:>14.2f} '
+            f'{buffered / args.ops * 1e6:>13.2f} {slicing / buffered:>7.1f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
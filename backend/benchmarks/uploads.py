@@ -0,0 +1,157 @@
+"""Attachment upload: spooled then copied serially vs. in parallel parts
+
+Usage (from backend/):
+    python -m benchmarks.uploads [--sizes 128 512] [--latency-ms 20] [--bandwidth 40]
+
+Feeds a generated multipart/form-data body through Django's
+MultiPartParser and into LocalUploadStorage (in a temporary directory):
+
+  buffered   Django's default handlers spool the file to a temp file, which
+             is then sent part by part, one at a time (what a single
+             upload stream does)
+  job        upload_file spools the file to a temp file, and its upload
+             job sends it through ParallelUpload, UPLOAD_CONCURRENCY
+             parts at a time
+
+Each part transfer is throttled by --latency-ms plus --bandwidth MB/s per
+connection to model S3 over a network; pass 0 for raw disk speed. Every
+run happens in a fresh subprocess so peak RSS is per run.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.django_setup import setup
+
+
+BOUNDARY = 'collabspace-benchmark-boundary-7f3a9c'
+MB = 1024 * 1024
+
+
+class MultipartBody:
+    """File-like multipart body generated on the fly (never held in memory)"""
+
+    def __init__(self, size):
+        block = os.urandom(MB)
+        self.head = (
+            f'--{BOUNDARY}\r\n'
+            'Content-Disposition: form-data; name="file"; filename="large.bin"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode()
+        self.tail = f'\r\n--{BOUNDARY}--\r\n'.encode()
+        self.block = block
+        self.size = size
+        self.length = len(self.head) + size + len(self.tail)
+        self.position = 0
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.length - self.position
+        out = bytearray()
+        while n > 0 and self.position < self.length:
+            offset = self.position
+            if offset < len(self.head):
+                chunk = self.head[offset:offset + n]
+            elif offset < len(self.head) + self.size:
+                start = (offset - len(self.head)) % MB
+                chunk = self.block[start:start + min(n, len(self.head) + self.size - offset)]
+            else:
+                start = offset - len(self.head) - self.size
+                chunk = self.tail[start:start + n]
+            out += chunk
+            self.position += len(chunk)
+            n -= len(chunk)
+        return bytes(out)
+
+
+def run(mode, size, latency, bandwidth):
+    setup()
+    from django.conf import settings
+    from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+    from django.http.multipartparser import MultiPartParser
+
+    from api.storage import LocalUploadStorage, ParallelUpload
+
+    class NetworkStorage(LocalUploadStorage):
+        def upload_part(self, key, upload_id, number, data):
+            time.sleep(latency + (len(data) / MB / bandwidth if bandwidth else 0))
+            return super().upload_part(key, upload_id, number, data)
+
+    with tempfile.TemporaryDirectory() as root:
+        storage = NetworkStorage(root)
+        body = MultipartBody(size)
+        meta = {
+            'CONTENT_TYPE': f'multipart/form-data; boundary={BOUNDARY}',
+            'CONTENT_LENGTH': str(body.length),
+        }
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        handlers = [MemoryFileUploadHandler(), TemporaryFileUploadHandler()]
+        _, files = MultiPartParser(meta, body, handlers, 'utf-8').parse()
+        spooled = files['file']
+        spooled.seek(0)
+        if mode == 'job':
+            # What UploadJobQueue.run does with the spooled file
+            upload = ParallelUpload('bench/large.bin', storage)
+            while True:
+                chunk = spooled.read(settings.UPLOAD_PART_SIZE)
+                if not chunk:
+                    break
+                upload.write(chunk)
+            upload.complete()
+        else:
+            upload_id = storage.begin('bench/large.bin')
+            number = 1
+            while True:
+                part = spooled.read(settings.UPLOAD_PART_SIZE)
+                if not part:
+                    break
+                storage.upload_part('bench/large.bin', upload_id, number, part)
+                number += 1
+            storage.complete('bench/large.bin', upload_id, [])
+        spooled.close()
+        elapsed = time.perf_counter() - start
+        assert spooled.size == size
+        assert os.path.getsize(os.path.join(root, 'bench', 'large.bin')) == size
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'seconds': elapsed,
+        'peak_rss_mb': peak / 1024,
+        'added_rss_mb': (peak - baseline) / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[128, 512], help='File sizes in MB')
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--bandwidth', type=float, default=40, help='MB/s per connection, 0 for unthrottled')
+    parser.add_argument('--run', choices=['buffered', 'job'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run, args.sizes[0] * MB, args.latency_ms / 1000, args.bandwidth)
+        return
+
+    print(f'{"size MB":>8} {"mode":>10} {"seconds":>8} {"MB/s":>8} {"peak RSS MB":>12} {"added RSS MB":>13}')
+    for size in args.sizes:
+        for mode in ('buffered', 'job'):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.uploads', '--run', mode, '--sizes', str(size),
+                 '--latency-ms', str(args.latency_ms), '--bandwidth', str(args.bandwidth)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f'{size:>8} {mode:>10} {result["seconds"]:>8.2f} {size / result["seconds"]:>8.1f} '
+                f'{result["peak_rss_mb"]:>12.1f} {result["added_rss_mb"]:>13.1f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""DocumentVersion storage: full snapshots vs. keyframes + deltas
+
+Usage (from backend/):
+    python -m benchmarks.versions [--size 200000] [--versions 200] [--edits 20]
+
+Writes the same edit history twice through api.versioning (keyframe
+interval 1, i.e. the old full-snapshot behaviour, and the configured
+interval), then reports bytes stored and reconstruction latency.
+"""
+import argparse
+import json
+import random
+import string
+import time
+
+from benchmarks.django_setup import setup
+
+
+def evolve(rng, text, edits):
+    """Apply a burst of small typing-style edits"""
+    for _ in range(edits):
+        position = rng.randint(0, len(text))
+        if rng.random() < 0.7 or not text:
+            text = text[:position] + ''.join(rng.choices(string.ascii_letters + ' \n', k=rng.randint(1, 40))) + text[position:]
+        else:
+            text = text[:position] + text[position + rng.randint(1, 40):]
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=200_000)
+    parser.add_argument('--versions', type=int, default=200)
+    parser.add_argument('--edits', type=int, default=20, help='Edits between consecutive versions')
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext, override_settings
+
+    from api.models import Document, DocumentVersion
+    from api.versioning import create_version, reconstruct
+
+    user = User.objects.create_user('bench', 'bench@example.com', 'bench')
+    rng = random.Random(args.seed)
+    history = [''.join(rng.choices(string.ascii_letters + ' \n', k=args.size))]
+    for _ in range(args.versions - 1):
+        history.append(evolve(rng, history[-1], args.edits))
+
+    interval = settings.DOCUMENT_VERSION_KEYFRAME_INTERVAL
+    print(f'{"keyframe every":>14} {"stored MB":>10} {"write ms/ver":>13} {"read p50 ms":>12} {"read max ms":>12} {"queries/read":>13}')
+    for keyframe_interval in (1, interval):
+        document = Document.objects.create(title=f'k{keyframe_interval}', owner=user)
+        with override_settings(DOCUMENT_VERSION_KEYFRAME_INTERVAL=keyframe_interval):
+            start = time.perf_counter()
+            for number, content in enumerate(history, start=1):
+                create_version(document, content, number, user)
+            write = (time.perf_counter() - start) / len(history)
+
+        rows = list(DocumentVersion.objects.filter(document=document))
+        stored = sum(len(row.content) + (len(json.dumps(row.delta)) if row.delta is not None else 0) for row in rows)
+
+        timings = []
+        queries = 0
+        for row in rows:
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                content = reconstruct(row)
+                timings.append(time.perf_counter() - start)
+            queries = max(queries, len(captured))
+            assert content == history[row.version_number - 1], f'version {row.version_number} did not round-trip'
+        timings.sort()
+        print(
+            f'{keyframe_interval:>14} {stored / 1e6:>10.2f} {write * 1e3:>13.2f} '
+            f'{timings[len(timings) // 2] * 1e3:>12.2f} {timings[-1] * 1e3:>12.2f} {queries:>13}'
+        )
+
+
+if __name__ == '__main__':
+    main()
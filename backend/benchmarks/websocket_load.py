@@ -0,0 +1,407 @@
+"""WebSocket load test: many clients editing, moving cursors and locking
+
+Usage (from backend/):
+    python -m benchmarks.websocket_load [--rooms 10] [--clients 20] [--dashboards 50]
+        [--duration 10] [--rate 0.5] [--mix 60 35 5] [--output results.json]
+
+Drives DocumentConsumer and DashboardConsumer in-process through the real
+JWT middleware and URL router with channels' WebsocketCommunicator, the
+in-memory channel layer and SQLite. Every document client sends a Poisson
+stream of messages (--rate per second) split between edits, cursor moves
+and lock toggles by --mix; a creator posts a document through
+DocumentViewSet every --create-interval seconds so dashboard sockets get
+document_created events.
+
+Each edit inserts a unique marker, so its delivery to every other client
+in the room is matched back to the moment it was sent; the same goes for
+lock sections and created document titles. Locks cover LOCK_LENGTH
+characters of the seed content, so some are denied because another
+client holds an overlapping range; lock_denied counts those replies. The report is JSON on stdout
+(or --output): throughput, p50/p95/p99 send-to-delivery latency per event
+type, and database queries per phase and per applied edit (the load
+phase includes the creator's requests). With --max-p99-ms the script
+exits non-zero when edit p99 latency exceeds it.
+
+Clients and server share one process and one core, so the numbers are a
+baseline to compare changes against rather than a capacity figure. If
+edits_applied_per_second falls well short of the edits sent, or
+edits_undelivered is non-zero, the run is saturated and latency is
+mostly queueing; lower --rate or --clients.
+
+Sync ORM calls run on a separate thread from the event loop, so the
+database is a temporary SQLite file unless BENCHMARK_DB names one.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.django_setup import setup
+
+LOCK_LENGTH = 10
+
+
+class QueryCounter:
+    """Execute wrapper that counts queries and their time on every connection"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.queries += 1
+                self.seconds += elapsed
+
+    def snapshot(self):
+        with self.lock:
+            return self.queries, self.seconds
+
+
+def percentiles(samples):
+    """p50/p95/p99/max in milliseconds (nearest rank)"""
+    if not samples:
+        return {'count': 0, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    samples = sorted(samples)
+
+    def rank(p):
+        return samples[min(len(samples) - 1, max(0, int(round(p / 100 * len(samples))) - 1))] * 1e3
+
+    return {
+        'count': len(samples),
+        'p50': rank(50),
+        'p95': rank(95),
+        'p99': rank(99),
+        'max': samples[-1] * 1e3,
+    }
+
+
+class Stats:
+    def __init__(self):
+        self.sent_at = {}
+        self.latency = {'edit': [], 'lock': [], 'lock_denied': [], 'document_created': []}
+        self.sent = {'edit': 0, 'cursor': 0, 'lock': 0, 'document_created': 0}
+        self.delivered = {}
+        self.edits_applied = set()
+        self.resyncs = 0
+        self.errors = 0
+
+    def mark(self, kind, key):
+        self.sent[kind] += 1
+        self.sent_at[key] = time.perf_counter()
+
+    def received(self, kind, key=None):
+        self.delivered[kind] = self.delivered.get(kind, 0) + 1
+        if key is not None and key in self.sent_at:
+            self.latency[kind].append(time.perf_counter() - self.sent_at[key])
+            if kind == 'edit':
+                self.edits_applied.add(key)
+
+
+class DocumentClient:
+    def __init__(self, index, communicator, version, length):
+        self.index = index
+        self.communicator = communicator
+        self.version = version
+        self.length = length
+        self.sequence = 0
+        self.locked = None
+        self.joined = False
+
+    async def read(self, stats):
+        while True:
+            message = await self.communicator.receive_output(timeout=3600)
+            if message['type'] != 'websocket.send':
+                return
+            data = json.loads(message['text'])
+            kind = data['type']
+            if kind == 'edit':
+                self.version = max(self.version, data['version'])
+                stats.received('edit', data['content'])
+            elif kind == 'ack':
+                self.version = max(self.version, data['version'])
+                stats.received('ack')
+            elif kind == 'resync':
+                self.version = data['version']
+                if self.joined:
+                    stats.resyncs += 1
+                    stats.received('resync')
+                # The first is the live state every socket gets on join
+                self.joined = True
+            elif kind == 'lock':
+                stats.received('lock', data['section'])
+            elif kind == 'lock_denied':
+                # Someone else holds an overlapping range; try again later
+                if self.locked == data['section']:
+                    self.locked = None
+                stats.received('lock_denied', data['section'])
+            else:
+                stats.received(kind)
+
+    async def send(self, kind, stats):
+        self.sequence += 1
+        key = f'<{self.index}.{self.sequence}>'
+        if kind == 'edit':
+            stats.mark('edit', key)
+            payload = {
+                'type': 'edit',
+                'operation': 'insert',
+                # The seed content only grows, so any offset within it is valid
+                'position': random.randint(0, self.length),
+                'content': key,
+                'version': self.version
+            }
+        elif kind == 'cursor':
+            stats.sent['cursor'] += 1
+            payload = {'type': 'cursor', 'position': random.randint(0, self.length)}
+        elif self.locked is None:
+            stats.mark('lock', key)
+            self.locked = key
+            payload = {
+                'type': 'lock',
+                'locked': True,
+                'section': key,
+                'position': random.randint(0, max(0, self.length - LOCK_LENGTH)),
+                'length': LOCK_LENGTH,
+                'version': self.version
+            }
+        else:
+            stats.mark('lock', key)
+            payload = {'type': 'lock', 'locked': False, 'section': key}
+            self.locked = None
+        await self.communicator.send_to(text_data=json.dumps(payload))
+
+    async def run(self, stats, rate, mix, stop):
+        kinds = ('edit', 'cursor', 'lock')
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), random.expovariate(rate))
+                return
+            except asyncio.TimeoutError:
+                pass
+            await self.send(random.choices(kinds, mix)[0], stats)
+
+
+async def read_dashboard(communicator, stats):
+    while True:
+        message = await communicator.receive_output(timeout=3600)
+        if message['type'] != 'websocket.send':
+            return
+        data = json.loads(message['text'])
+        stats.received(data['type'], data.get('title'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=10, help='Documents being edited')
+    parser.add_argument('--clients', type=int, default=20, help='Document sockets per room')
+    parser.add_argument('--dashboards', type=int, default=50, help='Dashboard sockets')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of steady load')
+    parser.add_argument('--rate', type=float, default=0.5, help='Messages per second per document socket')
+    parser.add_argument('--mix', type=float, nargs=3, default=[60, 35, 5],
+                        metavar=('EDIT', 'CURSOR', 'LOCK'), help='Relative share of each message type')
+    parser.add_argument('--create-interval', type=float, default=0.5,
+                        help='Seconds between documents created for the dashboards (0 disables)')
+    parser.add_argument('--content', type=int, default=2000, help='Characters of seed content per document')
+    parser.add_argument('--seed', type=int, default=20)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--max-p99-ms', type=float, help='Exit non-zero if edit p99 latency is above this')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    database = None
+    if not os.getenv('BENCHMARK_DB'):
+        database = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False).name
+        os.environ['BENCHMARK_DB'] = database
+    try:
+        # Consumers print as sockets come and go; keep stdout for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            report = asyncio.run(run(args))
+    finally:
+        if database is not None:
+            os.remove(database)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    p99 = report['latency_ms']['edit']['p99']
+    if args.max_p99_ms is not None and (p99 is None or p99 > args.max_p99_ms):
+        print(f'edit p99 {p99} ms is above {args.max_p99_ms} ms', file=sys.stderr)
+        sys.exit(1)
+
+
+async def run(args):
+    from asgiref.sync import sync_to_async
+
+    await sync_to_async(setup)()
+    from channels.routing import URLRouter
+    from channels.testing import WebsocketCommunicator
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.db.backends.signals import connection_created
+    from rest_framework.test import APIRequestFactory, force_authenticate
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from api.middleware import JWTAuthMiddleware
+    from api.models import Document, UserProfile
+    from api.routing import websocket_urlpatterns
+    from api.views import DocumentViewSet
+
+    counter = QueryCounter()
+
+    def install(sender, connection, **kwargs):
+        # database_sync_to_async reconnects per call on the same wrapper
+        if counter not in connection.execute_wrappers:
+            connection.execute_wrappers.append(counter)
+
+    def seed():
+        users = User.objects.bulk_create(
+            User(username=f'load{index}', email=f'load{index}@example.com')
+            for index in range(max(args.rooms * args.clients, args.dashboards, 1))
+        )
+        UserProfile.objects.bulk_create(UserProfile(user=user, role='editor') for user in users)
+        documents = Document.objects.bulk_create(
+            Document(title=f'load {index}', content='x' * args.content, owner=users[0])
+            for index in range(args.rooms)
+        )
+        # Counting starts after seeding, on this connection and any opened later
+        install(None, connection)
+        connection_created.connect(install)
+        return users, documents
+
+    users, documents = await sync_to_async(seed)()
+    tokens = [str(AccessToken.for_user(user)) for user in users]
+    application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+    factory = APIRequestFactory()
+    create = DocumentViewSet.as_view({'post': 'create'})
+    stats = Stats()
+    phases = {}
+
+    def phase(name, start, queries_before):
+        queries, seconds = counter.snapshot()
+        phases[name] = {
+            'seconds': time.perf_counter() - start,
+            'queries': queries - queries_before[0],
+            'query_seconds': seconds - queries_before[1],
+        }
+        return counter.snapshot()
+
+    def create_document(title):
+        request = factory.post('/api/documents/', {'title': title, 'content': ''}, format='json')
+        force_authenticate(request, user=users[0])
+        return create(request).status_code
+
+    # Connect
+    start, before = time.perf_counter(), counter.snapshot()
+    clients = []
+    for room, document in enumerate(documents):
+        for slot in range(args.clients):
+            index = room * args.clients + slot
+            communicator = WebsocketCommunicator(
+                application, f'/ws/document/{document.id}/?token={tokens[index]}'
+            )
+            connected, _ = await communicator.connect()
+            assert connected, f'document socket {index} was refused'
+            clients.append(DocumentClient(index, communicator, 0, args.content))
+    dashboards = []
+    for index in range(args.dashboards):
+        communicator = WebsocketCommunicator(application, f'/ws/documents/?token={tokens[index]}')
+        connected, _ = await communicator.connect()
+        assert connected, f'dashboard socket {index} was refused'
+        dashboards.append(communicator)
+    readers = [asyncio.ensure_future(client.read(stats)) for client in clients]
+    readers += [asyncio.ensure_future(read_dashboard(communicator, stats)) for communicator in dashboards]
+    await asyncio.sleep(0.5)
+    before = phase('connect', start, before)
+
+    # Steady load
+    stop = asyncio.Event()
+
+    async def creator():
+        sequence = 0
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), args.create_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            sequence += 1
+            title = f'<created.{sequence}>'
+            stats.mark('document_created', title)
+            if await sync_to_async(create_document)(title) != 201:
+                stats.errors += 1
+
+    start = time.perf_counter()
+    senders = [asyncio.ensure_future(client.run(stats, args.rate, args.mix, stop)) for client in clients]
+    if args.create_interval and args.dashboards:
+        senders.append(asyncio.ensure_future(creator()))
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*senders)
+    load_seconds = time.perf_counter() - start
+    # Let in-flight frames land before reading the counters
+    await asyncio.sleep(1)
+    before = phase('load', start, before)
+
+    # Disconnect (flushes sessions and queued edit rows)
+    start = time.perf_counter()
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    for client in clients:
+        await client.communicator.disconnect()
+    for communicator in dashboards:
+        await communicator.disconnect()
+    phase('disconnect', start, before)
+
+    edits_applied = len(stats.edits_applied)
+    delivered = sum(stats.delivered.values())
+    return {
+        'config': {
+            'rooms': args.rooms,
+            'clients_per_room': args.clients,
+            'document_sockets': len(clients),
+            'dashboard_sockets': len(dashboards),
+            'duration': args.duration,
+            'rate': args.rate,
+            'mix': dict(zip(('edit', 'cursor', 'lock'), args.mix)),
+            'create_interval': args.create_interval,
+        },
+        'throughput': {
+            'messages_sent_per_second': sum(stats.sent.values()) / load_seconds,
+            'edits_applied_per_second': edits_applied / load_seconds,
+            'edits_undelivered': stats.sent['edit'] - edits_applied,
+            'frames_delivered_per_second': delivered / load_seconds,
+        },
+        'sent': stats.sent,
+        'delivered': stats.delivered,
+        'latency_ms': {kind: percentiles(samples) for kind, samples in stats.latency.items()},
+        'db': {
+            **phases,
+            'queries_per_applied_edit': (
+                phases['load']['queries'] / edits_applied if edits_applied else None
+            ),
+        },
+        'resyncs': stats.resyncs,
+        'errors': stats.errors,
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""WebSocket wire formats: encode/decode throughput and frame size
+
+Usage (from backend/):
+    python -m benchmarks.wire [--iterations 200000]
+
+Compares stdlib json, orjson (if installed) and the MessagePack
+short-field protocol on typical edit and cursor frames.
+"""
+import argparse
+import json
+import time
+
+from api import wire
+
+
+FRAMES = {
+    'edit (client->server)': {
+        'type': 'edit', 'operation': 'insert', 'position': 10423, 'content': 'e', 'version': 5812,
+    },
+    'edit (server->client)': {
+        'type': 'edit', 'user': 'alice', 'operation': 'insert', 'position': 10423, 'length': 0,
+        'content': 'e', 'timestamp': 1718000000.123456, 'version': 5813,
+    },
+    'cursor (client->server)': {'type': 'cursor', 'position': 10424},
+    'cursors (20 users)': {
+        'type': 'cursors',
+        'cursors': [{'user': f'user{n}', 'position': 1000 + n * 37} for n in range(20)],
+    },
+}
+
+
+def codecs():
+    yield 'json', lambda p: json.dumps(p), json.loads
+    if wire.orjson is not None:
+        yield 'orjson', wire.orjson.dumps, wire.orjson.loads
+    if wire.msgpack is not None:
+        yield 'msgpack', wire.pack, wire.unpack
+
+
+def rate(func, arg, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return iterations / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200_000)
+    args = parser.parse_args()
+
+    print(f'{"frame":<24} {"codec":<8} {"bytes":>6} {"encode/s":>12} {"decode/s":>12}')
+    for label, payload in FRAMES.items():
+        for name, encode, decode in codecs():
+            encoded = encode(payload)
+            assert decode(encoded) == payload, f'{name} did not round-trip {label}'
+            print(
+                f'{label:<24} {name:<8} {len(encoded):>6} '
+                f'{rate(encode, payload, args.iterations):>12,.0f} '
+                f'{rate(decode, encoded, args.iterations):>12,.0f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ django_asgi_app = get_asgi_application()
 
 from api.routing import websocket_urlpatterns
 from api.middleware import JWTAuthMiddleware
+from api.sharding import lifespan
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -18,4 +19,5 @@ application = ProtocolTypeRouter({
             URLRouter(websocket_urlpatterns)
         )
     ),
+    "lifespan": lifespan,
 })
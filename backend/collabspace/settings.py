@@ -29,6 +29,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -82,6 +83,92 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Real-time document sessions and write-behind persistence of live edits
+DOCUMENT_SESSION_FLUSH_INTERVAL = float(os.getenv('DOCUMENT_SESSION_FLUSH_INTERVAL', '2.0'))
+DOCUMENT_SESSION_FLUSH_OPS = int(os.getenv('DOCUMENT_SESSION_FLUSH_OPS', '200'))
+DOCUMENT_SESSION_OP_LOG_SIZE = int(os.getenv('DOCUMENT_SESSION_OP_LOG_SIZE', '1000'))
+EDIT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv('EDIT_WRITE_BEHIND_BATCH_SIZE', '500'))
+EDIT_WRITE_BEHIND_INTERVAL = float(os.getenv('EDIT_WRITE_BEHIND_INTERVAL', '1.0'))
+
+# `manage.py compact_edits` folds DocumentEdit rows older than
+# EDIT_RETENTION_DAYS into a DocumentVersion keyframe and deletes them,
+# EDIT_COMPACTION_BATCH_SIZE rows per transaction
+EDIT_RETENTION_DAYS = float(os.getenv('EDIT_RETENTION_DAYS', '7'))
+EDIT_COMPACTION_BATCH_SIZE = int(os.getenv('EDIT_COMPACTION_BATCH_SIZE', '1000'))
+
+# Cursor moves are coalesced per room and broadcast once per tick
+CURSOR_TICK_INTERVAL_MS = int(os.getenv('CURSOR_TICK_INTERVAL_MS', '50'))
+CURSOR_TICK_IDLE_TICKS = int(os.getenv('CURSOR_TICK_IDLE_TICKS', '40'))
+
+# Room presence: clients heartbeat every PRESENCE_HEARTBEAT_INTERVAL seconds
+# and are dropped after PRESENCE_TTL without one. Use the 'redis' backend
+# when several workers serve the same rooms.
+PRESENCE_BACKEND = os.getenv('PRESENCE_BACKEND', 'memory')
+PRESENCE_REDIS_URL = os.getenv('PRESENCE_REDIS_URL', f"redis://{os.getenv('REDIS_HOST', 'redis')}:6379/1")
+PRESENCE_HEARTBEAT_INTERVAL = float(os.getenv('PRESENCE_HEARTBEAT_INTERVAL', '15'))
+PRESENCE_TTL = float(os.getenv('PRESENCE_TTL', '45'))
+PRESENCE_SWEEP_INTERVAL = float(os.getenv('PRESENCE_SWEEP_INTERVAL', '5'))
+
+# Section locks are leased; clients re-send a lock to renew it before
+# LOCK_LEASE_SECONDS run out
+LOCK_LEASE_SECONDS = float(os.getenv('LOCK_LEASE_SECONDS', '60'))
+
+# Document-affinity sharding. With SHARD_BACKEND = 'redis' every worker
+# heartbeats into a shared registry, each document's live session lives on
+# the one worker consistent hashing picks for it, and the others forward
+# edits and locks there through the channel layer. 'none' keeps every
+# session in the worker its socket reached (a single worker); 'memory'
+# shares the registry between routers in one process (benchmarks).
+# Sockets and REST calls give up (close / 503) if the ring can't be joined
+# within SHARD_START_TIMEOUT. Handing sessions off on shutdown needs an
+# ASGI server that sends lifespan events (uvicorn); under daphne a stopped
+# worker's rooms are reloaded from the database after SHARD_WORKER_TTL.
+SHARD_BACKEND = os.getenv('SHARD_BACKEND', 'none')
+SHARD_REDIS_URL = os.getenv('SHARD_REDIS_URL', f"redis://{os.getenv('REDIS_HOST', 'redis')}:6379/2")
+SHARD_WORKER_ID = os.getenv('SHARD_WORKER_ID', '')
+SHARD_VIRTUAL_NODES = int(os.getenv('SHARD_VIRTUAL_NODES', '64'))
+SHARD_HEARTBEAT_INTERVAL = float(os.getenv('SHARD_HEARTBEAT_INTERVAL', '2'))
+SHARD_WORKER_TTL = float(os.getenv('SHARD_WORKER_TTL', '6'))
+SHARD_HANDOFF_TIMEOUT = float(os.getenv('SHARD_HANDOFF_TIMEOUT', '5'))
+SHARD_CALL_TIMEOUT = float(os.getenv('SHARD_CALL_TIMEOUT', '2'))
+SHARD_START_TIMEOUT = float(os.getenv('SHARD_START_TIMEOUT', '5'))
+
+# DocumentVersion history is stored as deltas with a full keyframe every N versions
+DOCUMENT_VERSION_KEYFRAME_INTERVAL = int(os.getenv('DOCUMENT_VERSION_KEYFRAME_INTERVAL', '20'))
+
+# Per-process cache of (user, document) access decisions
+ACCESS_CACHE_SIZE = int(os.getenv('ACCESS_CACHE_SIZE', '10000'))
+ACCESS_CACHE_TTL = float(os.getenv('ACCESS_CACHE_TTL', '30'))
+
+# Per-process cache of users authenticated on WebSocket connect
+WS_USER_CACHE_SIZE = int(os.getenv('WS_USER_CACHE_SIZE', '5000'))
+WS_USER_CACHE_TTL = float(os.getenv('WS_USER_CACHE_TTL', '60'))
+
+# Document search: 'postgres' (tsvector + GIN index), 'fallback' (substring
+# scan, for SQLite) or 'auto' to pick by database vendor
+SEARCH_ENGINE = os.getenv('SEARCH_ENGINE', 'auto')
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'english')
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', '50'))
+
+# Dashboard events go to each recipient group, this many group_sends at a time
+DASHBOARD_FANOUT_BATCH_SIZE = int(os.getenv('DASHBOARD_FANOUT_BATCH_SIZE', '100'))
+
+# ActivityLog rows are queued and bulk-inserted by a background thread.
+# ACTIVITY_LOG_OVERFLOW is 'block' (wait up to ACTIVITY_LOG_BLOCK_TIMEOUT for
+# room, then drop) or 'drop'; ACTIVITY_LOG_SYNC writes inline, e.g. for tests.
+ACTIVITY_LOG_SYNC = os.getenv('ACTIVITY_LOG_SYNC', 'False') == 'True'
+ACTIVITY_LOG_QUEUE_SIZE = int(os.getenv('ACTIVITY_LOG_QUEUE_SIZE', '10000'))
+ACTIVITY_LOG_BATCH_SIZE = int(os.getenv('ACTIVITY_LOG_BATCH_SIZE', '200'))
+ACTIVITY_LOG_INTERVAL = float(os.getenv('ACTIVITY_LOG_INTERVAL', '1.0'))
+ACTIVITY_LOG_OVERFLOW = os.getenv('ACTIVITY_LOG_OVERFLOW', 'block')
+ACTIVITY_LOG_BLOCK_TIMEOUT = float(os.getenv('ACTIVITY_LOG_BLOCK_TIMEOUT', '0.5'))
+
+# Hot-path metrics (api.instrumentation). /api/metrics/prometheus/ serves them
+# to scrapers that send "Authorization: Bearer <METRICS_TOKEN>"; it is off
+# while METRICS_TOKEN is unset.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -133,6 +220,22 @@ AWS_S3_FILE_OVERWRITE = False
 AWS_DEFAULT_ACL = None
 AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
 
+# Document attachments stream to UPLOAD_STORAGE ('s3', or 'local' under
+# UPLOAD_LOCAL_ROOT) as UPLOAD_PART_SIZE multipart parts, at most
+# UPLOAD_CONCURRENCY in flight per file, on a pool of UPLOAD_WORKERS threads
+UPLOAD_STORAGE = os.getenv('UPLOAD_STORAGE', 's3')
+UPLOAD_LOCAL_ROOT = os.getenv('UPLOAD_LOCAL_ROOT', str(BASE_DIR / 'media'))
+UPLOAD_PART_SIZE = int(os.getenv('UPLOAD_PART_SIZE', str(8 * 1024 * 1024)))
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', '4'))
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '16'))
+
+# Uploads are spooled to disk by the request and transferred by a pool of
+# UPLOAD_JOB_WORKERS threads; beyond UPLOAD_JOB_QUEUE_SIZE queued or running
+# jobs new uploads are refused. Progress is pushed every UPLOAD_PROGRESS_INTERVAL s.
+UPLOAD_JOB_WORKERS = int(os.getenv('UPLOAD_JOB_WORKERS', '4'))
+UPLOAD_JOB_QUEUE_SIZE = int(os.getenv('UPLOAD_JOB_QUEUE_SIZE', '64'))
+UPLOAD_PROGRESS_INTERVAL = float(os.getenv('UPLOAD_PROGRESS_INTERVAL', '0.5'))
+
 # Use S3 for media files if AWS credentials are set
 if AWS_ACCESS_KEY_ID:
     DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
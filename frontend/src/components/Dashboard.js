@@ -108,7 +108,7 @@ const Dashboard = ({ onSelectDocument }) => {
               <h3>{doc.title}</h3>
               <p className="document-meta">
                 Owner: {doc.owner.username}<br />
-                Collaborators: {doc.collaborators.length}<br />
+                Collaborators: {doc.collaborator_count}<br />
                 Updated: {new Date(doc.updated_at).toLocaleDateString()}
               </p>
               <div className="document-actions">
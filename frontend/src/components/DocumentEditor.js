@@ -1,16 +1,19 @@
-import React, { useState, useEffect, useRef, useContext } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { documentsAPI } from '../services/api';
-import { AuthContext } from '../context/AuthContext';
+import { EditSync } from '../services/ot';
+import { PROTOCOLS, decodeFrame, encodeFrame } from '../services/wire';
 import './DocumentEditor.css';
 
 const DocumentEditor = ({ documentId, onBack }) => {
   const [document, setDocument] = useState(null);
   const [content, setContent] = useState('');
+  const [version, setVersion] = useState(null);
   const [saving, setSaving] = useState(false);
   const [connected, setConnected] = useState(false);
   const [activeUsers, setActiveUsers] = useState([]);
-  const { user } = useContext(AuthContext);
   const wsRef = useRef(null);
+  // Base version, in-flight batch and held-back frames for our edits
+  const syncRef = useRef(null);
 
   useEffect(() => {
     loadDocument();
@@ -27,7 +30,11 @@ const DocumentEditor = ({ documentId, onBack }) => {
     try {
       const response = await documentsAPI.getById(documentId);
       setDocument(response.data);
-      setContent(response.data.content);
+      // The socket's resync on join replaces this with the live body
+      if (syncRef.current?.version == null) {
+        setContent(response.data.content);
+        setVersion(response.data.version);
+      }
     } catch (error) {
       console.error('Failed to load document:', error);
     }
@@ -39,37 +46,53 @@ const DocumentEditor = ({ documentId, onBack }) => {
     const wsUrl = `${WS_URL}/ws/document/${documentId}/?token=${token}`;
 
     console.log('Connecting to:', wsUrl);
-    const ws = new WebSocket(wsUrl);
+    // Prefer the compact MessagePack protocol; the server falls back to JSON
+    const ws = new WebSocket(wsUrl, PROTOCOLS);
+    ws.binaryType = 'arraybuffer';
     wsRef.current = ws;
+    const send = (message) => ws.send(encodeFrame(ws, message));
+    syncRef.current = new EditSync(
+      send,
+      (text, at) => {
+        setContent(text);
+        setVersion(at);
+      }
+    );
 
     ws.onopen = () => {
       console.log('WebSocket OPENED');
       setConnected(true);
+      // Keep our presence alive; the server expires silent members
+      ws.heartbeat = setInterval(() => send({ type: 'heartbeat' }), 15000);
     };
 
     ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+      const data = decodeFrame(event.data);
       console.log('Received:', data);
 
-      if (data.type === 'user_joined') {
+      if (data.type === 'presence') {
+        // Snapshot of who was already here when we joined
+        setActiveUsers(data.users.map(u => u.user));
+      } else if (data.type === 'user_joined') {
         setActiveUsers(prev => [...new Set([...prev, data.user])]);
       } else if (data.type === 'user_left') {
         setActiveUsers(prev => prev.filter(u => u !== data.user));
-      } else if (data.type === 'edit' && data.user !== user?.username) {
-        // Apply remote edits only
-        setContent(current => {
-          if (data.operation === 'insert') {
-            return current.slice(0, data.position) + data.content + current.slice(data.position);
-          } else if (data.operation === 'delete') {
-            return current.slice(0, data.position) + current.slice(data.position + 1);
-          }
-          return current;
-        });
+      } else if (data.type === 'resync') {
+        // Live body and version: on join, after a rejected edit or a REST save
+        syncRef.current.reset(data.content, data.version);
+      } else if (data.type === 'ack') {
+        syncRef.current.ack(data.op_id, data.version);
+      } else if (data.type === 'edit') {
+        // Other sockets' edits (our own are acked, not echoed)
+        syncRef.current.remote([data], data.version);
+      } else if (data.type === 'edits') {
+        syncRef.current.remote(data.ops, data.version);
       }
     };
 
     ws.onclose = () => {
       console.log('WebSocket CLOSED');
+      clearInterval(ws.heartbeat);
       setConnected(false);
     };
 
@@ -80,28 +103,10 @@ const DocumentEditor = ({ documentId, onBack }) => {
 
   const handleChange = (e) => {
     const newContent = e.target.value;
-    const cursorPos = e.target.selectionStart;
-
-    if (newContent.length > content.length && wsRef.current?.readyState === 1) {
-      // Insert
-      const pos = cursorPos - 1;
-      const char = newContent.charAt(pos);
-      wsRef.current.send(JSON.stringify({
-        type: 'edit',
-        operation: 'insert',
-        position: pos,
-        content: char,
-        version: document?.version || 1
-      }));
-    } else if (newContent.length < content.length && wsRef.current?.readyState === 1) {
-      // Delete
-      wsRef.current.send(JSON.stringify({
-        type: 'edit',
-        operation: 'delete',
-        position: cursorPos,
-        content: '',
-        version: document?.version || 1
-      }));
+
+    if (wsRef.current?.readyState === 1) {
+      // Sent as one replace op based on the last version we've applied
+      syncRef.current.edit(newContent);
     }
 
     setContent(newContent);
@@ -154,7 +159,7 @@ const DocumentEditor = ({ documentId, onBack }) => {
       </div>
 
       <div className="editor-footer">
-        <span>Version: {document.version}</span>
+        <span>Version: {version ?? document.version}</span>
         <span>Characters: {content.length}</span>
       </div>
     </div>
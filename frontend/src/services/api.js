@@ -62,7 +62,7 @@ export const authAPI = {
 
 // Documents API
 export const documentsAPI = {
-  getAll: () => api.get('/documents/'),
+  getAll: () => api.get('/documents/', { params: { summary: 1 } }),
   getById: (id) => api.get(`/documents/${id}/`),
   create: (data) => api.post('/documents/', data),
   update: (id, data) => api.patch(`/documents/${id}/`, data),
@@ -80,7 +80,7 @@ export const documentsAPI = {
 
 // Activities API
 export const activitiesAPI = {
-  getAll: () => api.get('/activities/'),
+  getAll: (cursor) => api.get('/activities/', { params: { cursor } }),
 };
 
 export default api;
@@ -0,0 +1,187 @@
+// Client half of the server's operational transform; keep in sync with
+// backend/api/ot.py. An op is { position, length, text }: at `position`
+// remove `length` characters and insert `text`.
+
+const NOOP = { position: 0, length: 0, text: '' };
+
+const isNoop = (op) => !op.length && !op.text;
+
+export const applyOp = (content, op) =>
+  content.slice(0, op.position) + op.text + content.slice(op.position + op.length);
+
+// Rewrite `op` so it applies after `other` (both on the same base);
+// `priority` wins ties for `op`. Same rules as transform() in ot.py.
+export const transform = (op, other, priority = false) => {
+  if (isNoop(op) || isNoop(other)) return op;
+  const delta = other.text.length - other.length;
+  const opEnd = op.position + op.length;
+  const otherEnd = other.position + other.length;
+
+  if (op.position === other.position && !op.length && !other.length) {
+    return priority ? op : { ...op, position: op.position + other.text.length };
+  }
+  if (opEnd <= other.position) return op;
+  if (op.position >= otherEnd) return { ...op, position: op.position + delta };
+
+  let contains = op.position <= other.position && otherEnd <= opEnd;
+  const contained = other.position <= op.position && opEnd <= otherEnd;
+  if (contains && contained) contains = priority;
+  if (contains) return { ...op, length: op.length + delta };
+  if (contained) return NOOP;
+  if (op.position < other.position) return { ...op, length: other.position - op.position };
+  return { position: other.position + other.text.length, length: opEnd - otherEnd, text: op.text };
+};
+
+// The single replace that turns `before` into `after`
+export const diff = (before, after) => {
+  let start = 0;
+  while (start < before.length && start < after.length && before[start] === after[start]) {
+    start++;
+  }
+  let end = 0;
+  while (
+    end < before.length - start &&
+    end < after.length - start &&
+    before[before.length - 1 - end] === after[after.length - 1 - end]
+  ) {
+    end++;
+  }
+  return {
+    position: start,
+    length: before.length - start - end,
+    text: after.slice(start, after.length - end),
+  };
+};
+
+export const toWire = (op) => ({
+  operation: !op.length ? 'insert' : !op.text ? 'delete' : 'replace',
+  position: op.position,
+  length: op.length,
+  content: op.text,
+});
+
+export const fromWire = (op) => ({
+  position: op.position,
+  length: op.operation === 'insert' ? 0 : op.length ?? 1,
+  text: op.content || '',
+});
+
+/*
+ * Keeps one client's text in step with the server's op log.
+ *
+ * At most one batch is in flight; local edits made meanwhile are buffered
+ * and sent, based on the acked version, once it is acked. Server frames
+ * (remote edits and our own acks) are applied strictly in version order,
+ * holding back any that arrive early, and remote ops are transformed past
+ * our unacknowledged ones exactly as the server rebases those against
+ * them. `send(message)` writes to the socket; `onChange(content, version)`
+ * is called whenever either changes.
+ */
+export class EditSync {
+  constructor(send, onChange) {
+    this.send = send;
+    this.onChange = onChange;
+    this.content = '';
+    this.version = null;
+    this.inflight = null;
+    this.buffer = [];
+    this.held = new Map();
+    this.sizes = new Map();
+    this.nextOpId = 1;
+  }
+
+  // Full state from the server (on join, after a rejection or a REST save).
+  // Unacknowledged local edits are dropped; if one of them is applied
+  // after all, its ack asks for a fresh copy.
+  reset(content, version) {
+    this.content = content;
+    this.version = version;
+    this.inflight = null;
+    this.buffer = [];
+    for (const start of this.held.keys()) {
+      if (start < version) this.held.delete(start);
+    }
+    this.onChange(this.content, this.version);
+    this.drain();
+  }
+
+  // The user changed the text to `content`
+  edit(content) {
+    const op = diff(this.content, content);
+    this.content = content;
+    if (isNoop(op) || this.version === null) return;
+    this.buffer.push(op);
+    this.flush();
+  }
+
+  flush() {
+    if (this.inflight || !this.buffer.length) return;
+    this.inflight = { opId: this.nextOpId++, ops: this.buffer };
+    this.buffer = [];
+    this.sizes.set(this.inflight.opId, this.inflight.ops.length);
+    this.send({
+      type: 'edits',
+      op_id: this.inflight.opId,
+      ops: this.inflight.ops.map(toWire),
+      version: this.version,
+    });
+  }
+
+  // Another client's ops, ending at `version`
+  remote(ops, version) {
+    this.hold(version - ops.length, version, () => {
+      for (let op of ops.map(fromWire)) {
+        op = this.pastLocal(op);
+        this.content = applyOp(this.content, op);
+      }
+    });
+  }
+
+  // Our batch `opId` was applied, ending at `version`
+  ack(opId, version) {
+    const size = this.sizes.get(opId);
+    if (size === undefined) return;
+    this.sizes.delete(opId);
+    this.hold(version - size, version, () => {
+      if (this.inflight?.opId === opId) {
+        this.inflight = null;
+      } else {
+        // Dropped by a resync but applied anyway: our text lacks it
+        this.send({ type: 'resync' });
+      }
+    });
+  }
+
+  hold(start, version, apply) {
+    if (this.version !== null && start < this.version) return;
+    this.held.set(start, { version, apply });
+    this.drain();
+  }
+
+  drain() {
+    let changed = false;
+    while (this.version !== null && this.held.has(this.version)) {
+      const frame = this.held.get(this.version);
+      this.held.delete(this.version);
+      frame.apply();
+      this.version = frame.version;
+      changed = true;
+    }
+    if (changed) {
+      this.onChange(this.content, this.version);
+      this.flush();
+    }
+  }
+
+  // Carry a remote op past our unacknowledged ops, and them past it
+  pastLocal(op) {
+    const carry = (ops) => ops.map(local => {
+      const rebased = transform(local, op, false);
+      op = transform(op, local, true);
+      return rebased;
+    });
+    if (this.inflight) this.inflight.ops = carry(this.inflight.ops);
+    this.buffer = carry(this.buffer);
+    return op;
+  }
+}
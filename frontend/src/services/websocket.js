@@ -1,3 +1,7 @@
+import { PROTOCOLS, decodeFrame, encodeFrame } from './wire';
+
+const HEARTBEAT_INTERVAL_MS = 15000;
+
 class WebSocketService {
   constructor() {
     this.ws = null;
@@ -31,16 +35,20 @@ class WebSocketService {
     const wsUrl = `${WS_URL}/ws/document/${documentId}/?token=${token}`;
     
     console.log('Connecting to WebSocket:', wsUrl);
-    this.ws = new WebSocket(wsUrl);
+    // Prefer the compact MessagePack protocol; the server falls back to JSON
+    this.ws = new WebSocket(wsUrl, PROTOCOLS);
+    this.ws.binaryType = 'arraybuffer';
 
     this.ws.onopen = () => {
       console.log('WebSocket connected');
       this.reconnectAttempts = 0;
+      // The server drops members that stop heartbeating (see PRESENCE_TTL)
+      this.heartbeat = setInterval(() => this.send({ type: 'heartbeat' }), HEARTBEAT_INTERVAL_MS);
       this.trigger('connected');
     };
 
     this.ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+      const data = decodeFrame(event.data);
       this.trigger('message', data);
       
       // Trigger specific event types
@@ -51,6 +59,7 @@ class WebSocketService {
 
     this.ws.onclose = () => {
       console.log('WebSocket disconnected');
+      clearInterval(this.heartbeat);
       this.trigger('disconnected');
       this.attemptReconnect();
     };
@@ -81,7 +90,7 @@ class WebSocketService {
 
   send(data) {
     if (this.ws && this.ws.readyState === WebSocket.OPEN) {
-      this.ws.send(JSON.stringify(data));
+      this.ws.send(encodeFrame(this.ws, data));
     } else {
       console.error('WebSocket is not connected');
     }
@@ -117,7 +126,10 @@ class WebSocketService {
     this.listeners = {};
   }
 
-  // Document operations
+  // Document operations. `version` is the last version this client has
+  // applied (from a resync, an ack or a remote edit); the server rebases
+  // the op from there and replies { type: 'ack', version }. See
+  // services/ot.js for a client that keeps that base version right.
   sendEdit(operation, position, content, version) {
     this.send({
       type: 'edit',
@@ -129,6 +141,17 @@ class WebSocketService {
     });
   }
 
+  // Send an ordered batch of ops; the server replies with one
+  // { type: 'ack', op_id, version } and ignores retransmits of op_id
+  sendEdits(ops, version, opId) {
+    this.send({
+      type: 'edits',
+      op_id: opId,
+      ops,
+      version,
+    });
+  }
+
   sendCursorPosition(position) {
     this.send({
       type: 'cursor',
@@ -136,11 +159,18 @@ class WebSocketService {
     });
   }
 
-  sendLock(section, locked) {
+  // Lock (or renew) `length` characters at `position` as of `version`;
+  // the room gets { type: 'lock', locked: true, ..., lease } on success and
+  // this client alone gets { type: 'lock_denied' } if the range is taken.
+  // Edits inside another user's lock come back as 'edit_rejected' + resync.
+  sendLock(section, locked, position, length, version) {
     this.send({
       type: 'lock',
       section,
       locked,
+      position,
+      length,
+      version,
     });
   }
 }
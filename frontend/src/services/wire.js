@@ -0,0 +1,52 @@
+import { encode, decode } from '@msgpack/msgpack';
+
+// Document socket subprotocols (see backend/api/wire.py). Offer both in
+// this order: the server picks MessagePack when it can and JSON otherwise.
+export const JSON_PROTOCOL = 'collabspace.json.v1';
+export const MSGPACK_PROTOCOL = 'collabspace.msgpack.v1';
+export const PROTOCOLS = [MSGPACK_PROTOCOL, JSON_PROTOCOL];
+
+// Short keys used on the MessagePack protocol; keep in sync with
+// backend/api/wire.py
+const FIELD_CODES = {
+  type: 't',
+  user: 'u',
+  user_id: 'i',
+  operation: 'o',
+  position: 'p',
+  length: 'l',
+  content: 'c',
+  timestamp: 'ts',
+  version: 'v',
+  locked: 'k',
+  section: 's',
+  cursors: 'cs',
+  ops: 'os',
+  op_id: 'id',
+  users: 'us',
+};
+const FIELD_NAMES = Object.fromEntries(
+  Object.entries(FIELD_CODES).map(([name, code]) => [code, name])
+);
+
+const rename = (value, names) => {
+  if (Array.isArray(value)) {
+    return value.map(item => rename(item, names));
+  }
+  if (value && typeof value === 'object') {
+    return Object.fromEntries(
+      Object.entries(value).map(([key, item]) => [names[key] || key, rename(item, names)])
+    );
+  }
+  return value;
+};
+
+// Encode a message for `ws` in whichever protocol the server chose
+export const encodeFrame = (ws, message) =>
+  ws.protocol === MSGPACK_PROTOCOL
+    ? encode(rename(message, FIELD_CODES))
+    : JSON.stringify(message);
+
+// Decode a frame: binary ones (binaryType 'arraybuffer') are MessagePack
+export const decodeFrame = (data) =>
+  data instanceof ArrayBuffer ? rename(decode(data), FIELD_NAMES) : JSON.parse(data);